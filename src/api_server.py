@@ -0,0 +1,349 @@
+"""
+読み取り専用の HTTP API（JSON）
+
+Streamlit の画面を開かずに「今週の予定と参加者」を確認するための軽量な API。
+予約データは ReservationStore（変更ログで差分だけ更新するメモリ上のデータ）から返す。
+
+    GET /api/reservations?from=2026-10-01&to=2026-10-31   期間内の予約（to は含む）
+    GET /api/reservations/<id>/participants               予約1件の参加者
+    GET /api/reminders                                    今日表示する抽選リマインダー
+
+いずれも ?group=<グループ名> でグループを指定できる（省略時は default）。
+予約の id は予約のキー（sheets_common.reservation_keys()。例: 2026-10-25_市民コート_1）で、
+他の予約を削除しても変わらない。パスに入れる時は URL エンコードする。
+レスポンスには ETag を付け、If-None-Match が一致すれば 304 を返す。
+Accept-Encoding に gzip があれば圧縮して返す。
+
+認証はないため、既定では 127.0.0.1 だけで待ち受ける（参加者の名前・メモを返すため、
+外部に公開する場合は認証付きのリバースプロキシの後ろに置く）。
+
+使い方:
+    # Streamlit と同じプロセスで動かす（secrets.toml に [api] port = 8502 を設定）
+    streamlit run src/tennis_app.py
+
+    # 単独で動かす
+    python src/api_server.py --port 8502
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import pandas as pd
+
+from change_log import CHANGELOG_SHEET, CHANGELOG_COLUMNS
+from reminders import active_reminder_messages
+from shared_cache import make_reservation_store
+from sheets_common import (
+    DEFAULT_SECRETS_PATH, jst_today, load_secrets, open_worksheet, open_or_create_worksheet, reservation_keys,
+    run_with_retry, safe_int,
+)
+from tenants import DEFAULT_GROUP, BudgetedWorksheet, TenantRegistry, load_group_sheets
+
+# 予約データを Sheets に確認しに行く間隔（秒）。アプリの load_reservations と同じ
+REFRESH_SECONDS = 15
+
+# 抽選期間の設定を読み直す間隔（秒）
+REMINDER_SECONDS = 3600
+
+# 保持するレスポンスの数
+RESPONSE_CACHE_SIZE = 256
+
+# 待ち受けるアドレスの既定値（認証がないため、同じホストからだけ使えるようにする）
+DEFAULT_HOST = "127.0.0.1"
+
+logger = logging.getLogger(__name__)
+
+
+class ApiSource:
+    """
+    1グループ分のデータの取得元
+
+    Args:
+        store: ReservationStore
+        lottery_sheet: lottery_periods シート（なければ None）
+    """
+    def __init__(self, store, lottery_sheet=None):
+        self.store = store
+        self.lottery_sheet = lottery_sheet
+        self.checked_at = 0.0
+        self.reminders_at = None
+        self.lottery_df = pd.DataFrame()
+        self.lock = threading.Lock()
+
+    def rows(self):
+        """
+        Returns:
+            tuple: (ヘッダー, データ行, データのバージョン)
+        """
+        with self.lock:
+            if time.monotonic() - self.checked_at > REFRESH_SECONDS or self.store.version is None:
+                self.store.refresh()
+                self.checked_at = time.monotonic()
+        with self.store.lock:
+            return list(self.store.header), list(self.store.rows), (self.store.version, self.store.loaded_at)
+
+    def reminders(self, today):
+        with self.lock:
+            if self.lottery_sheet is not None and (self.reminders_at is None or time.monotonic() - self.reminders_at > REMINDER_SECONDS):
+                try:
+                    self.lottery_df = pd.DataFrame(run_with_retry(self.lottery_sheet.get_all_records))
+                except Exception:
+                    pass
+                self.reminders_at = time.monotonic()
+            return active_reminder_messages(self.lottery_df, today), (today, self.reminders_at)
+
+
+def _split(value):
+    return [n for n in str(value).split(";") if n]
+
+def _record(header, row, key):
+    r = dict(zip(header, list(row) + [""] * (len(header) - len(row))))
+    return {
+        "id": key,
+        "date": r.get("date", ""),
+        "facility": r.get("facility", ""),
+        "status": r.get("status", ""),
+        "start": f"{safe_int(r.get('start_hour'), 9):02d}:{safe_int(r.get('start_minute')):02d}",
+        "end": f"{safe_int(r.get('end_hour'), 11):02d}:{safe_int(r.get('end_minute')):02d}",
+        "participants": len(_split(r.get("participants", ""))),
+        "consider": len(_split(r.get("consider", ""))),
+        "message": r.get("message", ""),
+    }
+
+def parse_date_param(value):
+    """
+    クエリの日付（YYYY-MM-DD）。省略時は None
+
+    Raises:
+        ValueError: 日付として読めない場合
+    """
+    if value is None or value == "": return None
+    return date.fromisoformat(value)
+
+def _row_date(value):
+    """シート上の日付（アプリと同じく表記ゆれも読む）。読めなければ None"""
+    d = pd.to_datetime(value, errors="coerce")
+    return None if pd.isna(d) else d.date()
+
+def _cell(header, row, name):
+    col = header.index(name) if name in header else None
+    return row[col] if col is not None and col < len(row) else ""
+
+def row_keys(header, rows):
+    """各行の予約のキー（日付が読めない行は None）"""
+    return reservation_keys(
+        [_row_date(_cell(header, row, "date")) for row in rows],
+        [_cell(header, row, "facility") for row in rows],
+    )
+
+def reservations_payload(header, rows, date_from=None, date_to=None):
+    """
+    期間内の予約（日付・開始時間順）
+
+    id は予約のキー（row_keys()）。日付が読めない行は含めない。
+
+    Args:
+        date_from: この日以降（datetime.date、None なら制限なし）
+        date_to: この日以前（datetime.date、None なら制限なし）
+    """
+    if "date" not in header: return []
+    out = []
+    for key, row in zip(row_keys(header, rows), rows):
+        if key is None: continue
+        day = _row_date(_cell(header, row, "date"))
+        if date_from and day < date_from: continue
+        if date_to and day > date_to: continue
+        out.append(_record(header, row, key))
+    out.sort(key=lambda r: (r["date"], r["start"]))
+    return out
+
+def participants_payload(header, rows, key):
+    """予約1件の参加者（見つからなければ None）"""
+    keys = row_keys(header, rows)
+    if key not in keys: return None
+    row = rows[keys.index(key)]
+    r = dict(zip(header, list(row) + [""] * (len(header) - len(row))))
+    payload = _record(header, row, key)
+    for col in ["participants", "consider", "absent"]:
+        payload[col] = _split(r.get(col, ""))
+    return payload
+
+
+class ResponseCache:
+    """
+    (グループ, パス, データのバージョン) ごとに生成済みのレスポンスを保持する（LRU）
+    """
+    def __init__(self, size=RESPONSE_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        body = json.dumps(build(), ensure_ascii=False).encode("utf-8")
+        entry = {
+            "body": body,
+            "gzip": gzip.compress(body),
+            "etag": '"' + hashlib.sha1(body).hexdigest() + '"',
+        }
+        with self.lock:
+            self.entries[key] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return entry
+
+
+def make_handler(resolve, cache):
+    """
+    Args:
+        resolve: グループ名 → ApiSource（未登録なら None）
+        cache: ResponseCache
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_entry(self, entry):
+            tags = [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]
+            if entry["etag"] in tags:
+                self.send_response(304)
+                self.send_header("ETag", entry["etag"])
+                self.end_headers()
+                return
+            use_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+            body = entry["gzip"] if use_gzip else entry["body"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("ETag", entry["etag"])
+            # 参加者の名前を含むため、共有キャッシュ（プロキシ・CDN）には置かせない
+            self.send_header("Cache-Control", f"private, max-age={REFRESH_SECONDS}")
+            self.send_header("Vary", "Accept-Encoding")
+            if use_gzip:
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            group = query.get("group", DEFAULT_GROUP)
+            source = resolve(group)
+            if source is None:
+                return self._send_json(404, {"error": f"unknown group: {group}"})
+            parts = [unquote(p) for p in url.path.split("/") if p]
+
+            try:
+                if parts == ["api", "reminders"]:
+                    messages, version = source.reminders(jst_today())
+                    entry = cache.get((group, "reminders", version), lambda: {"messages": messages})
+                    return self._send_entry(entry)
+
+                if parts == ["api", "reservations"]:
+                    try:
+                        date_from, date_to = parse_date_param(query.get("from")), parse_date_param(query.get("to"))
+                    except ValueError:
+                        return self._send_json(400, {"error": "from / to must be YYYY-MM-DD"})
+                    header, rows, version = source.rows()
+                    entry = cache.get(
+                        (group, "reservations", date_from, date_to, version),
+                        lambda: {"reservations": reservations_payload(header, rows, date_from, date_to)},
+                    )
+                    return self._send_entry(entry)
+
+                if len(parts) == 4 and parts[:2] == ["api", "reservations"] and parts[3] == "participants":
+                    header, rows, version = source.rows()
+                    payload = participants_payload(header, rows, parts[2])
+                    if payload is None:
+                        return self._send_json(404, {"error": "reservation not found"})
+                    entry = cache.get((group, "participants", parts[2], version), lambda: payload)
+                    return self._send_entry(entry)
+            except Exception:
+                logger.exception("API の応答に失敗しました（%s）", self.path)
+                return self._send_json(503, {"error": "service unavailable"})
+
+            self._send_json(404, {"error": "not found"})
+
+    return Handler
+
+def serve_in_background(host, port, resolve):
+    """
+    API サーバーをデーモンスレッドで起動する（Streamlit と同じプロセスで動かす場合）
+
+    Streamlit を複数プロセスで動かしている場合、ポートを使えるのは最初に起動した1プロセスだけ。
+    他のプロセスでは起動せずにログに残す（アプリの表示は止めない）。
+
+    Returns:
+        ThreadingHTTPServer（ポートを使えなかった場合は None）
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), make_handler(resolve, ResponseCache()))
+    except OSError as e:
+        logger.warning("API サーバーを起動できませんでした（%s:%s）: %s", host, port, e)
+        return None
+    thread = threading.Thread(target=server.serve_forever, name="api-server", daemon=True)
+    thread.start()
+    return server
+
+
+# ==========================================
+# コマンドライン
+# ==========================================
+
+def main():
+    parser = argparse.ArgumentParser(description="予約データの読み取り専用 API")
+    parser.add_argument("--secrets", default=DEFAULT_SECRETS_PATH, help="secrets.toml のパス")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="待ち受けるアドレス（外部に公開する場合は認証付きのプロキシを置く）")
+    parser.add_argument("--port", type=int, default=8502)
+    args = parser.parse_args()
+
+    secrets = load_secrets(args.secrets)
+    groups = load_group_sheets(secrets)
+    registry = TenantRegistry.from_secrets(secrets)
+    sources = {}
+    lock = threading.Lock()
+
+    def resolve(group):
+        sheet_id = groups.get(group)
+        if sheet_id is None: return None
+        with lock:
+            if group not in sources:
+                budget = registry.budget(sheet_id)
+                store = make_reservation_store(
+                    BudgetedWorksheet(open_worksheet(secrets["google"], sheet_id, "reservations"), budget),
+                    BudgetedWorksheet(open_or_create_worksheet(secrets["google"], sheet_id, CHANGELOG_SHEET, CHANGELOG_COLUMNS), budget),
+                    secrets, sheet_id,
+                )
+                try:
+                    lottery = BudgetedWorksheet(open_worksheet(secrets["google"], sheet_id, "lottery_periods"), budget)
+                except Exception:
+                    lottery = None
+                sources[group] = ApiSource(store, lottery)
+            return sources[group]
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(resolve, ResponseCache()))
+    print(f"API: http://{args.host}:{args.port}/api/reservations")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+抽選結果などの予約一括登録
+
+アップロードされた CSV / TSV をまとめて検証し、既存の予約と突き合わせたうえで
+新規行を append_rows で追加し、ステータス更新は対象の行を読み直して確認してから1回の batch_update で書き込む。
+
+ファイル形式（1行目はヘッダー、日本語の列名も可）:
+    date,facility,status,start,end,message
+    2025-12-06,市民コート,当選,9:00,11:00,
+"""
+import io
+
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+
+from sheets_common import RESERVATION_COLUMNS, run_with_retry, serialize_reservations
+
+# 日本語の列名 → 内部の列名
+COLUMN_ALIASES = {
+    "日付": "date", "施設名": "facility", "施設": "facility", "ステータス": "status", "状態": "status",
+    "開始": "start", "開始時間": "start", "終了": "end", "終了時間": "end", "メモ": "message",
+}
+
+# 抽選結果の表記 → ステータス
+STATUS_ALIASES = {"当選": "確保", "落選": "中止"}
+
+IMPORT_STATUSES = ["確保", "抽選中", "中止"]
+
+# 同じ予約とみなすキー
+KEY_COLUMNS = ["date", "facility", "start_hour", "start_minute", "end_hour", "end_minute"]
+
+
+def read_import_file(data, filename=""):
+    """
+    CSV / TSV を読み込む（区切り文字は拡張子、なければ内容から判定）
+
+    Args:
+        data: ファイルの中身（bytes）
+        filename: ファイル名
+
+    Returns:
+        DataFrame: すべて文字列の列
+    """
+    text = data.decode("utf-8-sig")
+    if filename.lower().endswith((".tsv", ".txt")):
+        sep = "\t"
+    elif filename.lower().endswith(".csv"):
+        sep = ","
+    else:
+        sep = "\t" if text.split("\n", 1)[0].count("\t") > 0 else ","
+    df = pd.read_csv(io.StringIO(text), sep=sep, dtype=str, keep_default_na=False)
+    df.columns = [COLUMN_ALIASES.get(c.strip(), c.strip().lower()) for c in df.columns]
+    return df
+
+def validate_import(df):
+    """
+    全行をまとめて検証し、登録できる行とエラー一覧に分ける
+
+    Args:
+        df: read_import_file() の結果
+
+    Returns:
+        tuple: (登録できる行の DataFrame, [(ファイル上の行番号, エラー内容), ...])
+    """
+    missing = [c for c in ["date", "facility", "start", "end"] if c not in df.columns]
+    if missing:
+        return pd.DataFrame(columns=RESERVATION_COLUMNS), [(1, f"列がありません: {', '.join(missing)}")]
+
+    status = df["status"].str.strip() if "status" in df.columns else pd.Series("確保", index=df.index)
+    status = status.replace(STATUS_ALIASES).replace("", "確保")
+    dates = pd.to_datetime(df["date"].str.strip(), errors="coerce")
+    facility = df["facility"].str.strip()
+    start = pd.to_datetime(df["start"].str.strip(), format="%H:%M", errors="coerce")
+    end = pd.to_datetime(df["end"].str.strip(), format="%H:%M", errors="coerce")
+
+    checks = [
+        (dates.isna(), "日付が不正です"),
+        (facility == "", "施設名が空です"),
+        (~status.isin(IMPORT_STATUSES), "ステータスが不正です"),
+        (start.isna() | end.isna(), "時間は HH:MM 形式で入力してください"),
+        (start.notna() & end.notna() & (end <= start), "終了時間は開始時間より後にしてください"),
+    ]
+    errors = []
+    invalid = pd.Series(False, index=df.index)
+    for mask, message in checks:
+        invalid |= mask
+        # ファイル上の行番号 = 位置 + 2（1行目はヘッダー）
+        errors += [(pos + 2, message) for pos in df.index[mask]]
+    errors.sort()
+
+    ok = ~invalid
+    n = int(ok.sum())
+    message = df["message"] if "message" in df.columns else pd.Series("", index=df.index)
+    valid = pd.DataFrame({
+        "date": dates[ok].dt.date.values,
+        "facility": facility[ok].values,
+        "status": status[ok].values,
+        "start_hour": start[ok].dt.hour.values,
+        "start_minute": start[ok].dt.minute.values,
+        "end_hour": end[ok].dt.hour.values,
+        "end_minute": end[ok].dt.minute.values,
+        "participants": [[] for _ in range(n)],
+        "absent": [[] for _ in range(n)],
+        "consider": [[] for _ in range(n)],
+        "message": message[ok].str.replace("\n", "<br>").values,
+    })
+    return valid, errors
+
+def _key_frame(df):
+    keys = df[KEY_COLUMNS].copy()
+    for c in KEY_COLUMNS[2:]:
+        keys[c] = pd.to_numeric(keys[c], errors="coerce").fillna(-1).astype(int)
+    keys["date"] = keys["date"].astype(str)
+    keys["facility"] = keys["facility"].astype(str).str.strip()
+    return keys
+
+def plan_import(existing_df, valid_df):
+    """
+    既存の予約と突き合わせ、追加する行とステータスを更新する行を決める
+
+    日付・施設・時間帯が同じ予約は同一とみなし、ステータスが違えば更新、同じなら重複として除外する。
+    ファイル内の重複は後の行を優先する。
+
+    Args:
+        existing_df: load_reservations() の結果
+        valid_df: validate_import() で登録可能と判定された行
+
+    Returns:
+        dict: new_rows（追加する DataFrame）, status_updates（[(既存の行インデックス, ステータス)]）, duplicates（除外件数）
+    """
+    incoming = valid_df.copy()
+    incoming_keys = _key_frame(incoming)
+    dedup_mask = ~incoming_keys.duplicated(keep="last")
+    in_file_duplicates = int((~dedup_mask).sum())
+    incoming, incoming_keys = incoming[dedup_mask], incoming_keys[dedup_mask]
+
+    if existing_df.empty:
+        return {"new_rows": incoming.reset_index(drop=True), "status_updates": [], "duplicates": in_file_duplicates}
+
+    existing_keys = _key_frame(existing_df)
+    existing_keys["existing_idx"] = existing_df.index
+    existing_keys["existing_status"] = existing_df["status"].values
+    existing_keys = existing_keys.drop_duplicates(subset=KEY_COLUMNS, keep="first")
+
+    incoming_keys["pos"] = range(len(incoming_keys))
+    merged = incoming_keys.merge(existing_keys, on=KEY_COLUMNS, how="left")
+    merged = merged.sort_values("pos")
+    matched = merged["existing_idx"].notna().values
+
+    new_rows = incoming[~matched].reset_index(drop=True)
+    statuses = incoming["status"].values[matched]
+    status_updates = [
+        (int(idx), new_status)
+        for idx, old_status, new_status in zip(merged["existing_idx"][matched], merged["existing_status"][matched], statuses)
+        if old_status != new_status
+    ]
+    duplicates = in_file_duplicates + int(matched.sum()) - len(status_updates)
+    return {"new_rows": new_rows, "status_updates": status_updates, "duplicates": duplicates}
+
+def build_append_rows(header, plan):
+    """
+    追加する行を append_rows 用の値にする（シートのヘッダーの列順に揃える）
+
+    Args:
+        header: reservations シートのヘッダー
+        plan: plan_import() の結果
+
+    Returns:
+        list: データ行のリスト
+    """
+    new_rows = plan["new_rows"].reindex(columns=header, fill_value="")
+    return serialize_reservations(new_rows)[1:]
+
+def verify_status_updates(worksheet, header, existing_df, updates):
+    """
+    ステータスを更新する行を書き込む直前に読み直し、読み込んだ時と同じ予約のままの行だけを残す
+
+    他のセッションが行を追加・削除・編集していると、行インデックスが別の予約を指していることがあるため。
+
+    Args:
+        worksheet: reservations シート
+        header: reservations シートのヘッダー
+        existing_df: 突き合わせに使った load_reservations() の結果
+        updates: plan_import() の status_updates
+
+    Returns:
+        tuple: (書き込んでよい更新のリスト, 内容が変わっていたため除外した件数)
+    """
+    if not updates: return [], 0
+    ranges = [f"{rowcol_to_a1(idx + 2, 1)}:{rowcol_to_a1(idx + 2, len(header))}" for idx, _ in updates]
+    current = run_with_retry(worksheet.batch_get, ranges)
+    rows = [dict(zip(header, cells[0] if cells else [])) for cells in current]
+    now_df = pd.DataFrame(rows).reindex(columns=KEY_COLUMNS + ["status"], fill_value="").fillna("")
+    now_keys = _key_frame(now_df)
+    old_keys = _key_frame(existing_df.loc[[idx for idx, _ in updates]])
+
+    verified = []
+    for i, (idx, status) in enumerate(updates):
+        same = (
+            list(now_keys.iloc[i]) == list(old_keys.iloc[i])
+            and now_df["status"].iloc[i] == existing_df.at[idx, "status"]
+        )
+        if same:
+            verified.append((idx, status))
+    return verified, len(updates) - len(verified)
+
+def build_status_batch(header, updates):
+    """
+    ステータス更新を batch_update 用のデータにする（ステータスのセルだけ）
+    """
+    status_col = header.index("status") + 1
+    # シート上の行番号 = 行インデックス + 2（1行目はヘッダー）
+    return [{"range": rowcol_to_a1(idx + 2, status_col), "values": [[status]]} for idx, status in updates]
+
+def missing_facilities(facility_names, known_facilities):
+    """
+    facilities シートに未登録の施設名を返す（入力順・重複なし）
+    """
+    seen = set(known_facilities)
+    missing = []
+    for name in facility_names:
+        if name and name not in seen:
+            seen.add(name)
+            missing.append(name)
+    return missing
+
+def commit_import(worksheet, facilities_sheet, existing_df, plan, known_facilities):
+    """
+    施設の追加と予約の書き込みを行う
+
+    新規行は append_rows で末尾に追加する（読み込んだ後に他のセッションが追加した行を上書きしない）。
+    ステータスの更新は対象の行を読み直して確認し、ステータスのセルだけを1回の batch_update で書き込む。
+
+    Args:
+        worksheet: reservations シート
+        facilities_sheet: facilities シート
+        existing_df: load_reservations() の結果
+        plan: plan_import() の結果
+        known_facilities: 登録済みの施設名
+
+    Returns:
+        dict: {"facilities": 追加した施設名, "added": 追加した行数, "updated": 更新した行数,
+               "skipped": 内容が変わっていたため更新しなかった行数}
+    """
+    new_facilities = missing_facilities(plan["new_rows"]["facility"].tolist(), known_facilities)
+    if new_facilities:
+        run_with_retry(facilities_sheet.append_rows, [[name, "", ""] for name in new_facilities])
+
+    header = run_with_retry(worksheet.row_values, 1)
+    if not header:
+        header = RESERVATION_COLUMNS
+        run_with_retry(worksheet.update, values=[header], range_name="A1")
+
+    rows = build_append_rows(header, plan)
+    if rows:
+        run_with_retry(worksheet.append_rows, rows)
+
+    updates, skipped = verify_status_updates(worksheet, header, existing_df, plan["status_updates"])
+    if updates:
+        run_with_retry(worksheet.batch_update, build_status_batch(header, updates))
+    return {"facilities": new_facilities, "added": len(rows), "updated": len(updates), "skipped": skipped}
@@ -0,0 +1,99 @@
+"""
+カレンダーに渡すイベントの差分更新
+
+予約データのバージョンが変わった時だけ、内容が変わった予約のイベントを作り直す。
+イベントは予約のキー（sheets_common.reservation_keys()。日付・施設と、同じ日・同じ施設の中での順番）ごとに
+保持し、イベントの id にも使う。他の日付の行を削除・追加しても、変わらなかった予約の id と dict はそのまま。
+
+streamlit-calendar はイベントを配列でしか受け取らず（追加・変更・削除を個別に送れない）、
+再実行のたびに配列全体が JSON としてブラウザに送られる。送る量を減らすため、カレンダーには
+表示中の期間のイベントだけを渡す（between()）。カレンダーは固定の key でマウントしたままにする。
+"""
+import threading
+from bisect import bisect_left
+
+from sheets_common import reservation_keys
+
+# イベントの内容に関係する列（これらが変わった予約だけ作り直す）
+EVENT_COLUMNS = ["date", "start_hour", "start_minute", "end_hour", "end_minute", "status", "facility"]
+
+
+class EventCache:
+    """
+    予約のキー → イベントの保持（グループ内で共有する）
+
+    Args:
+        build: (DataFrame, イベントの id のリスト) → イベントのリスト（build_calendar_events）
+    """
+    def __init__(self, build):
+        self.build = build
+        self.version = None
+        self.rows = {}
+        self.events = []
+        self.starts = []
+        self.index = {}
+        self.delta = {"added": 0, "updated": 0, "removed": 0}
+        self.lock = threading.Lock()
+
+    def get(self, df, version):
+        """
+        Args:
+            df: load_reservations() の結果
+            version: df のデータのバージョン（同じなら前回のイベントをそのまま返す）
+
+        Returns:
+            list: イベント（開始日時の順。変更しないこと）
+        """
+        with self.lock:
+            if version == self.version:
+                return self.events
+            keys = reservation_keys(df["date"], df["facility"]) if not df.empty else []
+            columns = [df[c] if c in df.columns else [None] * len(df) for c in EVENT_COLUMNS]
+            rows = {}
+            index = {}
+            delta = {"added": 0, "updated": 0, "removed": 0}
+            changed = []
+            for key, idx, signature in zip(keys, df.index, zip(*columns)):
+                if key is None: continue
+                index[key] = idx
+                old = self.rows.get(key)
+                if old is not None and old[0] == signature:
+                    rows[key] = old
+                    continue
+                changed.append((key, idx))
+                rows[key] = (signature, None)
+                delta["updated" if old is not None else "added"] += 1
+            # 変わった予約はまとめて1回で作る
+            if changed:
+                built = self.build(df.loc[[idx for _, idx in changed]], ids=[key for key, _ in changed])
+                built = {e["id"]: e for e in built}
+                for key, _ in changed:
+                    rows[key] = (rows[key][0], built.get(key))
+            delta["removed"] = sum(1 for key in self.rows if key not in rows)
+
+            self.rows = rows
+            self.index = index
+            self.events = sorted((event for _, event in rows.values() if event is not None), key=lambda e: e["start"])
+            self.starts = [e["start"] for e in self.events]
+            self.version = version
+            self.delta = delta
+            return self.events
+
+    def between(self, df, version, start, end):
+        """
+        期間内（start 以上 end 未満の日）に始まるイベント
+
+        Args:
+            start: 期間の開始日（datetime.date）
+            end: 期間の終了日（datetime.date、含まない）
+        """
+        self.get(df, version)
+        with self.lock:
+            lo = bisect_left(self.starts, start.isoformat())
+            hi = bisect_left(self.starts, end.isoformat())
+            return self.events[lo:hi]
+
+    def row_index(self, key):
+        """イベントの id（予約のキー）から、予約データの行インデックス（なければ None）"""
+        with self.lock:
+            return self.index.get(key)
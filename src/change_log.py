@@ -0,0 +1,291 @@
+"""
+reservations シートの変更ログ（changelog シート）
+
+予約を書き換えるたびに、変更内容（行の追加・更新・削除）を changelog シートの末尾に追記する。
+読み込み側は前回までに反映したバージョンより新しいログだけを取得して手元のデータに適用するため、
+変更がなければ reservations シート全体を読み直さずに済む。
+
+* バージョン = changelog シートのデータ行の番号（1始まり）。追記した位置で決まるので採番の競合がない
+* 古いログは compact_changelog() で中身だけ消す（行は残す）。消えたログを読んだ場合は全件読み直す
+* アプリを通さない変更（シートの直接編集など）に備え、一定時間ごとに全件読み直す
+"""
+import difflib
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from gspread.utils import rowcol_to_a1
+
+from chunked_reader import ColumnBuilder, read_sheet_values
+from sheets_common import run_with_retry, serialize_reservations
+
+CHANGELOG_SHEET = "changelog"
+
+CHANGELOG_COLUMNS = ["version", "op", "row", "payload", "ts"]
+
+# insert: row の位置に行を挿入 / update: row の行を置き換え / delete: row の行を削除
+# reload: 差分で表せない変更（一括登録など）。読み込み側は全件読み直す
+OPS = ["insert", "update", "delete", "reload"]
+
+# 変更ログと関係なく全件読み直す間隔（秒）
+FULL_RELOAD_SECONDS = 600
+
+
+def diff_rows(old_rows, new_rows):
+    """
+    変更前後の行の並び（シートに書く値）を比べ、変更ログのエントリにする
+
+    エントリは先頭から順に適用すれば new_rows になるように、後ろの行から並べる。
+
+    Args:
+        old_rows: 変更前のデータ行（ヘッダーを除く）
+        new_rows: 変更後のデータ行（ヘッダーを除く）
+
+    Returns:
+        list: [(op, 行の位置（0始まり）, 行の値 or None), ...]
+    """
+    old_keys = [tuple(r) for r in old_rows]
+    new_keys = [tuple(r) for r in new_rows]
+    matcher = difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+    entries = []
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == "equal": continue
+        common = min(i2 - i1, j2 - j1) if tag == "replace" else 0
+        # 後ろの行から処理するので、削除・挿入しても手前の位置はずれない
+        for k in range(i2 - i1 - 1, common - 1, -1):
+            entries.append(("delete", i1 + k, None))
+        for k in range(j2 - j1 - 1, common - 1, -1):
+            entries.append(("insert", i1 + common, list(new_rows[j1 + k])))
+        for k in range(common - 1, -1, -1):
+            entries.append(("update", i1 + k, list(new_rows[j1 + k])))
+    return entries
+
+def build_log_rows(entries, size, journal_ids=None):
+    """
+    エントリを changelog シートに追記する行にする
+
+    payload には行の値と適用後の行数を入れる。読み込み側は適用後の行数を照合し、
+    一致しなければ（二重適用・取りこぼし）全件読み直す。
+
+    Args:
+        entries: diff_rows() の結果
+        size: 変更前のデータ行数
+        journal_ids: この書き込みで反映したオフラインのジャーナルの記録の ID（payload の journal に入れる）
+    """
+    ts = (datetime.utcnow() + timedelta(hours=9)).isoformat(timespec="seconds")
+    rows = []
+    for op, pos, values in entries:
+        size += {"insert": 1, "delete": -1}.get(op, 0)
+        payload = {"values": values, "size": size}
+        if journal_ids:
+            payload["journal"] = list(journal_ids)
+        rows.append(["=ROW()-1", op, pos, json.dumps(payload, ensure_ascii=False), ts])
+    return rows
+
+def append_changes(log_sheet, entries, size, journal_ids=None):
+    """
+    変更ログを追記する（1回の API 呼び出し）
+
+    Args:
+        log_sheet: changelog シート
+        entries: diff_rows() の結果
+        size: 変更前の reservations のデータ行数
+        journal_ids: build_log_rows() と同じ
+    """
+    if not entries: return
+    run_with_retry(log_sheet.append_rows, build_log_rows(entries, size, journal_ids), value_input_option="USER_ENTERED")
+
+def append_reload(log_sheet, journal_ids=None):
+    """差分で表せない変更をしたことを記録する（読み込み側は全件読み直す）"""
+    run_with_retry(
+        log_sheet.append_rows, build_log_rows([("reload", 0, None)], 0, journal_ids), value_input_option="USER_ENTERED",
+    )
+
+def applied_journal_ids(log_sheet, since_version=0):
+    """
+    変更ログに記録されている、反映済みのジャーナルの記録の ID
+
+    Args:
+        log_sheet: changelog シート
+        since_version: このバージョンより後のログだけを読む
+
+    Returns:
+        set
+    """
+    ids = set()
+    for r in run_with_retry(log_sheet.get_values, f"A{since_version + 2}:D"):
+        try:
+            ids.update(json.loads(r[3]).get("journal", []))
+        except (IndexError, ValueError, AttributeError):
+            continue
+    return ids
+
+def compact_changelog(log_sheet, keep=500):
+    """
+    古い変更ログの中身を消す（バージョンを行番号で表しているため、行自体は削除しない）
+
+    Args:
+        log_sheet: changelog シート
+        keep: 残すエントリ数
+
+    Returns:
+        int: 中身を消したエントリ数
+    """
+    versions = run_with_retry(log_sheet.get_values, "A:B")
+    last = len(versions) - 1 - keep
+    # 消去済みの行は B 列（op）が空
+    first = next((i for i in range(1, len(versions)) if len(versions[i]) > 1 and versions[i][1]), None)
+    if first is None or last < first:
+        return 0
+    run_with_retry(log_sheet.batch_clear, [f"B{first + 1}:E{last + 1}"])
+    return last - first + 1
+
+
+def rows_to_frame(header, rows):
+    """
+    シートの値（文字列）から get_all_records() と同じ形の DataFrame を作る
+    """
+    builder = ColumnBuilder(header)
+    width = len(header)
+    for pos, r in enumerate(rows):
+        builder.add(pos, (list(r) + [""] * width)[:width])
+    return builder.frame()
+
+
+class ReservationStore:
+    """
+    プロセス内で共有する reservations シートの内容
+
+    refresh() で変更ログの新しい分だけを取得して反映する。
+    """
+    def __init__(self, worksheet, log_sheet):
+        self.worksheet = worksheet
+        self.log_sheet = log_sheet
+        self.header = []
+        self.rows = []
+        self.version = None
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+
+    def full_reload(self):
+        # 先にログの長さを読む（後から読んだシートに含まれる変更を再適用しても、行数の照合で検出できる）
+        log_len = len(run_with_retry(self.log_sheet.get_values, "A:A"))
+        # 行数が多くても1回の巨大なレスポンスにならないよう、CHUNK_ROWS 行ずつ読む
+        self.header, self.rows = read_sheet_values(self.worksheet)
+        self.version = max(log_len - 1, 0)
+        self.loaded_at = time.monotonic()
+
+    def _apply(self, log_rows):
+        """
+        取得した変更ログを適用する
+
+        Returns:
+            bool: 適用できたか（False なら全件読み直しが必要）
+        """
+        for r in log_rows:
+            op = r[1] if len(r) > 1 else ""
+            if op not in OPS or op == "reload":
+                return False
+            try:
+                pos = int(r[2])
+                payload = json.loads(r[3])
+            except (IndexError, ValueError):
+                return False
+            if op == "insert":
+                self.rows.insert(pos, payload["values"])
+            elif op == "update":
+                if pos >= len(self.rows): return False
+                self.rows[pos] = payload["values"]
+            elif op == "delete":
+                if pos >= len(self.rows): return False
+                del self.rows[pos]
+            if len(self.rows) != payload["size"]:
+                return False
+            self.version += 1
+        return True
+
+    def refresh(self, latest=False):
+        """
+        最新の状態にする
+
+        Args:
+            latest: 必ず Sheets を確認するか（このクラスでは常に確認する。
+                    共有キャッシュを使う SharedReservationStore で意味を持つ）
+
+        Returns:
+            str: "full"（全件読み直し）/ "delta"（ログを適用）/ "none"（変更なし）
+        """
+        with self.lock:
+            if self.version is None or time.monotonic() - self.loaded_at > FULL_RELOAD_SECONDS:
+                self.full_reload()
+                return "full"
+            log_rows = run_with_retry(self.log_sheet.get_values, f"A{self.version + 2}:E")
+            log_rows = [r for r in log_rows if any(r)]
+            if not log_rows:
+                return "none"
+            if not self._apply(log_rows):
+                self.full_reload()
+                return "full"
+            return "delta"
+
+    def invalidate(self):
+        """
+        次の refresh() で必ず Sheets を確認させる（このクラスでは常に確認するので何もしない）
+        """
+
+    def snapshot(self):
+        """
+        最新の状態を DataFrame で返す
+        """
+        self.refresh()
+        with self.lock:
+            return rows_to_frame(self.header, self.rows)
+
+    def write(self, df):
+        """
+        予約データ全体を書き込み、変更ログを追記する
+
+        Args:
+            df: normalize_reservations() 形式の DataFrame
+        """
+        self.write_values(serialize_reservations(df))
+
+    def write_values(self, values, on_written=None, journal_ids=None):
+        """
+        シートの値（ヘッダー行 + データ行）を書き込み、変更ログを追記する
+
+        先に上書きしてから余った行を消す（途中で失敗してもシートが空にならない）。
+
+        Args:
+            values: ヘッダー行 + データ行
+            on_written: シートへの書き込みが終わった時点（変更ログの追記の前）に呼ぶ関数。
+                        例外を投げても変更ログは追記する
+            journal_ids: 反映したオフラインのジャーナルの記録の ID（変更ログに残す）
+        """
+        # 差分は他のプロセスの変更も反映した最新の状態と比べる
+        self.refresh(latest=True)
+        with self.lock:
+            old_header, old_rows = self.header, self.rows
+        run_with_retry(self.worksheet.update, values)
+        if len(old_rows) > len(values) - 1:
+            width = max(len(old_header), len(values[0]))
+            tail = f"{rowcol_to_a1(len(values) + 1, 1)}:{rowcol_to_a1(len(old_rows) + 1, width)}"
+            run_with_retry(self.worksheet.batch_clear, [tail])
+        try:
+            if on_written is not None:
+                on_written()
+        finally:
+            self._append_log(old_header, old_rows, values, journal_ids)
+
+    def _append_log(self, old_header, old_rows, values, journal_ids):
+        try:
+            if [str(h) for h in old_header] != values[0]:
+                append_reload(self.log_sheet, journal_ids)
+            else:
+                append_changes(self.log_sheet, diff_rows(old_rows, values[1:]), len(old_rows), journal_ids)
+        except Exception:
+            # シートは書き換わっているが変更ログにない。次の refresh() で全件読み直す
+            with self.lock:
+                self.version = None
+            raise
@@ -0,0 +1,163 @@
+"""
+reservations シートの分割読み込み
+
+get_all_values / get_all_records はシート全体を1回のレスポンスで受け取り、
+さらに行ごとの dict → DataFrame と変換するため、行数が多いとメモリ使用量が倍になる。
+ここでは get_values に A1 形式の行範囲（A2:K5001 など）を指定して CHUNK_ROWS 行ずつ取得し、
+取得した分から列ごとの配列（数値列は数値、リスト列はリスト）に直接変換する。
+
+* ヘッダーは row_values(1) で先に読み、列の範囲を決める
+* 途中の空行は空文字の行として扱う（get_all_values と同じ行の位置になる）。
+  CHUNK_ROWS 行すべてが空の範囲があれば、そこでシートの終わりとみなす
+* 行が日付順に並んでいる場合は、指定した期間を過ぎた時点で読み込みを止められる
+  （読んだ範囲で日付順になっていない行があればエラーにする）
+"""
+from datetime import date
+
+import pandas as pd
+from gspread.utils import numericise, rowcol_to_a1
+
+from sheets_common import LIST_COLUMNS, normalize_reservations, run_with_retry
+
+# 1回の get_values で読む行数
+CHUNK_ROWS = 5000
+
+
+def iter_row_chunks(worksheet, width, chunk_rows=CHUNK_ROWS, start_row=2):
+    """
+    データ行を chunk_rows 行ずつ読み込む
+
+    get_values は末尾の空行を返さないため、取得した行数が指定より少ない場合でも
+    次の範囲を読み、途中の空行を空文字の行で埋める。範囲がすべて空だった時点
+    （またはシートの行数 row_count に達した時点）で終わる。
+    シートの行数だけ大きく余っている場合に、空の範囲を何度も読まないようにするため。
+
+    Args:
+        worksheet: 読み込むシート
+        width: 列数（ヘッダーの列数）
+        chunk_rows: 1回に読む行数
+        start_row: 読み始める行番号（1始まり）
+
+    Yields:
+        tuple: (先頭の行の位置（データ行の0始まり）, 行のリスト)  各行は width 列に揃える
+    """
+    row = start_row
+    blank = 0
+    while True:
+        end = row + chunk_rows - 1
+        values = run_with_retry(worksheet.get_values, f"{rowcol_to_a1(row, 1)}:{rowcol_to_a1(end, width)}")
+        if not values:
+            return
+        rows = [[""] * width for _ in range(blank)]
+        rows += [(list(r) + [""] * width)[:width] for r in values]
+        yield row - start_row - blank, rows
+        blank = chunk_rows - len(values)
+        if len(values) < chunk_rows and end >= worksheet.row_count:
+            return
+        row = end + 1
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        # normalize_reservations() と同じく、YYYY/MM/DD などの表記も読む
+        d = pd.to_datetime(value, errors="coerce")
+        return None if pd.isna(d) else d.date()
+
+
+class ColumnBuilder:
+    """
+    シートの行を列ごとの配列に変換しながらためる
+
+    数値の列は get_all_records() と同じく数値に、participants / absent / consider はリストにする。
+    """
+    def __init__(self, header):
+        self.header = list(header)
+        self.columns = [[] for _ in self.header]
+        self.index = []
+        self.parsers = [self._parser(h) for h in self.header]
+
+    @staticmethod
+    def _parser(name):
+        if name in LIST_COLUMNS:
+            return lambda v: str(v).split(";") if v != "" else []
+        return lambda v: numericise(v, default_blank="")
+
+    def add(self, pos, row):
+        """
+        Args:
+            pos: 行の位置（データ行の0始まり）。DataFrame のインデックスになる
+            row: ヘッダーと同じ列数の値
+        """
+        self.index.append(pos)
+        for values, parse, v in zip(self.columns, self.parsers, row):
+            values.append(parse(v))
+
+    def frame(self):
+        """normalize_reservations() 形式の DataFrame"""
+        if not self.header:
+            return normalize_reservations(pd.DataFrame())
+        df = pd.DataFrame(dict(zip(self.header, self.columns)), index=self.index, columns=self.header)
+        return normalize_reservations(df)
+
+
+def read_sheet_values(worksheet, chunk_rows=CHUNK_ROWS):
+    """
+    シート全体の値を分割して読み込む（get_all_values の代わり）
+
+    Returns:
+        tuple: (ヘッダー, データ行のリスト)  データ行はヘッダーと同じ列数
+    """
+    header = run_with_retry(worksheet.row_values, 1)
+    if not header:
+        return [], []
+    rows = []
+    for _, chunk in iter_row_chunks(worksheet, len(header), chunk_rows):
+        rows += chunk
+    return header, rows
+
+def load_reservations_between(worksheet, date_from=None, date_to=None, date_ordered=False, chunk_rows=CHUNK_ROWS):
+    """
+    期間内の予約だけを DataFrame にする
+
+    読み込んだ分から順に変換し、期間外の行は保持しない。
+    date_ordered=True の場合は、date_to より後の日付の行が出てきた時点で残りを読まない。
+    それまでに前の行より前の日付の行があれば、日付順ではないので ValueError にする（日付のない行は除く）。
+
+    DataFrame のインデックスはシート上の行の位置（データ行の0始まり）なので、
+    load_reservations() の結果と同じインデックスで行を特定できる。
+
+    Args:
+        worksheet: reservations シート
+        date_from: この日以降（省略時は制限なし）
+        date_to: この日以前（省略時は制限なし）
+        date_ordered: 行が日付の昇順に並んでいるか
+        chunk_rows: 1回に読む行数
+
+    Returns:
+        DataFrame
+
+    Raises:
+        ValueError: date_ordered=True で、行が日付順に並んでいなかった場合
+    """
+    header = run_with_retry(worksheet.row_values, 1)
+    builder = ColumnBuilder(header)
+    if "date" not in header:
+        return builder.frame()
+    date_col = header.index("date")
+    last = None
+    for first, chunk in iter_row_chunks(worksheet, len(header), chunk_rows):
+        for i, row in enumerate(chunk):
+            d = _parse_date(row[date_col])
+            if d is None: continue
+            if date_ordered:
+                if last is not None and d < last:
+                    raise ValueError(f"{first + i + 2}行目が日付順ではありません（{last} の後に {d}）")
+                last = d
+            if date_to and d > date_to:
+                if date_ordered:
+                    return builder.frame()
+                continue
+            if date_from and d < date_from: continue
+            builder.add(first + i, row)
+    return builder.frame()
@@ -0,0 +1,485 @@
+"""
+Tk 版（data/*.csv）と Google Sheets の差分同期
+
+Tk 版（reservation_model.py / participation_window.py / lottery_period_window.py）はローカルの CSV を、
+Streamlit 版は Google Sheets を読み書きしている。両方の行を共通の形に変換し、
+行ごとの内容のハッシュを前回同期時のハッシュ（data/.sync_state.json）と比べて、
+変わった行だけをシートへ送る（push）・CSV に取り込む（pull）。
+
+* 予約: reservations.csv（date, time, end_time, title, description）⇔ reservations シート
+  （title → facility、description → message）。キーは 日付・開始時刻・タイトル。
+  同じキーの予約が複数ある場合（同じ施設・時間に2面取った場合など）は、2つ目以降に #2, #3 … を付けて
+  それぞれ同期する（CSV・シートとも上から順に対応させる）
+* 参加表明: participations.csv（〇/×）⇔ reservations シートの participants / absent。
+  キーは 日付・タイトル・名前。同じ日付・施設の予約が複数ある場合はどの行か決められないため、
+  その日付・施設の参加表明は同期しない（件数を表示する）
+* 抽選期間: lottery_periods シート → lottery_periods.csv（Tk 版は表示のみのため取り込みだけ）。
+  毎年・毎月の設定を今年・今月の日付にして書き出す
+* 両方で変わっていた行はシートの内容を優先し、競合として件数を表示する
+
+シートへの書き込みは、行の削除がなければ変わった行だけを1回の batch_update で書き、
+変更ログ（changelog シート）に追記する。削除がある場合は ReservationStore.write_values で書き直す。
+シートを読んだ後に変更ログが伸びていた（アプリで予約が更新された）場合は書き込まずに中止する。
+
+使い方:
+    python src/csv_sync.py [--dry-run] [--data-dir data] [--group default] [--secrets .streamlit/secrets.toml]
+"""
+import argparse
+import calendar
+import csv
+import hashlib
+import json
+import os
+from datetime import date, datetime
+
+from gspread.utils import rowcol_to_a1
+
+from change_log import CHANGELOG_SHEET, CHANGELOG_COLUMNS, ReservationStore, append_changes
+from sheets_common import (
+    DEFAULT_SECRETS_PATH, jst_today, load_secrets, open_worksheet, open_or_create_worksheet, run_with_retry, safe_int,
+)
+from tenants import DEFAULT_GROUP, load_group_sheets
+
+# Tk 版の CSV の列
+RESERVATION_FIELDS = ["date", "time", "end_time", "title", "description", "created_at"]
+PARTICIPATION_FIELDS = ["date", "title", "username", "status", "updated_at"]
+LOTTERY_FIELDS = ["lottery_name", "start_date", "end_date", "target_period"]
+
+# Tk 版の参加表明 → reservations シートの列（保留は Tk 版にないため同期しない）
+PARTICIPATION_COLUMNS = {"〇": "participants", "×": "absent"}
+
+STATE_FILE = ".sync_state.json"
+
+
+# ==========================================
+# 差分の計算
+# ==========================================
+
+def content_hash(values):
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+def plan_sync(local, remote, base):
+    """
+    行ごとに送る・取り込む方向を決める
+
+    Args:
+        local: CSV 側 {キー: 値}
+        remote: シート側 {キー: 値}
+        base: 前回同期時 {キー: ハッシュ}
+
+    Returns:
+        dict: {"push": {キー: 値 or None（削除）}, "pull": {キー: 値 or None}, "conflicts": [キー]}
+    """
+    plan = {"push": {}, "pull": {}, "conflicts": []}
+    for key in sorted(set(local) | set(remote)):
+        lh = content_hash(local[key]) if key in local else None
+        rh = content_hash(remote[key]) if key in remote else None
+        if lh == rh: continue
+        bh = base.get(key)
+        if lh == bh:
+            plan["pull"][key] = remote.get(key)
+        elif rh == bh:
+            plan["push"][key] = local.get(key)
+        else:
+            # 両方で変わっていればシートを優先する
+            plan["pull"][key] = remote.get(key)
+            plan["conflicts"].append(key)
+    return plan
+
+def merged(side, changes):
+    """side に changes（値が None なら削除）を適用した結果"""
+    result = dict(side)
+    for key, value in changes.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = value
+    return result
+
+
+# ==========================================
+# 予約・参加表明の変換
+# ==========================================
+
+def _time(hour, minute, default_hour):
+    return f"{safe_int(hour, default_hour):02d}:{safe_int(minute):02d}"
+
+def _split_time(text, default_hour):
+    hour, _, minute = str(text).partition(":")
+    return str(safe_int(hour, default_hour)), str(safe_int(minute))
+
+def _key(*parts):
+    return "|".join(parts)
+
+def _unique_key(seen, *parts):
+    """
+    予約のキー。同じキーが2つ目以降なら #2, #3 … を付ける
+
+    Args:
+        seen: これまでに出てきたキー → 回数（更新する）
+    """
+    key = _key(*parts)
+    seen[key] = seen.get(key, 0) + 1
+    return key if seen[key] == 1 else f"{key}#{seen[key]}"
+
+def csv_reservations(rows):
+    """reservations.csv → {日付|開始|タイトル: [date, time, end_time, title, description]}"""
+    result, seen = {}, {}
+    for r in rows:
+        if not r.get("date"): continue
+        values = [r["date"], r.get("time", ""), r.get("end_time", ""), r.get("title", ""), r.get("description", "")]
+        result[_unique_key(seen, values[0], values[1], values[3])] = values
+    return result
+
+def sheet_reservations(header, rows):
+    """
+    reservations シート → ({キー: 値}, {キー: 行の位置})  同じキーの行が複数あれば2つ目以降に #n を付ける
+    """
+    col = {c: i for i, c in enumerate(header)}
+    result, positions, seen = {}, {}, {}
+    for pos, row in enumerate(rows):
+        r = {c: row[i] if i < len(row) else "" for c, i in col.items()}
+        if not r.get("date"): continue
+        values = [
+            r["date"], _time(r.get("start_hour"), r.get("start_minute"), 9),
+            _time(r.get("end_hour"), r.get("end_minute"), 11), r.get("facility", ""), r.get("message", ""),
+        ]
+        key = _unique_key(seen, values[0], values[1], values[3])
+        result[key] = values
+        positions[key] = pos
+    return result, positions
+
+def csv_participations(rows):
+    """participations.csv → {日付|タイトル|名前: 〇 or ×}"""
+    return {
+        _key(r["date"], r["title"], r["username"]): r["status"]
+        for r in rows if r.get("date") and r.get("username") and r.get("status") in PARTICIPATION_COLUMNS
+    }
+
+def _reservation_positions(header, rows):
+    """(日付, 施設) → 行の位置のリスト（削除予定の行 None は除く）"""
+    d, f = header.index("date"), header.index("facility")
+    positions = {}
+    for pos, row in enumerate(rows):
+        if row is None: continue
+        positions.setdefault((row[d], row[f]), []).append(pos)
+    return positions
+
+def _participation_pair(key):
+    d, f, _ = key.split("|", 2)
+    return d, f
+
+def ambiguous_participation_keys(header, rows, keys):
+    """
+    同じ日付・施設の予約が複数ある参加表明のキー（どの行の参加表明か決められない）
+
+    Tk 版の参加表明は日付・タイトルしか持たないため、予約のキー（#2, #3 …）で対応させられない。
+    """
+    positions = _reservation_positions(header, rows)
+    return sorted(k for k in keys if len(positions.get(_participation_pair(k), [])) > 1)
+
+def sheet_participations(header, rows):
+    """
+    reservations シートの participants / absent → {日付|タイトル|名前: 〇 or ×}
+
+    同じ日付・施設の予約が複数ある場合は、どの行か決められないため含めない。
+    """
+    result = {}
+    for (d, f), found in _reservation_positions(header, rows).items():
+        if not d or len(found) != 1: continue
+        for status, col in PARTICIPATION_COLUMNS.items():
+            value = rows[found[0]][header.index(col)]
+            for name in (value.split(";") if value else []):
+                result.setdefault(_key(d, f, name), status)
+    return result
+
+def apply_reservation_push(header, rows, positions, push):
+    """
+    予約の変更を行データに反映する（削除した行は None にして位置を保つ。追加は末尾）
+    """
+    col = {c: i for i, c in enumerate(header)}
+    for key, values in push.items():
+        if values is None:
+            if key in positions:
+                rows[positions[key]] = None
+            continue
+        if key in positions:
+            row = rows[positions[key]]
+        else:
+            row = [""] * len(header)
+            row[col["status"]] = "確保"
+            rows.append(row)
+        row[col["date"]] = values[0]
+        row[col["start_hour"]], row[col["start_minute"]] = _split_time(values[1], 9)
+        row[col["end_hour"]], row[col["end_minute"]] = _split_time(values[2], 11)
+        row[col["facility"]] = values[3]
+        row[col["message"]] = values[4]
+
+def apply_participation_push(header, rows, push):
+    """
+    参加表明の変更を行データに反映する
+
+    Returns:
+        list: 対応する予約がない（または同じ日付・施設の予約が複数あり決められない）ため反映できなかったキー
+    """
+    positions = _reservation_positions(header, rows)
+    unmatched = []
+    for key, status in push.items():
+        d, f, name = key.split("|", 2)
+        found = positions.get((d, f), [])
+        if len(found) != 1:
+            unmatched.append(key)
+            continue
+        row = rows[found[0]]
+        for col in ["participants", "absent", "consider"]:
+            i = header.index(col)
+            names = [n for n in row[i].split(";") if n and n != name]
+            if status is not None and PARTICIPATION_COLUMNS.get(status) == col:
+                names.append(name)
+            row[i] = ";".join(names)
+    return unmatched
+
+def write_reservation_rows(store, version, old_rows, new_rows):
+    """
+    変わった行だけを書き込み、変更ログを追記する
+
+    行の位置で書き込むため、old_rows を読んだ後に予約が更新されていると別の行を書き換えてしまう。
+    変更ログの長さが読んだ時から変わっていた場合は書き込まずに中止する。
+
+    Args:
+        store: ReservationStore（old_rows を読んだもの）
+        version: old_rows を読んだ時の store.version
+        old_rows: 変更前の行
+        new_rows: old_rows と同じ位置の行（削除した行は None）+ 末尾に追加した行
+
+    Returns:
+        int: 書き込んだ行数
+    """
+    count = len(old_rows)
+    if new_rows == old_rows: return 0
+    # 変更ログの1行目はヘッダー
+    if len(run_with_retry(store.log_sheet.get_values, "A:A")) != version + 1:
+        raise RuntimeError("同期中に予約が更新されました。もう一度実行してください")
+    if any(r is None for r in new_rows[:count]):
+        # 削除があると後ろの行の位置がずれるため、全体を書き直す
+        kept = [r for r in new_rows if r is not None]
+        store.write_values([list(store.header)] + kept)
+        return len(kept)
+    entries = [("update", pos, new_rows[pos]) for pos in range(count) if new_rows[pos] != old_rows[pos]]
+    entries += [("insert", pos, new_rows[pos]) for pos in range(count, len(new_rows))]
+    if not entries: return 0
+    width = len(store.header)
+    data = [
+        {"range": f"{rowcol_to_a1(pos + 2, 1)}:{rowcol_to_a1(pos + 2, width)}", "values": [values]}
+        for _, pos, values in entries
+    ]
+    run_with_retry(store.worksheet.batch_update, data)
+    append_changes(store.log_sheet, entries, count)
+    return len(entries)
+
+
+# ==========================================
+# 抽選期間の変換（シート → CSV）
+# ==========================================
+
+def lottery_csv_rows(records, today):
+    """
+    lottery_periods シートの毎年・毎月の設定を、今年・今月の応募期間にする（毎週の設定は除く）
+    """
+    rows = []
+    for r in records:
+        if str(r.get("enabled", "")).lower() not in ["true", "1", "yes", "有効"]: continue
+        try:
+            if r.get("frequency") == "yearly":
+                start = date(today.year, int(r["start_month"]), int(r["start_day"]))
+                end = date(today.year, int(r["end_month"]), int(r["end_day"]))
+                # 年をまたぐ期間
+                if end < start: end = end.replace(year=end.year + 1)
+            elif r.get("frequency") == "monthly":
+                last = calendar.monthrange(today.year, today.month)[1]
+                start = today.replace(day=min(int(r.get("start_day") or 1), last))
+                end = today.replace(day=min(int(r.get("end_day") or last), last))
+            else:
+                continue
+        except (KeyError, ValueError):
+            continue
+        rows.append({
+            "lottery_name": r.get("title") or r.get("messages", ""),
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat(),
+            "target_period": r.get("messages", ""),
+        })
+    return rows
+
+
+# ==========================================
+# CSV・同期状態の読み書き
+# ==========================================
+
+def read_csv(path):
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            return list(csv.DictReader(f))
+    except FileNotFoundError:
+        return []
+
+def write_csv(path, fields, rows):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp, path)
+
+def load_state(data_dir):
+    try:
+        with open(os.path.join(data_dir, STATE_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_state(data_dir, state):
+    path = os.path.join(data_dir, STATE_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+# ==========================================
+# 同期
+# ==========================================
+
+def sync(store, lottery_sheet, data_dir, dry_run=False):
+    """
+    CSV とシートを同期する
+
+    Args:
+        store: ReservationStore
+        lottery_sheet: lottery_periods シート（なければ None）
+        data_dir: CSV のディレクトリ
+        dry_run: True の場合は件数を数えるだけで書き込まない
+
+    Returns:
+        dict: {"reservations": plan, "participations": plan, "unmatched": [キー], "ambiguous": [キー],
+               "lottery": 件数 or None}
+    """
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    state = load_state(data_dir)
+    res_path = os.path.join(data_dir, "reservations.csv")
+    part_path = os.path.join(data_dir, "participations.csv")
+
+    store.refresh(latest=True)
+    with store.lock:
+        header, old_rows, version = list(store.header), [list(r) for r in store.rows], store.version
+    rows = [list(r) for r in old_rows]
+
+    local_res_rows = read_csv(res_path)
+    local_res = csv_reservations(local_res_rows)
+    remote_res, positions = sheet_reservations(header, rows)
+    res_plan = plan_sync(local_res, remote_res, state.get("reservations", {}))
+
+    # 参加表明は予約の変更（削除・追加）を反映した後の行と比べる
+    apply_reservation_push(header, rows, positions, res_plan["push"])
+    local_part_rows = read_csv(part_path)
+    local_part = csv_participations(local_part_rows)
+    remote_part = sheet_participations(header, rows)
+    part_base = state.get("participations", {})
+    # 同じ日付・施設の予約が複数ある参加表明はどちらにも反映せず、CSV・前回の状態をそのまま残す
+    ambiguous = ambiguous_participation_keys(header, rows, set(local_part) | set(part_base))
+    held = {k: local_part.pop(k) for k in ambiguous if k in local_part}
+    held_base = {k: part_base[k] for k in ambiguous if k in part_base}
+    part_plan = plan_sync(local_part, remote_part, {k: v for k, v in part_base.items() if k not in held_base})
+    unmatched = apply_participation_push(header, rows, part_plan["push"])
+
+    result = {
+        "reservations": res_plan, "participations": part_plan, "unmatched": unmatched,
+        "ambiguous": ambiguous, "lottery": None,
+    }
+    lottery_rows = None
+    if lottery_sheet is not None:
+        lottery_rows = lottery_csv_rows(run_with_retry(lottery_sheet.get_all_records), jst_today())
+        lottery_path = os.path.join(data_dir, "lottery_periods.csv")
+        current = [{k: r.get(k, "") for k in LOTTERY_FIELDS} for r in read_csv(lottery_path)]
+        result["lottery"] = len(lottery_rows) if current != lottery_rows else 0
+    if dry_run:
+        return result
+
+    write_reservation_rows(store, version, old_rows, rows)
+
+    if res_plan["pull"]:
+        final = merged(local_res, res_plan["pull"])
+        seen = {}
+        created = {
+            _unique_key(seen, r["date"], r.get("time", ""), r.get("title", "")): r.get("created_at", "")
+            for r in local_res_rows if r.get("date")
+        }
+        out = [dict(zip(RESERVATION_FIELDS, values + [created.get(key) or now])) for key, values in final.items()]
+        write_csv(res_path, RESERVATION_FIELDS, sorted(out, key=lambda r: (r["date"], r["time"])))
+    if part_plan["pull"]:
+        final = dict(merged(local_part, part_plan["pull"]), **held)
+        updated = {_key(r["date"], r["title"], r["username"]): (r["status"], r.get("updated_at", "")) for r in local_part_rows}
+        out = []
+        for key, status in final.items():
+            d, f, name = key.split("|", 2)
+            old = updated.get(key)
+            out.append({"date": d, "title": f, "username": name, "status": status,
+                        "updated_at": old[1] if old and old[0] == status else now})
+        write_csv(part_path, PARTICIPATION_FIELDS, sorted(out, key=lambda r: (r["date"], r["title"], r["username"])))
+    if result["lottery"]:
+        write_csv(os.path.join(data_dir, "lottery_periods.csv"), LOTTERY_FIELDS, lottery_rows)
+
+    # 反映できなかった参加表明は同期済みにしない（次回もう一度送る）
+    final_part = merged(local_part, part_plan["pull"])
+    save_state(data_dir, {
+        "reservations": {k: content_hash(v) for k, v in merged(local_res, res_plan["pull"]).items()},
+        "participations": dict(
+            {k: content_hash(v) for k, v in final_part.items() if k not in unmatched}, **held_base
+        ),
+    })
+    return result
+
+
+# ==========================================
+# コマンドライン
+# ==========================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Tk 版の CSV と Google Sheets の差分同期")
+    parser.add_argument("--secrets", default=DEFAULT_SECRETS_PATH, help="secrets.toml のパス")
+    parser.add_argument("--data-dir", default="data", help="Tk 版の CSV のディレクトリ")
+    parser.add_argument("--group", default=DEFAULT_GROUP, help="グループ名（secrets の [groups]）")
+    parser.add_argument("--dry-run", action="store_true", help="件数を表示するだけで書き込まない")
+    args = parser.parse_args()
+
+    secrets = load_secrets(args.secrets)
+    sheet_id = load_group_sheets(secrets).get(args.group)
+    if sheet_id is None:
+        parser.error(f"グループ {args.group} のスプレッドシートが設定されていません")
+    google = secrets["google"]
+    store = ReservationStore(
+        open_worksheet(google, sheet_id, "reservations"),
+        open_or_create_worksheet(google, sheet_id, CHANGELOG_SHEET, CHANGELOG_COLUMNS),
+    )
+    try:
+        lottery_sheet = open_worksheet(google, sheet_id, "lottery_periods")
+    except Exception:
+        lottery_sheet = None
+
+    result = sync(store, lottery_sheet, args.data_dir, dry_run=args.dry_run)
+    for name, label in [("reservations", "予約"), ("participations", "参加表明")]:
+        plan = result[name]
+        print(f"{label}: シートへ {len(plan['push'])}件 / CSV へ {len(plan['pull'])}件 / 競合 {len(plan['conflicts'])}件（シートを優先）")
+    if result["unmatched"]:
+        print(f"対応する予約がない参加表明: {len(result['unmatched'])}件")
+    if result["ambiguous"]:
+        print(f"同じ日付・施設の予約が複数あり同期しなかった参加表明: {len(result['ambiguous'])}件")
+    if result["lottery"] is not None:
+        print(f"抽選期間: {'CSV を更新（' + str(result['lottery']) + '件）' if result['lottery'] else '変更なし'}")
+    if args.dry_run:
+        print("（--dry-run のため書き込んでいません）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+予約・参加表明の履歴を年・月ごとの Parquet に書き出す（集計用）
+
+年間の集計（施設ごとの利用時間、メンバーごとの参加回数、施設ごとの抽選の当選率など）のたびに
+シート全体を読んで pandas で加工しなくてよいよう、履歴を年・月で分けた Parquet ファイルに置く。
+
+    data/history/reservations/year=2026/month=10/part.parquet
+    data/history/participations/year=2026/month=10/part.parquet
+    data/history/_manifest.json   （パーティションごとの内容のハッシュ）
+
+* 書き出しはシートを分割読み込みし（chunked_reader の load_reservations_between。日付のない行は読み込み時に除く）、
+  前回とハッシュが変わった月のファイルだけを書き直す。行がなくなった月のファイルは削除する
+* --year を指定した場合はその年の月だけを読み・書き直す（他の年のファイルはそのまま）。
+  シートを日付順に並べて運用している場合は --date-ordered で、その年を過ぎた行から先を読まない
+* read_history() は必要な年・月のパーティションの必要な列だけを読む
+* pyarrow は streamlit の依存パッケージとしてインストールされる
+
+使い方:
+    python src/history_export.py export [--year 2026 [--date-ordered]] [--out data/history] [--group default] [--secrets .streamlit/secrets.toml]
+    python src/history_export.py report --year 2026 [--out data/history]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from chunked_reader import load_reservations_between
+from integrity import TIME_COLUMNS
+from member_index import attendance_frame
+from sheets_common import DEFAULT_SECRETS_PATH, load_secrets, open_worksheet, safe_int
+from tenants import DEFAULT_GROUP, load_group_sheets
+
+DEFAULT_OUT_DIR = os.path.join("data", "history")
+MANIFEST_FILE = "_manifest.json"
+
+# データセット → 列の型（パーティションの year / month はディレクトリ名から読む）
+SCHEMAS = {
+    "reservations": pa.schema([
+        ("reservation", pa.string()),
+        ("date", pa.date32()),
+        ("facility", pa.string()),
+        ("status", pa.string()),
+        ("start_hour", pa.int16()),
+        ("start_minute", pa.int16()),
+        ("end_hour", pa.int16()),
+        ("end_minute", pa.int16()),
+        ("hours", pa.float64()),
+        ("participants", pa.int32()),
+        ("consider", pa.int32()),
+        ("absent", pa.int32()),
+        ("message", pa.string()),
+    ]),
+    "participations": pa.schema([
+        ("reservation", pa.string()),
+        ("date", pa.date32()),
+        ("facility", pa.string()),
+        ("status", pa.string()),
+        ("member", pa.string()),
+        ("role", pa.string()),
+    ]),
+}
+
+# 抽選の結果とみなすステータス（当選 → 確保・完了、落選 → 中止）
+WON_STATUSES = ["確保", "完了"]
+LOST_STATUSES = ["中止"]
+
+
+# ==========================================
+# 書き出し
+# ==========================================
+
+def reservation_keys(df):
+    """
+    予約のキー（日付・開始時刻・施設）。同じキーが2つ目以降なら上から順に #2, #3 … を付ける
+
+    シート上の行の位置は途中の行を削除するとずれるため、Parquet の reservation 列にはこのキーを使う。
+    """
+    seen = {}
+    keys = []
+    for r in df.itertuples(index=False):
+        key = f"{r.date} {safe_int(r.start_hour, 9):02d}:{safe_int(r.start_minute):02d} {r.facility}"
+        seen[key] = seen.get(key, 0) + 1
+        keys.append(key if seen[key] == 1 else f"{key}#{seen[key]}")
+    return keys
+
+def _time_values(values, col):
+    """
+    時・分の列。空欄は既定値にし、範囲外（integrity.TIME_COLUMNS の上限を超える・負）の値は欠損にする
+    """
+    default, limit = TIME_COLUMNS[col]
+    numbers = values.map(lambda v: safe_int(v, default))
+    return numbers.where((numbers >= 0) & (numbers <= limit)).astype("Int16")
+
+def history_frames(df):
+    """
+    load_reservations() と同じ形の DataFrame から、書き出す2つの表を作る（日付のない行は除く）
+
+    時・分が範囲外の予約は、その列と利用時間（hours）を欠損にする。
+    終了が開始より前の予約の利用時間は 0 にする（行ごと。集計で他の予約の時間を減らさない）。
+
+    Returns:
+        dict: {データセット名: DataFrame}  どちらも year / month 列を含む
+    """
+    df = df[df["date"].notna()]
+    df = df.set_axis(reservation_keys(df))
+    times = {col: _time_values(df[col], col) for col in TIME_COLUMNS}
+    minutes = (times["end_hour"] * 60 + times["end_minute"]) - (times["start_hour"] * 60 + times["start_minute"])
+    hours = [None if pd.isna(m) else max(int(m), 0) / 60 for m in minutes]
+    res = pd.DataFrame({
+        "reservation": df.index,
+        "date": df["date"],
+        "facility": df["facility"].astype(str),
+        "status": df["status"].astype(str),
+        **times,
+        "hours": pd.Series(hours, index=df.index, dtype="float64"),
+        "participants": df["participants"].map(len),
+        "consider": df["consider"].map(len),
+        "absent": df["absent"].map(len),
+        "message": df["message"].astype(str),
+    })
+    part = attendance_frame(df).drop(columns="month")
+    frames = {"reservations": res, "participations": part}
+    for name, frame in frames.items():
+        dates = pd.to_datetime(frame["date"])
+        frames[name] = frame.assign(year=dates.dt.year, month=dates.dt.month).reset_index(drop=True)
+    return frames
+
+def partition_hash(frame):
+    return hashlib.sha1(pd.util.hash_pandas_object(frame, index=False).values.tobytes()).hexdigest()
+
+def _partition_dir(out_dir, name, year, month):
+    return os.path.join(out_dir, name, f"year={year}", f"month={month}")
+
+def write_partitions(out_dir, frames, manifest, years=None):
+    """
+    ハッシュが変わった年・月のファイルだけを書き直し、なくなった年・月のファイルを削除する
+
+    Args:
+        out_dir: 出力先
+        frames: history_frames() の結果
+        manifest: 前回の {データセット名: {"年-月": ハッシュ}}（更新する）
+        years: frames が含む年（その年だけを読んだ場合）。他の年のファイルは削除しない
+
+    Returns:
+        dict: {データセット名: {"written": 書き直した数, "removed": 削除した数, "kept": 変更なしの数}}
+    """
+    stats = {}
+    for name, frame in frames.items():
+        old = manifest.get(name, {})
+        new = {} if years is None else {k: v for k, v in old.items() if int(k.split("-")[0]) not in years}
+        counts = {"written": 0, "removed": 0, "kept": 0}
+        for (year, month), part in frame.groupby(["year", "month"], sort=True):
+            key = f"{year}-{month:02d}"
+            part = part.drop(columns=["year", "month"])
+            new[key] = partition_hash(part)
+            if old.get(key) == new[key]:
+                counts["kept"] += 1
+                continue
+            path = _partition_dir(out_dir, name, year, month)
+            os.makedirs(path, exist_ok=True)
+            table = pa.Table.from_pandas(part, schema=SCHEMAS[name], preserve_index=False)
+            tmp = os.path.join(path, "part.parquet.tmp")
+            pq.write_table(table, tmp)
+            os.replace(tmp, os.path.join(path, "part.parquet"))
+            counts["written"] += 1
+        for key in set(old) - set(new):
+            year, month = key.split("-")
+            shutil.rmtree(_partition_dir(out_dir, name, int(year), int(month)), ignore_errors=True)
+            counts["removed"] += 1
+        manifest[name] = new
+        stats[name] = counts
+    return stats
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+def export_history(worksheet, out_dir=DEFAULT_OUT_DIR, year=None, date_ordered=False):
+    """
+    reservations シートを読み、変わった年・月の Parquet だけを書き直す
+
+    Args:
+        year: 指定した場合はその年の行だけを読み、その年の月だけを書き直す
+        date_ordered: シートの行が日付順に並んでいるか（year の後の日付の行が出てきたら読むのを止める。
+                      日付順でない行があれば ValueError）
+
+    Returns:
+        dict: write_partitions() の結果
+    """
+    if year is None:
+        df = load_reservations_between(worksheet)
+    else:
+        df = load_reservations_between(worksheet, date(year, 1, 1), date(year, 12, 31), date_ordered=date_ordered)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    stats = write_partitions(out_dir, history_frames(df), manifest, None if year is None else [year])
+    save_manifest(out_dir, manifest)
+    return stats
+
+
+# ==========================================
+# 読み込み・集計
+# ==========================================
+
+def read_history(out_dir, name, columns=None, years=None, months=None):
+    """
+    必要な年・月のパーティションから、必要な列だけを読む
+
+    Args:
+        out_dir: export_history() の出力先
+        name: "reservations" または "participations"
+        columns: 読む列（省略時はすべて。year / month も指定できる）
+        years: 読む年のリスト（省略時はすべて）
+        months: 読む月のリスト（省略時はすべて）
+
+    Returns:
+        DataFrame
+    """
+    path = os.path.join(out_dir, name)
+    if not os.path.isdir(path):
+        return pd.DataFrame(columns=columns or SCHEMAS[name].names)
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    condition = None
+    for field, values in [("year", years), ("month", months)]:
+        if values is None: continue
+        expr = ds.field(field).isin(list(values))
+        condition = expr if condition is None else condition & expr
+    # パーティションの条件に合わないディレクトリのファイルは開かない
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+def yearly_report(out_dir, year):
+    """
+    1年分の集計
+
+    Returns:
+        dict: {
+            "facilities": 施設ごとの予約数・利用時間・当選率（当選 = 確保・完了、落選 = 中止）,
+            "members": メンバーごとの参加・保留・不参加の回数,
+        }
+    """
+    res = read_history(out_dir, "reservations", columns=["facility", "status", "hours"], years=[year])
+    facilities = pd.DataFrame(columns=["facility", "reservations", "hours", "won", "lost", "win_rate"])
+    if not res.empty:
+        res = res.assign(won=res["status"].isin(WON_STATUSES), lost=res["status"].isin(LOST_STATUSES))
+        facilities = res.groupby("facility").agg(
+            reservations=("status", "size"), hours=("hours", "sum"), won=("won", "sum"), lost=("lost", "sum"),
+        ).reset_index()
+        decided = facilities["won"] + facilities["lost"]
+        facilities["win_rate"] = (facilities["won"] / decided.where(decided > 0)).round(3)
+
+    part = read_history(out_dir, "participations", columns=["member", "role"], years=[year])
+    members = pd.DataFrame(columns=["member"])
+    if not part.empty:
+        members = part.groupby(["member", "role"]).size().unstack(fill_value=0).reset_index()
+        members.columns.name = None
+    return {"facilities": facilities, "members": members}
+
+
+# ==========================================
+# コマンドライン
+# ==========================================
+
+def main():
+    parser = argparse.ArgumentParser(description="予約・参加表明の履歴の Parquet 書き出しと集計")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="変わった年・月の Parquet を書き直す")
+    export.add_argument("--out", default=DEFAULT_OUT_DIR, help="出力先のディレクトリ")
+    export.add_argument("--secrets", default=DEFAULT_SECRETS_PATH, help="secrets.toml のパス")
+    export.add_argument("--group", default=DEFAULT_GROUP, help="グループ名（secrets の [groups]）")
+    export.add_argument("--year", type=int, help="この年の月だけを書き直す")
+    export.add_argument("--date-ordered", action="store_true",
+                        help="シートが日付順に並んでいる（--year の年を過ぎた行から先を読まない）")
+    report = sub.add_parser("report", help="1年分の集計を表示する")
+    report.add_argument("--year", type=int, required=True, help="集計する年")
+    report.add_argument("--out", default=DEFAULT_OUT_DIR, help="export の出力先のディレクトリ")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        secrets = load_secrets(args.secrets)
+        sheet_id = load_group_sheets(secrets).get(args.group)
+        if sheet_id is None:
+            parser.error(f"グループ {args.group} のスプレッドシートが設定されていません")
+        if args.date_ordered and args.year is None:
+            parser.error("--date-ordered は --year と一緒に指定してください")
+        stats = export_history(
+            open_worksheet(secrets["google"], sheet_id, "reservations"), args.out, args.year, args.date_ordered,
+        )
+        for name, s in stats.items():
+            print(f"{name}: 書き直し {s['written']} / 削除 {s['removed']} / 変更なし {s['kept']}（月）")
+
+    elif args.command == "report":
+        result = yearly_report(args.out, args.year)
+        print(f"■ 施設ごと（{args.year}年）")
+        print(result["facilities"].to_string(index=False))
+        print(f"\n■ メンバーごと（{args.year}年）")
+        print(result["members"].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
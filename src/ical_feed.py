@@ -0,0 +1,201 @@
+"""
+iCalendar（.ics）フィードの生成
+
+今後の予約をまとめた全体フィードと、参加者ごとのフィード（参加・保留の予約のみ）を作る。
+フィードはデータのバージョン（内容のハッシュ）と日付ごとに1回だけ生成する。
+
+Streamlit の静的ファイル配信（.streamlit/config.toml の server.enableStaticServing）を
+有効にすると、src/static/ics/ 以下に書き出したファイルが /app/static/ics/ で配信される
+（ETag / Last-Modified と 304 は静的配信が付ける）。
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sheets_common import reservation_keys, safe_int, serialize_reservations
+
+PRODID = "-//tennis_plan//reservations//JA"
+
+FEED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "ics")
+ALL_FEED_NAME = "all.ics"
+
+# キャンセル扱いにするステータス
+CANCELLED_STATUSES = ["中止"]
+
+
+def data_version(df):
+    """
+    予約データの内容から決まるバージョン文字列（内容が同じなら同じ値）
+    """
+    values = serialize_reservations(df)
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+def member_feed_name(member):
+    """参加者ごとのフィードのファイル名（ニックネームをそのまま URL に出さない）"""
+    return f"member-{hashlib.sha1(member.encode('utf-8')).hexdigest()[:12]}.ics"
+
+def _escape(text):
+    return (
+        str(text).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+        .replace("<br>", "\\n").replace("\n", "\\n")
+    )
+
+def _fold(line):
+    """75オクテットを超える行を折り返す（RFC 5545 3.1）"""
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return line
+    parts, current = [], b""
+    for ch in line:
+        b = ch.encode("utf-8")
+        if len(current) + len(b) > (75 if not parts else 74):
+            parts.append(current.decode("utf-8"))
+            current = b""
+        current += b
+    parts.append(current.decode("utf-8"))
+    return "\r\n ".join(parts)
+
+def _utc_stamp(d, hour, minute):
+    """JST の日時を UTC の iCalendar 形式（YYYYMMDDTHHMMSSZ）にする"""
+    dt = datetime(d.year, d.month, d.day) + timedelta(hours=hour, minutes=minute) - timedelta(hours=9)
+    return dt.strftime("%Y%m%dT%H%M%SZ")
+
+def _event_uid(key):
+    """
+    予約のキー（reservation_keys()）から作る UID
+
+    同じ日・同じ施設の予約が複数あっても別の UID になり、時刻を変えても UID は変わらない（購読側では更新になる）。
+    """
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + "@tennis-plan"
+
+def render_ics(df, today, calendar_name="テニスコート予約", member=None, dtstamp=None):
+    """
+    予約データから iCalendar テキストを生成する
+
+    Args:
+        df: load_reservations() の結果
+        today: この日以降の予約だけを含める
+        calendar_name: カレンダー名
+        member: 指定した場合、その人が参加・保留の予約だけを含める
+        dtstamp: DTSTAMP に使う時刻（UTC）。同じデータから同じ内容を作るため呼び出し側で固定する
+
+    Returns:
+        str
+    """
+    stamp = (dtstamp or datetime.utcnow()).strftime("%Y%m%dT%H%M%SZ")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escape(calendar_name)}",
+        "X-WR-TIMEZONE:Asia/Tokyo",
+    ]
+    # キーは参加者で絞る前の全体で付ける（全体フィードと参加者ごとのフィードで同じ UID にする）
+    keys = reservation_keys(df["date"], df["facility"]) if not df.empty else []
+    for key, (_, r) in zip(keys, df.iterrows()):
+        d = r.get("date")
+        if key is None or d < today: continue
+        if member is not None:
+            names = list(r.get("participants") or []) + list(r.get("consider") or [])
+            if member not in names: continue
+
+        participants = [n for n in (r.get("participants") or []) if n]
+        description = f"ステータス: {r['status']}"
+        if participants:
+            description += f"\n参加: {', '.join(participants)}"
+        if r.get("message"):
+            description += f"\n{r['message']}"
+
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{_event_uid(key)}",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{_utc_stamp(d, safe_int(r.get('start_hour'), 9), safe_int(r.get('start_minute'), 0))}",
+            f"DTEND:{_utc_stamp(d, safe_int(r.get('end_hour'), 11), safe_int(r.get('end_minute'), 0))}",
+            f"SUMMARY:{_escape('🎾テニス_' + str(r['facility']))}",
+            f"LOCATION:{_escape(r['facility'])}",
+            f"DESCRIPTION:{_escape(description)}",
+            f"STATUS:{'CANCELLED' if r['status'] in CANCELLED_STATUSES else 'CONFIRMED' if r['status'] == '確保' else 'TENTATIVE'}",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold(line) for line in lines) + "\r\n"
+
+
+class FeedCache:
+    """
+    データのバージョンと日付ごとに生成済みのフィードを保持する
+
+    同じバージョン・日付に対する2回目以降の要求は、生成も Sheets の読み込みも行わずに返す。
+    バージョンか日付が変わった時点で古いフィードは捨てる（日付が変わると過ぎた予約が外れるため）。
+    """
+    def __init__(self):
+        self.version = None
+        self.today = None
+        self.generated_at = None
+        self.feeds = {}
+        self.lock = threading.Lock()
+
+    def get(self, version, df, today, member=None):
+        """
+        フィードを取得する（未生成なら生成する）
+
+        Args:
+            version: data_version(df)
+            df: 予約データ
+            today: この日以降の予約を含める
+            member: 参加者ごとのフィードの場合はニックネーム
+
+        Returns:
+            bytes: フィードの内容
+        """
+        with self.lock:
+            if version != self.version or today != self.today:
+                self.version = version
+                self.today = today
+                self.generated_at = datetime.utcnow().replace(microsecond=0)
+                self.feeds = {}
+            if member not in self.feeds:
+                self.feeds[member] = render_ics(df, today, member=member, dtstamp=self.generated_at).encode("utf-8")
+            return self.feeds[member]
+
+
+def publish_feeds(cache, version, df, today, members, feed_dir=FEED_DIR):
+    """
+    全体フィードと参加者ごとのフィードをファイルに書き出す
+
+    内容が変わったファイルだけを書き換えるため、変更がなければ更新日時（Last-Modified）も
+    ETag も変わらず、カレンダーアプリの再取得は 304 で済む。
+
+    Args:
+        cache: FeedCache
+        version: data_version(df)
+        df: 予約データ
+        today: この日以降の予約を含める
+        members: 参加者ごとのフィードを作るニックネームの一覧
+        feed_dir: 出力先
+
+    Returns:
+        int: 書き換えたファイル数
+    """
+    os.makedirs(feed_dir, exist_ok=True)
+    targets = [(ALL_FEED_NAME, None)] + [(member_feed_name(m), m) for m in members]
+    written = 0
+    for name, member in targets:
+        body = cache.get(version, df, today, member=member)
+        path = os.path.join(feed_dir, name)
+        try:
+            with open(path, "rb") as f:
+                if f.read() == body: continue
+        except FileNotFoundError:
+            pass
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, path)
+        written += 1
+    return written
@@ -0,0 +1,244 @@
+"""
+reservations シートの整合性チェックと修復
+
+シートを直接編集した行などには、アプリの描画時に読み飛ばされる（カレンダーに出ない）値が残ることがある。
+シートを CHUNK_ROWS 行ずつ読んで以下を検出し、修正できるものは1回の batch_update で書き込む。
+
+* 日付が空 / 日付として読めない（修正しない。シートで直接直す）
+* 日付が YYYY-MM-DD 形式でない（例: 2026/10/5） → YYYY-MM-DD に揃える
+* 開始・終了の時・分が数値でない、範囲外 → 全角数字などは数値に、読めなければ既定値（9:00-11:00）
+* 不明なステータス → 前後の空白・当選/落選の表記を直す。空欄は「確保」。それ以外は修正しない
+* participants / absent / consider 内の名前の重複・空の名前 → 取り除く
+
+使い方:
+    python src/maintenance.py check          # 検出結果を表示するだけ
+    python src/maintenance.py check --fix    # 修正できるものを書き込む
+"""
+import unicodedata
+from datetime import date
+
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+
+from bulk_import import STATUS_ALIASES
+from change_log import append_reload
+from chunked_reader import CHUNK_ROWS, iter_row_chunks
+from sheets_common import LIST_COLUMNS, RESERVATION_STATUSES, run_with_retry
+
+# 検出する種類 → 表示名
+ISSUE_LABELS = {
+    "blank_date": "日付が空",
+    "bad_date": "日付として読めない",
+    "date_format": "日付の形式が YYYY-MM-DD でない",
+    "bad_time": "時・分が数値でない、または範囲外",
+    "unknown_status": "不明なステータス",
+    "duplicate_names": "名前の重複・空の名前",
+}
+
+# 時・分の列 → (既定値, 上限)。既定値は描画時に safe_int で補う値と同じ
+TIME_COLUMNS = {
+    "start_hour": (9, 23), "start_minute": (0, 59),
+    "end_hour": (11, 23), "end_minute": (0, 59),
+}
+
+# 空欄の時に補うステータス（一括登録と同じ）
+DEFAULT_STATUS = "確保"
+
+
+def _check_date(value):
+    """
+    Returns:
+        tuple: (種類, 修正後の値)  問題がなければ (None, None)
+    """
+    text = str(value).strip()
+    if not text:
+        return "blank_date", None
+    try:
+        if date.fromisoformat(text).isoformat() == text:
+            return None, None
+    except ValueError:
+        pass
+    parsed = pd.to_datetime(unicodedata.normalize("NFKC", text), errors="coerce")
+    if pd.isna(parsed):
+        return "bad_date", None
+    return "date_format", parsed.date().isoformat()
+
+def _check_time(value, default, limit):
+    text = str(value)
+    if text.isascii() and text.isdigit() and int(text) <= limit:
+        return None, None
+    try:
+        number = float(unicodedata.normalize("NFKC", text).strip())
+        if number.is_integer() and 0 <= number <= limit:
+            return "bad_time", str(int(number))
+    except ValueError:
+        pass
+    return "bad_time", str(default)
+
+def _check_status(value):
+    if value in RESERVATION_STATUSES:
+        return None, None
+    text = str(value).strip()
+    text = STATUS_ALIASES.get(text, text) or DEFAULT_STATUS
+    return "unknown_status", text if text in RESERVATION_STATUSES else None
+
+def _check_names(value):
+    names = str(value).split(";") if value != "" else []
+    cleaned = []
+    for n in names:
+        n = n.strip()
+        if n and n not in cleaned:
+            cleaned.append(n)
+    if cleaned == names:
+        return None, None
+    return "duplicate_names", ";".join(cleaned)
+
+def check_row(header, row):
+    """
+    1行分の問題を探す
+
+    Args:
+        header: ヘッダー
+        row: ヘッダーと同じ列数の値
+
+    日付が空・読めない行は、シートで直接直してもらう行なので、他の問題も自動では直さない
+    （既定の時刻やステータスを書き込んで、内容のない行を予約らしくしてしまわないため）。
+
+    Returns:
+        list: [{"kind", "column", "value", "fix"}, ...]  fix が None のものは自動では直せない
+    """
+    if not any(str(v).strip() for v in row):
+        return []
+    issues = []
+    for col, value in zip(header, row):
+        if col == "date":
+            kind, fix = _check_date(value)
+        elif col in TIME_COLUMNS:
+            kind, fix = _check_time(value, *TIME_COLUMNS[col])
+        elif col == "status":
+            kind, fix = _check_status(value)
+        elif col in LIST_COLUMNS:
+            kind, fix = _check_names(value)
+        else:
+            continue
+        if kind:
+            issues.append({"kind": kind, "column": col, "value": value, "fix": fix})
+    if any(i["kind"] in ("blank_date", "bad_date") for i in issues):
+        for i in issues:
+            i["fix"] = None
+    return issues
+
+def scan_reservations(worksheet, log_sheet=None, chunk_rows=CHUNK_ROWS):
+    """
+    シート全体を分割して読み、問題のある行を探す
+
+    Args:
+        worksheet: reservations シート
+        log_sheet: changelog シート（修復する場合に指定。読み込み前の長さを記録する）
+        chunk_rows: 1回に読む行数
+
+    Returns:
+        dict: {"header", "rows"（読んだデータ行数）, "issues"（各要素に行番号 "row" と読んだ行の値 "cells" を追加）, "log_length"}
+    """
+    log_length = len(run_with_retry(log_sheet.get_values, "A:A")) if log_sheet is not None else None
+    header = run_with_retry(worksheet.row_values, 1)
+    result = {"header": header, "rows": 0, "issues": [], "log_length": log_length}
+    if not header:
+        return result
+    for first, chunk in iter_row_chunks(worksheet, len(header), chunk_rows):
+        for i, row in enumerate(chunk):
+            for issue in check_row(header, row):
+                # シート上の行番号 = 位置 + 2（1行目はヘッダー）
+                result["issues"].append(dict(issue, row=first + i + 2, cells=row))
+        result["rows"] = first + len(chunk)
+    return result
+
+def summarize(issues):
+    """
+    種類ごとの件数と行番号
+
+    Returns:
+        dict: {種類: {"count", "rows", "fixable"}}  ISSUE_LABELS の順
+    """
+    summary = {}
+    for kind in ISSUE_LABELS:
+        found = [i for i in issues if i["kind"] == kind]
+        if not found: continue
+        summary[kind] = {
+            "count": len(found),
+            "rows": sorted({i["row"] for i in found}),
+            "fixable": sum(1 for i in found if i["fix"] is not None),
+        }
+    return summary
+
+def build_repair_batch(header, issues):
+    """
+    修正できる問題を batch_update のデータにする（セル単位）
+    """
+    return [
+        {"range": rowcol_to_a1(i["row"], header.index(i["column"]) + 1), "values": [[i["fix"]]]}
+        for i in issues if i["fix"] is not None
+    ]
+
+def unchanged_rows(worksheet, header, issues):
+    """
+    修正する行を読み直し、チェックした時と同じ内容の行番号だけを返す（1回の batch_get）
+
+    シートを直接編集された場合は変更ログに残らないため、行の内容で確かめる。
+    """
+    rows = sorted({i["row"] for i in issues if i["fix"] is not None})
+    if not rows: return set()
+    width = len(header)
+    current = run_with_retry(worksheet.batch_get, [f"{rowcol_to_a1(r, 1)}:{rowcol_to_a1(r, width)}" for r in rows])
+    scanned = {i["row"]: i["cells"] for i in issues}
+    same = set()
+    for r, values in zip(rows, current):
+        cells = (list(values[0]) if values else []) + [""] * width
+        if [str(v) for v in cells[:width]] == [str(v) for v in scanned[r]]:
+            same.add(r)
+    return same
+
+def repair_reservations(worksheet, log_sheet, scan):
+    """
+    修正を1回の batch_update で書き込み、変更ログに reload を記録する
+
+    セル単位で書き込むため、読み込んだ後に行が追加・削除されていると別の行を書き換えてしまう。
+    読み込み前後で変更ログの長さが変わっていた場合は書き込まずに中止する。
+    さらに書き込む直前に対象の行を読み直し、チェックした時から変わっていた行（シートの直接編集など）は書き込まない。
+
+    Args:
+        worksheet: reservations シート
+        log_sheet: changelog シート
+        scan: scan_reservations(worksheet, log_sheet) の結果
+
+    Returns:
+        dict: {"written": 書き込んだセル数, "skipped_rows": 変わっていたため書き込まなかった行番号}
+    """
+    if not build_repair_batch(scan["header"], scan["issues"]):
+        return {"written": 0, "skipped_rows": []}
+    if len(run_with_retry(log_sheet.get_values, "A:A")) != scan["log_length"]:
+        raise RuntimeError("チェック中に予約が更新されました。もう一度実行してください")
+    same = unchanged_rows(worksheet, scan["header"], scan["issues"])
+    skipped = sorted({i["row"] for i in scan["issues"] if i["fix"] is not None and i["row"] not in same})
+    data = build_repair_batch(scan["header"], [i for i in scan["issues"] if i["row"] in same])
+    if not data:
+        return {"written": 0, "skipped_rows": skipped}
+    run_with_retry(worksheet.batch_update, data)
+    # 各プロセスの ReservationStore に全件読み直しさせる
+    append_reload(log_sheet)
+    return {"written": len(data), "skipped_rows": skipped}
+
+def format_report(scan, limit=20):
+    """
+    表示用のテキスト（行番号は limit 件まで）
+    """
+    summary = summarize(scan["issues"])
+    lines = [f"チェックした行: {scan['rows']}行"]
+    if not summary:
+        lines.append("問題は見つかりませんでした")
+    for kind, s in summary.items():
+        rows = ", ".join(map(str, s["rows"][:limit])) + (" ..." if len(s["rows"]) > limit else "")
+        fixable = f"（修正可能 {s['fixable']}件）" if s["fixable"] else "（自動では修正できません）"
+        lines.append(f"{ISSUE_LABELS[kind]}: {s['count']}件{fixable}")
+        lines.append(f"  行番号: {rows}")
+    return "\n".join(lines)
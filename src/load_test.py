@@ -0,0 +1,506 @@
+"""
+tennis_app.py の同時アクセス負荷テスト
+
+Google Sheets の代わりにプロセス内の疑似ワークシート（API クォータ付き）を使い、
+Streamlit の AppTest で複数セッションを同時に動かして、
+操作ごとの応答時間（p50/p95）・Sheets API 呼び出し回数・更新消失件数を集計する。
+
+使い方:
+    python src/load_test.py --sessions 10 --iterations 3
+"""
+import argparse
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import date, timedelta
+from unittest import mock
+
+import gspread
+import streamlit
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_to_rowcol
+from streamlit import config
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from streamlit.runtime.secrets import Secrets
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tennis_app.py")
+
+RESERVATION_HEADER = [
+    "date", "facility", "status", "start_hour", "start_minute",
+    "end_hour", "end_minute", "participants", "absent", "consider", "message"
+]
+
+# セッションを識別するための session_state のキー（API 呼び出しの集計に使う）
+SESSION_LABEL_KEY = "_load_test_session"
+
+READ_METHODS = {"get_all_records", "get_all_values", "get_values", "batch_get", "row_values"}
+
+
+# ==========================================
+# 1. 疑似 Google Sheets
+# ==========================================
+
+class _QuotaResponse:
+    """APIError に渡す 429 応答の代わり"""
+    status_code = 429
+    text = "Quota exceeded"
+
+    def json(self):
+        return {"error": {"code": 429, "message": self.text, "status": "RESOURCE_EXHAUSTED"}}
+
+
+class QuotaLimiter:
+    """
+    Sheets API の「1分あたりの読み取り/書き込みリクエスト数」制限を再現する
+
+    Args:
+        reads_per_minute: 1分あたりの読み取り上限
+        writes_per_minute: 1分あたりの書き込み上限
+    """
+    def __init__(self, reads_per_minute=60, writes_per_minute=60):
+        self.limits = {"read": reads_per_minute, "write": writes_per_minute}
+        self.windows = {"read": deque(), "write": deque()}
+        self.rejected = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def acquire(self, kind):
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows[kind]
+            while window and now - window[0] >= 60:
+                window.popleft()
+            if len(window) >= self.limits[kind]:
+                self.rejected[kind] += 1
+                raise APIError(_QuotaResponse())
+            window.append(now)
+
+
+class CallLog:
+    """セッションごとの API 呼び出し回数"""
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def record(self, method):
+        label = "-"
+        ctx = get_script_run_ctx()
+        if ctx is not None:
+            try:
+                label = ctx.session_state[SESSION_LABEL_KEY]
+            except KeyError:
+                pass
+        with self.lock:
+            self.counts[label] += 1
+
+    def count(self, label):
+        with self.lock:
+            return self.counts[label]
+
+
+class FakeWorksheet:
+    """
+    gspread.Worksheet のうちアプリが使うメソッドだけを持つインメモリ実装
+
+    値はすべて文字列で保持し、get_all_records では実物と同様に数値へ変換して返す。
+    """
+    def __init__(self, title, rows, quota, call_log):
+        self.title = title
+        self.rows = [[str(v) for v in r] for r in rows]
+        self.quota = quota
+        self.call_log = call_log
+        self.lock = threading.Lock()
+
+    def _call(self, method):
+        self.quota.acquire("read" if method in READ_METHODS else "write")
+        self.call_log.record(method)
+
+    def _write_range(self, range_name, values):
+        start = range_name.split("!")[-1].split(":")[0]
+        if not re.search(r"\d", start):
+            start += "1"
+        row, col = a1_to_rowcol(start)
+        for i, vals in enumerate(values):
+            while len(self.rows) < row + i:
+                self.rows.append([])
+            target = self.rows[row + i - 1]
+            for j, v in enumerate(vals):
+                while len(target) < col + j:
+                    target.append("")
+                target[col + j - 1] = str(v)
+
+    def _read_range(self, range_name):
+        start, _, end = range_name.split("!")[-1].partition(":")
+        row1, col1 = a1_to_rowcol(start if re.search(r"\d", start) else start + "1")
+        if not end:
+            row2, col2 = row1, col1
+        else:
+            m = re.match(r"([A-Z]*)(\d*)$", end)
+            col2 = a1_to_rowcol(m.group(1) + "1")[1] if m.group(1) else max(len(r) for r in self.rows or [[]])
+            row2 = int(m.group(2)) if m.group(2) else len(self.rows)
+        return [r[col1 - 1:col2] for r in self.rows[row1 - 1:row2]]
+
+    @property
+    def row_count(self):
+        return max(len(self.rows), 1000)
+
+    def get_all_records(self, **kwargs):
+        self._call("get_all_records")
+        with self.lock:
+            if not self.rows:
+                return []
+            header = self.rows[0]
+            records = []
+            for r in self.rows[1:]:
+                r = r + [""] * (len(header) - len(r))
+                rec = {}
+                for key, v in zip(header, r):
+                    try:
+                        rec[key] = int(v)
+                    except ValueError:
+                        rec[key] = v
+                records.append(rec)
+            return records
+
+    def get_all_values(self, **kwargs):
+        self._call("get_all_values")
+        with self.lock:
+            return [list(r) for r in self.rows]
+
+    def get_values(self, range_name=None, **kwargs):
+        self._call("get_values")
+        with self.lock:
+            if range_name is None:
+                return [list(r) for r in self.rows]
+            return self._read_range(range_name)
+
+    def row_values(self, row, **kwargs):
+        self._call("row_values")
+        with self.lock:
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def batch_get(self, ranges, **kwargs):
+        self._call("batch_get")
+        with self.lock:
+            return [self._read_range(r) for r in ranges]
+
+    def batch_clear(self, ranges):
+        self._call("batch_clear")
+        with self.lock:
+            for r in ranges:
+                start, _, end = r.partition(":")
+                row1, col1 = a1_to_rowcol(start)
+                row2, col2 = a1_to_rowcol(end or start)
+                for row in self.rows[row1 - 1:row2]:
+                    for c in range(col1 - 1, min(col2, len(row))):
+                        row[c] = ""
+
+    def clear(self):
+        self._call("clear")
+        with self.lock:
+            self.rows = []
+
+    def update(self, values=None, range_name=None, **kwargs):
+        self._call("update")
+        # 旧形式 update(range_name, values) にも対応
+        if isinstance(values, str):
+            values, range_name = range_name, values
+        with self.lock:
+            self._write_range(range_name or "A1", values)
+
+    def batch_update(self, data, **kwargs):
+        self._call("batch_update")
+        with self.lock:
+            for d in data:
+                self._write_range(d["range"], d["values"])
+
+    def append_rows(self, values, **kwargs):
+        self._call("append_rows")
+        with self.lock:
+            self.rows.extend([[str(v) for v in r] for r in values])
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values], **kwargs)
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheets, quota, call_log):
+        self.worksheets = worksheets
+        self.quota = quota
+        self.call_log = call_log
+
+    def worksheet(self, name):
+        if name not in self.worksheets:
+            raise WorksheetNotFound(name)
+        return self.worksheets[name]
+
+    def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+        ws = FakeWorksheet(title, [], self.quota, self.call_log)
+        self.worksheets[title] = ws
+        return ws
+
+
+class FakeClient:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+
+def build_fake_spreadsheet(quota, call_log, num_reservations=30):
+    """
+    テスト用の初期データ（予約・施設・抽選期間）を持つ疑似スプレッドシートを作る
+    """
+    today = date.today()
+    facilities = ["市民コート", "中央公園", "河川敷テニス場"]
+    reservations = [RESERVATION_HEADER]
+    for i in range(num_reservations):
+        d = today + timedelta(days=i - num_reservations // 3)
+        reservations.append([
+            d.isoformat(), facilities[i % len(facilities)], "確保" if i % 2 else "抽選中",
+            9 + i % 4, 0, 11 + i % 4, 0, "", "", "", ""
+        ])
+    sheets = {
+        "reservations": reservations,
+        "facilities": [["name", "url", "address"]] + [[f, "", ""] for f in facilities],
+        "lottery_periods": [
+            ["enabled", "frequency", "start_day", "end_day", "messages"],
+            ["true", "monthly", 1, 31, "抽選受付中です"],
+        ],
+    }
+    worksheets = {name: FakeWorksheet(name, rows, quota, call_log) for name, rows in sheets.items()}
+    return FakeSpreadsheet(worksheets, quota, call_log)
+
+
+# ==========================================
+# 2. セッションの操作シナリオ
+# ==========================================
+
+class SimulatedSession:
+    """
+    1人のメンバーの操作（カレンダー表示→予定クリック→参加表明→新規登録）を AppTest で再現する
+    """
+    def __init__(self, name, call_log, recorder, num_reservations):
+        self.name = name
+        self.call_log = call_log
+        self.recorder = recorder
+        self.num_reservations = num_reservations
+        self.expected_participations = []
+        self.expected_bookings = []
+        self.errors = []
+        # secrets は shared_runtime_patches() でプロセス全体に設定済み
+        self.at = AppTest.from_file(APP_PATH, default_timeout=120)
+        self.at.session_state[SESSION_LABEL_KEY] = name
+
+    def _measure(self, action, func):
+        calls_before = self.call_log.count(self.name)
+        started = time.perf_counter()
+        try:
+            func()
+            if self.at.exception:
+                self.errors.append(f"{action}: {self.at.exception[0].message}")
+        except Exception as e:
+            self.errors.append(f"{action}: {e}")
+        elapsed = time.perf_counter() - started
+        self.recorder.record(action, elapsed, self.call_log.count(self.name) - calls_before)
+
+    def _click(self, label):
+        for b in self.at.button:
+            if b.label == label:
+                b.click().run()
+                return
+        raise LookupError(f"ボタン「{label}」が見つかりません")
+
+    def open_calendar(self):
+        self.at.run()
+
+    def click_event(self, idx):
+        self.at.session_state["is_popup_open"] = True
+        self.at.session_state["popup_mode"] = "edit"
+        self.at.session_state["active_event_idx"] = idx
+        self.at.run()
+
+    def toggle_participation(self, idx):
+        self.at.selectbox(key="edit_nick").set_value("新規入力").run()
+        self.at.text_input(key="edit_nick_input").set_value(self.name).run()
+        self.at.radio(key="edit_type").set_value("参加").run()
+        self._click("反映する")
+        self.expected_participations.append(idx)
+
+    def add_booking(self, iteration):
+        tag = f"{self.name}-{iteration}"
+        self.at.session_state["is_popup_open"] = True
+        self.at.session_state["popup_mode"] = "new"
+        self.at.session_state["clicked_date"] = date.today().isoformat()
+        self.at.run()
+        next(s for s in self.at.selectbox if s.label == "施設名").set_value("市民コート").run()
+        self.at.text_area[0].set_value(tag).run()
+        self._click("登録する")
+        self.expected_bookings.append(tag)
+
+    def run(self, iterations, seed):
+        self._measure("open_calendar", self.open_calendar)
+        for i in range(iterations):
+            idx = (seed + i) % self.num_reservations
+            self._measure("click_event", lambda: self.click_event(idx))
+            self._measure("toggle_participation", lambda: self.toggle_participation(idx))
+            self._measure("add_booking", lambda: self.add_booking(i))
+
+
+class ResultRecorder:
+    """操作ごとの応答時間と API 呼び出し回数を集める"""
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.api_calls = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def record(self, action, elapsed, api_calls):
+        with self.lock:
+            self.latencies[action].append(elapsed)
+            self.api_calls[action].append(api_calls)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def count_lost_updates(spreadsheet, sessions):
+    """
+    シートの最終状態と各セッションが行った更新を突き合わせ、消えた更新を数える
+
+    Returns:
+        tuple: (消えた参加表明の件数, 消えた新規登録の件数)
+    """
+    rows = spreadsheet.worksheet("reservations").rows
+    header = rows[0]
+    records = [dict(zip(header, r + [""] * (len(header) - len(r)))) for r in rows[1:]]
+    messages = {rec.get("message", "") for rec in records}
+
+    lost_participations = 0
+    lost_bookings = 0
+    for s in sessions:
+        for idx in s.expected_participations:
+            names = records[idx].get("participants", "").split(";") if idx < len(records) else []
+            if s.name not in names:
+                lost_participations += 1
+        for tag in s.expected_bookings:
+            if tag not in messages:
+                lost_bookings += 1
+    return lost_participations, lost_bookings
+
+
+# ==========================================
+# 3. 実行
+# ==========================================
+
+def shared_runtime_patches(spreadsheet):
+    """
+    複数の AppTest を同時に動かすためのパッチ一式
+
+    AppTest は実行のたびに Runtime・st.secrets・設定値をグローバルに差し替えて元に戻すため、
+    そのままでは並行実行中の他セッションを壊してしまう。
+    負荷テスト中はこれらを共有のものに固定し、Sheets 接続を疑似クライアントに向ける。
+    """
+    runtime = mock.MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+
+    secrets = Secrets()
+    # API の上限は QuotaLimiter で再現するため、アプリ側のグループごとの上限は外す
+    secrets._secrets = {
+        "google": {"GSHEET_ID": "load-test"},
+        "tenancy": {"reads_per_minute": 10 ** 6, "writes_per_minute": 10 ** 6},
+    }
+    config.set_option("global.appTest", True)
+
+    return [
+        mock.patch.object(Runtime, "instance", classmethod(lambda cls: runtime)),
+        mock.patch.object(Runtime, "exists", classmethod(lambda cls: True)),
+        mock.patch.object(streamlit, "secrets", secrets),
+        mock.patch.object(gspread, "authorize", lambda creds: FakeClient(spreadsheet)),
+        mock.patch(
+            "google.oauth2.service_account.Credentials.from_service_account_info",
+            lambda *args, **kwargs: object()
+        ),
+    ]
+
+
+def run_load_test(num_sessions, iterations, reads_per_minute, writes_per_minute, num_reservations):
+    quota = QuotaLimiter(reads_per_minute, writes_per_minute)
+    call_log = CallLog()
+    spreadsheet = build_fake_spreadsheet(quota, call_log, num_reservations)
+    recorder = ResultRecorder()
+
+    patches = shared_runtime_patches(spreadsheet)
+    for p in patches:
+        p.start()
+    try:
+        sessions = [
+            SimulatedSession(f"member{i:02}", call_log, recorder, num_reservations)
+            for i in range(num_sessions)
+        ]
+        threads = [
+            threading.Thread(target=s.run, args=(iterations, i), name=s.name)
+            for i, s in enumerate(sessions)
+        ]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall_time = time.perf_counter() - started
+    finally:
+        for p in patches:
+            p.stop()
+
+    lost = count_lost_updates(spreadsheet, sessions)
+    return recorder, quota, sessions, lost, wall_time
+
+
+def print_report(recorder, quota, sessions, lost, wall_time):
+    print(f"{'action':<22}{'count':>6}{'p50[s]':>9}{'p95[s]':>9}{'api/op':>8}")
+    for action in ["open_calendar", "click_event", "toggle_participation", "add_booking"]:
+        lat = recorder.latencies.get(action, [])
+        calls = recorder.api_calls.get(action, [])
+        avg_calls = sum(calls) / len(calls) if calls else 0.0
+        print(f"{action:<22}{len(lat):>6}{percentile(lat, 50):>9.3f}{percentile(lat, 95):>9.3f}{avg_calls:>8.1f}")
+    print()
+    print(f"経過時間: {wall_time:.1f}s")
+    print(f"クォータ超過 (read/write): {quota.rejected['read']}/{quota.rejected['write']}")
+    print(f"消えた参加表明: {lost[0]}件 / 消えた新規登録: {lost[1]}件")
+    errors = [e for s in sessions for e in s.errors]
+    if errors:
+        print(f"エラー: {len(errors)}件")
+        for e in errors[:10]:
+            print(f"  {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tennis_app.py の同時アクセス負荷テスト")
+    parser.add_argument("--sessions", type=int, default=5, help="同時セッション数")
+    parser.add_argument("--iterations", type=int, default=2, help="1セッションあたりの操作の繰り返し回数")
+    parser.add_argument("--reads-per-minute", type=int, default=60, help="読み取りクォータ（回/分）")
+    parser.add_argument("--writes-per-minute", type=int, default=60, help="書き込みクォータ（回/分）")
+    parser.add_argument("--reservations", type=int, default=30, help="初期データの予約件数")
+    args = parser.parse_args()
+
+    result = run_load_test(
+        args.sessions, args.iterations,
+        args.reads_per_minute, args.writes_per_minute, args.reservations
+    )
+    print_report(*result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+予約データの定期メンテナンス
+
+日付が過ぎた予約のステータスを「完了」に更新する（DATA_SPEC.md 運用ルール 3）。
+Streamlit アプリ内で毎日実行されるほか、コマンドラインからも実行できる。
+
+使い方:
+    python src/maintenance.py [--group default] [--secrets .streamlit/secrets.toml] complete-past [--dry-run]
+    python src/maintenance.py [--group default] [--secrets .streamlit/secrets.toml] check [--fix]
+"""
+import argparse
+import logging
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+
+from change_log import CHANGELOG_SHEET, CHANGELOG_COLUMNS, append_reload
+from integrity import format_report, repair_reservations, scan_reservations
+from sheets_common import (
+    TERMINAL_STATUSES, jst_today, load_secrets, open_worksheet, open_or_create_worksheet, run_with_retry,
+)
+from tenants import DEFAULT_GROUP, load_group_sheets
+
+COMPLETED_STATUS = "完了"
+
+logger = logging.getLogger(__name__)
+
+
+def build_date_index(date_values):
+    """
+    日付列から (日付, シート上の行番号) の昇順インデックスを作る
+
+    Args:
+        date_values: 2行目以降の日付セルの値（ヘッダーを除く）
+
+    Returns:
+        tuple: (日付のリスト, 行番号のリスト)  どちらも日付の昇順
+    """
+    dates = pd.to_datetime(pd.Series(date_values, dtype="object"), errors="coerce")
+    valid = dates.dropna().sort_values(kind="stable")
+    # シート上の行番号 = 位置 + 2（1行目はヘッダー）
+    return valid.dt.date.tolist(), (valid.index + 2).tolist()
+
+def find_past_open_rows(date_values, status_values, today):
+    """
+    日付が today より前で、ステータスが終端（中止・完了）でない行を探す
+
+    Args:
+        date_values: 日付セルの値（ヘッダーを除く）
+        status_values: ステータスセルの値（ヘッダーを除く）
+        today: 基準日
+
+    Returns:
+        list: シート上の行番号
+    """
+    dates, rows = build_date_index(date_values)
+    end = bisect_left(dates, today)
+    targets = []
+    for row in rows[:end]:
+        pos = row - 2
+        status = status_values[pos] if pos < len(status_values) else ""
+        if status not in TERMINAL_STATUSES:
+            targets.append(row)
+    return sorted(targets)
+
+def still_past_open_rows(worksheet, date_col, status_col, rows, today):
+    """
+    対象の行の日付・ステータスを読み直し、まだ過去で終端でない行番号だけを返す（1回の batch_get）
+
+    シートを直接編集された場合は変更ログに残らないため、セルの内容で確かめる。
+    """
+    ranges = []
+    for row in rows:
+        ranges += [rowcol_to_a1(row, date_col), rowcol_to_a1(row, status_col)]
+    cells = run_with_retry(worksheet.batch_get, ranges)
+    values = [c[0][0] if c and c[0] else "" for c in cells]
+    return [
+        row for row, d, status in zip(rows, values[0::2], values[1::2])
+        if find_past_open_rows([d], [status], today)
+    ]
+
+def complete_past_reservations(worksheet, log_sheet, today=None, dry_run=False):
+    """
+    過去の予約のステータスを「完了」に更新する
+
+    日付列とステータス列だけを読み、対象セルのみを1回の batch_update で書き込み、変更ログに reload を記録する。
+    セル単位で書き込むため、読み込んだ後に行が追加・削除されていると別の行を書き換えてしまう。
+    読み込み前後で変更ログの長さが変わっていた場合は書き込まずに中止する。
+    さらに書き込む直前に対象の行を読み直し、まだ過去で終端でない行だけを書き込む。
+
+    Args:
+        worksheet: reservations シート
+        log_sheet: changelog シート
+        today: 基準日（省略時は JST の今日）
+        dry_run: True の場合は書き込まない
+
+    Returns:
+        list: 更新した（dry_run の場合は更新対象の）行番号
+
+    Raises:
+        RuntimeError: 読み込み中に予約が更新された場合
+    """
+    today = today or jst_today()
+
+    log_length = len(run_with_retry(log_sheet.get_values, "A:A"))
+    header = run_with_retry(worksheet.row_values, 1)
+    if "date" not in header or "status" not in header:
+        return []
+    date_col = header.index("date") + 1
+    status_col = header.index("status") + 1
+
+    date_range = f"{rowcol_to_a1(2, date_col)}:{rowcol_to_a1(worksheet.row_count, date_col)}"
+    status_range = f"{rowcol_to_a1(2, status_col)}:{rowcol_to_a1(worksheet.row_count, status_col)}"
+    date_cells, status_cells = run_with_retry(worksheet.batch_get, [date_range, status_range])
+
+    date_values = [r[0] if r else "" for r in date_cells]
+    status_values = [r[0] if r else "" for r in status_cells]
+    rows = find_past_open_rows(date_values, status_values, today)
+    if not rows or dry_run:
+        return rows
+
+    if len(run_with_retry(log_sheet.get_values, "A:A")) != log_length:
+        raise RuntimeError("読み込み中に予約が更新されました。もう一度実行してください")
+    rows = still_past_open_rows(worksheet, date_col, status_col, rows, today)
+    if rows:
+        data = [
+            {"range": rowcol_to_a1(row, status_col), "values": [[COMPLETED_STATUS]]}
+            for row in rows
+        ]
+        run_with_retry(worksheet.batch_update, data)
+        append_reload(log_sheet)
+    return rows
+
+
+# ==========================================
+# 定期実行
+# ==========================================
+
+def seconds_until_next_run(hour, minute, now=None):
+    """
+    次の実行時刻（JST）までの秒数
+
+    Args:
+        hour: 実行時（JST）
+        minute: 実行分
+        now: 現在時刻（UTC, naive）
+    """
+    jst_now = (now or datetime.utcnow()) + timedelta(hours=9)
+    next_run = jst_now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if next_run <= jst_now:
+        next_run += timedelta(days=1)
+    return (next_run - jst_now).total_seconds()
+
+def start_daily_scheduler(job, hour=0, minute=5, run_now=True):
+    """
+    job を毎日 hour:minute（JST）に実行するデーモンスレッドを起動する
+
+    例外はログ出力のみとし、翌日も続けて実行する。
+
+    Args:
+        job: 引数なしで呼び出す関数
+        hour: 実行時（JST）
+        minute: 実行分
+        run_now: True の場合は起動直後にも1回実行する
+
+    Returns:
+        threading.Thread
+    """
+    def _loop():
+        if run_now:
+            _run_job()
+        while True:
+            time.sleep(seconds_until_next_run(hour, minute))
+            _run_job()
+
+    def _run_job():
+        try:
+            job()
+        except Exception:
+            logger.exception("定期処理に失敗しました")
+
+    thread = threading.Thread(target=_loop, name="daily-maintenance", daemon=True)
+    thread.start()
+    return thread
+
+
+# ==========================================
+# コマンドライン
+# ==========================================
+
+def main():
+    parser = argparse.ArgumentParser(description="予約データの定期メンテナンス")
+    parser.add_argument("--secrets", default=None, help="secrets.toml のパス")
+    parser.add_argument("--group", default=DEFAULT_GROUP, help="グループ名（secrets の [groups]）")
+    sub = parser.add_subparsers(dest="command", required=True)
+    complete = sub.add_parser("complete-past", help="日付が過ぎた予約を「完了」にする")
+    complete.add_argument("--dry-run", action="store_true", help="更新対象を表示するだけで書き込まない")
+    check = sub.add_parser("check", help="予約データの不整合（日付・時刻・ステータス・名前の重複）を調べる")
+    check.add_argument("--fix", action="store_true", help="修正できるものを1回の書き込みで修正する")
+    args = parser.parse_args()
+
+    secrets = load_secrets(args.secrets) if args.secrets else load_secrets()
+    google = secrets["google"]
+    sheet_id = load_group_sheets(secrets).get(args.group)
+    if sheet_id is None:
+        parser.error(f"グループ {args.group} のスプレッドシートが設定されていません")
+    worksheet = open_worksheet(google, sheet_id, "reservations")
+    log_sheet = open_or_create_worksheet(google, sheet_id, CHANGELOG_SHEET, CHANGELOG_COLUMNS)
+
+    if args.command == "complete-past":
+        rows = complete_past_reservations(worksheet, log_sheet, dry_run=args.dry_run)
+        label = "更新対象" if args.dry_run else "完了に更新"
+        print(f"{label}: {len(rows)}件")
+        if rows:
+            print("行番号: " + ", ".join(map(str, rows)))
+
+    elif args.command == "check":
+        scan = scan_reservations(worksheet, log_sheet)
+        print(format_report(scan))
+        if args.fix:
+            result = repair_reservations(worksheet, log_sheet, scan)
+            print(f"修正: {result['written']}セル")
+            if result["skipped_rows"]:
+                print(f"チェック後に変更されていたため修正しなかった行: {', '.join(map(str, result['skipped_rows']))}")
+
+
+if __name__ == "__main__":
+    main()
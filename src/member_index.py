@@ -0,0 +1,140 @@
+"""
+参加者ごとの予約の索引と参加状況の集計
+
+MemberIndex は「ニックネーム → 参加/保留/不参加ごとの予約の行インデックス」を持つ。
+予約データ全体を毎回走査せずに、ある人の予定をすぐに取り出すために使う。
+集計は participants / absent / consider を縦持ち（1人1行）に展開してから groupby で行う。
+"""
+import pandas as pd
+
+# 列 → 表示名
+ROLES = {"participants": "参加", "consider": "保留", "absent": "不参加"}
+
+# 集計から除くステータス
+EXCLUDED_STATUSES = ["中止"]
+
+
+def _names(value):
+    if isinstance(value, (list, tuple)):
+        return [n for n in value if n]
+    return []
+
+
+class MemberIndex:
+    """
+    ニックネーム → {列名: 予約の行インデックスの集合}
+    """
+    def __init__(self):
+        self.index = {}
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        予約データ全体から作る
+
+        Args:
+            df: load_reservations() の結果
+        """
+        index = cls()
+        for col in ROLES:
+            if col not in df.columns: continue
+            for idx, names in zip(df.index, df[col]):
+                for name in _names(names):
+                    index.index.setdefault(name, {c: set() for c in ROLES})[col].add(idx)
+        return index
+
+    def set_roles(self, idx, lists):
+        """
+        予約1件分の参加者を差し替える（参加表明を変更した時の差分更新）
+
+        Args:
+            idx: 予約の行インデックス
+            lists: {"participants": [...], "consider": [...], "absent": [...]}
+        """
+        for roles in self.index.values():
+            for ids in roles.values():
+                ids.discard(idx)
+        for col, names in lists.items():
+            for name in _names(names):
+                self.index.setdefault(name, {c: set() for c in ROLES})[col].add(idx)
+
+    def reservations(self, member, roles=("participants", "consider")):
+        """
+        その人の予約の行インデックス
+
+        Args:
+            member: ニックネーム
+            roles: 対象の列
+
+        Returns:
+            dict: {行インデックス: 列名}
+        """
+        entry = self.index.get(member, {})
+        return {idx: col for col in roles for idx in entry.get(col, ())}
+
+    def members(self):
+        return sorted(self.index)
+
+
+def attendance_frame(df):
+    """
+    参加表明を1人1行の縦持ちにする
+
+    Returns:
+        DataFrame: reservation, date, month, facility, status, member, role
+    """
+    columns = ["reservation", "date", "month", "facility", "status", "member", "role"]
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    base = df[["date", "facility", "status"]].copy()
+    base["reservation"] = df.index
+    base["month"] = pd.to_datetime(base["date"], errors="coerce").dt.strftime("%Y-%m")
+    parts = []
+    for col, label in ROLES.items():
+        if col not in df.columns: continue
+        part = base.assign(member=df[col]).explode("member")
+        part = part[part["member"].notna() & (part["member"] != "")]
+        parts.append(part.assign(role=label))
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True)[columns]
+
+def member_monthly_stats(long_df, member=None):
+    """
+    参加者・月ごとの参加/保留/不参加の回数と参加率
+
+    Args:
+        long_df: attendance_frame() の結果
+        member: 指定した場合はその人だけ
+
+    Returns:
+        DataFrame: member, month, 参加, 保留, 不参加, 回答数, 参加率
+    """
+    data = long_df[~long_df["status"].isin(EXCLUDED_STATUSES) & long_df["month"].notna()]
+    if member is not None:
+        data = data[data["member"] == member]
+    counts = data.groupby(["member", "month", "role"]).size().unstack("role", fill_value=0)
+    counts = counts.reindex(columns=list(ROLES.values()), fill_value=0)
+    counts["回答数"] = counts.sum(axis=1)
+    counts["参加率"] = (counts["参加"] / counts["回答数"]).round(2)
+    return counts.reset_index()
+
+def facility_monthly_stats(df, long_df):
+    """
+    施設・月ごとの予約数と参加人数
+
+    Args:
+        df: load_reservations() の結果
+        long_df: attendance_frame() の結果
+
+    Returns:
+        DataFrame: facility, month, 予約数, 参加人数, 1回あたり参加人数
+    """
+    active = df[~df["status"].isin(EXCLUDED_STATUSES)]
+    months = pd.to_datetime(active["date"], errors="coerce").dt.strftime("%Y-%m")
+    reservations = active.groupby([active["facility"], months.rename("month")]).size().rename("予約数")
+    joined = long_df[(long_df["role"] == ROLES["participants"]) & ~long_df["status"].isin(EXCLUDED_STATUSES)]
+    people = joined.groupby(["facility", "month"]).size().rename("参加人数")
+    stats = pd.concat([reservations, people], axis=1).fillna(0).astype(int)
+    stats["1回あたり参加人数"] = (stats["参加人数"] / stats["予約数"].where(stats["予約数"] > 0)).round(1)
+    return stats.reset_index()
@@ -0,0 +1,339 @@
+"""
+オフライン（Sheets API に接続できない時）の動作
+
+* 読み込み: 最後に取得できた予約データ（ディスクにも保存）を表示する
+* 書き込み: 変更内容をローカルのジャーナル（JSON Lines、1行ずつ fsync）に記録する
+* 復旧後: ジャーナルを記録順に Sheets に反映する。記録時の内容（before）と
+  シートの現在の行が一致しない変更は競合として適用せず、別ファイルに残す
+
+ジャーナルは同じホストの複数プロセスで共有するため、読み書きはファイルロックの中で行う。
+反映は1度に1つのセッション（プロセス）だけが行う。記録ごとに ID を付け、反映した記録の ID を
+変更ログ（changelog）に残す。シートへの書き込み後にジャーナルから取り除けなかった場合も、
+変更ログにある ID の記録はもう一度適用しない（行の内容からは判断しない。同じ内容の行は同じ日時・施設の
+コート2面などで普通にある）。
+
+接続に失敗した後は RETRY_SECONDS の間 API を呼ばずにオフラインのまま動作する
+（失敗のたびに run_with_retry の待ち時間がかかるのを避ける）。
+"""
+import contextlib
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from change_log import applied_journal_ids, diff_rows
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    # Windows
+    import msvcrt
+    fcntl = None
+
+JOURNAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "journal")
+
+# 接続失敗後、次に API を試すまでの秒数
+RETRY_SECONDS = 30
+
+
+def _now_jst():
+    return (datetime.utcnow() + timedelta(hours=9)).isoformat(timespec="seconds")
+
+@contextlib.contextmanager
+def file_lock(path, blocking=True):
+    """
+    プロセス間（同じプロセスの別スレッドも含む）で排他するファイルロック
+
+    Args:
+        path: ロックに使うファイルのパス
+        blocking: 他が持っている場合に待つか（False なら待たずに False を返す）
+
+    Yields:
+        bool: ロックを取れたか
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a+") as f:
+        try:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            locked = True
+        except OSError:
+            locked = False
+        try:
+            yield locked
+        finally:
+            if locked:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def record_changes(old_rows, new_rows):
+    """
+    変更前後の行から、ジャーナルに記録する変更の一覧を作る
+
+    diff_rows() の結果に、変更・削除する行の変更前の値（before）を加える。
+
+    Returns:
+        list: [{"op", "pos", "before", "after"}, ...]
+    """
+    rows = [list(r) for r in old_rows]
+    changes = []
+    for op, pos, values in diff_rows(old_rows, new_rows):
+        before = rows[pos] if op in ("update", "delete") else None
+        change = {"op": op, "pos": pos, "before": before, "after": values}
+        if op == "insert":
+            rows.insert(pos, values)
+        elif op == "update":
+            rows[pos] = values
+        else:
+            del rows[pos]
+        changes.append(change)
+    return changes
+
+def _locate(rows, pos, before):
+    """変更対象の行を探す（記録時の位置になければ、同じ内容の行が1つだけある場合はその位置）"""
+    if pos < len(rows) and rows[pos] == before:
+        return pos
+    matches = [i for i, r in enumerate(rows) if r == before]
+    return matches[0] if len(matches) == 1 else None
+
+def apply_changes(rows, changes):
+    """
+    記録した変更を行データに適用する
+
+    変更・削除は記録時の位置の行が変更前の値と一致すれば適用する。一致しない場合は、同じ内容の行が
+    ほかに1つだけあればその行に適用し、なければ（複数ある場合も）競合として適用しない。
+    反映済みかどうかはここでは判断しない（replay_journal() が変更ログの ID で判断する）。
+
+    Args:
+        rows: 適用先の行（ヘッダーを除く）。変更しない
+        changes: record_changes() の結果
+
+    Returns:
+        tuple: (適用後の行, 適用できなかった変更の一覧)
+    """
+    rows = [list(r) for r in rows]
+    conflicts = []
+    for c in changes:
+        if c["op"] == "insert":
+            rows.insert(min(c["pos"], len(rows)), c["after"])
+            continue
+        pos = _locate(rows, c["pos"], c["before"])
+        if pos is None:
+            conflicts.append(c)
+        elif c["op"] == "update":
+            rows[pos] = c["after"]
+        else:
+            del rows[pos]
+    return rows, conflicts
+
+
+class WriteJournal:
+    """
+    未同期の書き込みの記録（1グループに1ファイル）
+
+    同じホストの複数プロセスが同じファイルを使うため、メモリには持たず、
+    読み書きのたびに path + ".lock" のロックを取ってファイルを読む。
+
+    Args:
+        path: ジャーナルファイルのパス（競合は path + ".conflicts" に残す）
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conflict_path = path + ".conflicts"
+        self.lock_path = path + ".lock"
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    @staticmethod
+    def _append_lines(path, records):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            for r in records:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record(self, old_rows, new_rows, version=None):
+        """
+        書き込み1回分の変更を記録する（ディスクに書き終えてから戻る）
+
+        Args:
+            old_rows: 変更前の行（表示していた内容。未同期の変更を含む）
+            new_rows: 変更後の行
+            version: 最後に取得できた予約データのバージョン（反映済みかを変更ログで調べる範囲。不明なら None）
+
+        Returns:
+            int: 記録した変更の数
+        """
+        changes = record_changes(old_rows, new_rows)
+        if not changes: return 0
+        with file_lock(self.lock_path):
+            records = self._read(self.path)
+            seq = records[-1]["seq"] + 1 if records else 1
+            self._append_lines(self.path, [{
+                "seq": seq, "id": uuid.uuid4().hex, "version": version, "ts": _now_jst(), "changes": changes,
+            }])
+        return len(changes)
+
+    def pending(self):
+        if not os.path.exists(self.path): return []
+        with file_lock(self.lock_path):
+            return self._read(self.path)
+
+    def overlay(self, rows):
+        """未同期の変更を適用した行（オフライン中の表示用）"""
+        for r in self.pending():
+            rows, _ = apply_changes(rows, r["changes"])
+        return rows
+
+    def complete(self, records, conflicts):
+        """
+        反映し終えた記録を取り除き、競合した変更を残す（反映中に他のプロセスが追記した記録は残す）
+
+        Args:
+            records: 反映した記録（pending() の結果）
+            conflicts: 適用できなかった変更
+        """
+        done = {r["seq"] for r in records}
+        with file_lock(self.lock_path):
+            if conflicts:
+                self._append_lines(self.conflict_path, [dict(c, ts=_now_jst()) for c in conflicts])
+            remaining = [r for r in self._read(self.path) if r["seq"] not in done]
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for r in remaining:
+                    f.write(json.dumps(r, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+    def replay_lock(self):
+        """
+        反映を1つだけにするロック（待たない。with で使い、取れたかどうかが返る）
+        """
+        return file_lock(self.path + ".replay.lock", blocking=False)
+
+    def conflicts(self):
+        with file_lock(self.lock_path):
+            return self._read(self.conflict_path)
+
+    def clear_conflicts(self):
+        with file_lock(self.lock_path):
+            try:
+                os.remove(self.conflict_path)
+            except FileNotFoundError:
+                pass
+
+
+class OfflineState:
+    """
+    1グループ分のオフライン状態（接続状況・スナップショット・ジャーナル）
+
+    Args:
+        directory: 保存先ディレクトリ
+        sheet_id: スプレッドシートID（ファイル名に使う）
+    """
+    def __init__(self, directory, sheet_id):
+        self.snapshot_path = os.path.join(directory, f"{sheet_id}.snapshot.json")
+        self.journal = WriteJournal(os.path.join(directory, f"{sheet_id}.journal.jsonl"))
+        self.down_until = 0.0
+        self.last_error = None
+        self.saved_key = None
+
+    def is_down(self):
+        return time.monotonic() < self.down_until
+
+    def mark_down(self, error):
+        self.down_until = time.monotonic() + RETRY_SECONDS
+        self.last_error = str(error)
+
+    def mark_up(self):
+        self.down_until = 0.0
+        self.last_error = None
+
+    def save_snapshot(self, store):
+        """
+        取得できた予約データをディスクに保存する（前回保存時から変わった場合のみ）
+
+        Args:
+            store: ReservationStore
+        """
+        key = (store.version, store.loaded_at)
+        if key == self.saved_key: return
+        with store.lock:
+            data = {"header": store.header, "rows": store.rows, "saved_at": _now_jst()}
+            text = json.dumps(data, ensure_ascii=False)
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, self.snapshot_path)
+        self.saved_key = key
+
+    def load_snapshot(self):
+        """
+        Returns:
+            dict: {"header", "rows", "saved_at"}（保存されていなければ None）
+        """
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+def replay_journal(store, journal):
+    """
+    未同期の変更を記録順に Sheets に反映する（書き込みは1回）
+
+    他のセッション・プロセスが反映中の場合は何もしない。
+    シートに書き込めた時点でジャーナルから取り除き、反映した記録の ID を変更ログに残す。
+    ジャーナルから取り除けなかった記録も、変更ログに ID があればもう一度適用しない。
+    （シートへの書き込みが終わってから、ジャーナルから取り除くまでの間にプロセスが止まった場合だけは、
+    もう一度適用される）
+
+    Args:
+        store: ReservationStore
+        journal: WriteJournal
+
+    Returns:
+        list: 競合して適用しなかった変更（他が反映中の場合は None）
+    """
+    with journal.replay_lock() as locked:
+        if not locked: return None
+        records = journal.pending()
+        if not records: return []
+        store.refresh(latest=True)
+        versions = [r.get("version") for r in records]
+        since = 0 if None in versions else min(versions)
+        applied = applied_journal_ids(store.log_sheet, since)
+        todo = [r for r in records if r.get("id") not in applied]
+        if not todo:
+            journal.complete(records, [])
+            return []
+        with store.lock:
+            header, rows = list(store.header), [list(r) for r in store.rows]
+        conflicts = []
+        for r in todo:
+            rows, failed = apply_changes(rows, r["changes"])
+            conflicts += failed
+        store.write_values(
+            [header] + rows,
+            on_written=lambda: journal.complete(records, conflicts),
+            journal_ids=[r["id"] for r in todo if r.get("id")],
+        )
+        return conflicts
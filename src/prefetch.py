@@ -0,0 +1,114 @@
+"""
+表示後の先読み
+
+カレンダー・予約リストを描画した後に、前後の月のイベント・予約リストの行・施設情報などを
+バックグラウンドで作ってキャッシュに入れておく。月の移動やダイアログを開いた時はキャッシュから返す。
+
+ジョブはグループごとに1本のスレッドで順に実行する。同じキーのジョブは、待っている間と
+実行してから PREFETCH_SECONDS の間は重ねて登録しない。グループのキャッシュを捨てる時にスレッドも止める。
+"""
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+# 先読みした結果を使える秒数（TENANT.cached の ttl と同じ）。これを過ぎたら同じキーでも先読みし直す
+PREFETCH_SECONDS = 15
+
+# 実行済みとして覚えておくキーの数
+MAX_DONE_KEYS = 64
+
+logger = logging.getLogger(__name__)
+
+
+def month_grid_window(day):
+    """
+    月表示（dayGridMonth）で day の月を表示した時の展開範囲
+
+    FullCalendar の月表示は、1日を含む週の日曜日から6週間分を表示する。
+    handle_calendar_state() が記録する範囲と同じになるよう、前後に1日ずつ広げる。
+
+    Returns:
+        tuple: (開始日, 終了日)
+    """
+    first = date(day.year, day.month, 1)
+    start = first - timedelta(days=(first.weekday() + 1) % 7)
+    return start - timedelta(days=1), start + timedelta(days=43)
+
+def adjacent_months(day):
+    """day の月の前月・翌月の1日"""
+    first = date(day.year, day.month, 1)
+    prev_month = (first - timedelta(days=1)).replace(day=1)
+    next_month = (first + timedelta(days=31)).replace(day=1)
+    return prev_month, next_month
+
+
+class Prefetcher:
+    """
+    先読みのジョブを順に実行するワーカー（グループ内で共有する）
+    """
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.pending = set()
+        self.done = OrderedDict()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.closed = False
+
+    def request(self, key, job):
+        """
+        ジョブを登録する（描画をブロックしない）
+
+        Args:
+            key: ジョブを区別するキー（データのバージョンや表示範囲など）
+            job: 引数なしで呼び出す関数
+
+        Returns:
+            bool: 登録したか
+        """
+        with self.lock:
+            if self.closed: return False
+            finished = self.done.get(key)
+            if key in self.pending or (finished is not None and time.monotonic() - finished < PREFETCH_SECONDS):
+                return False
+            self.pending.add(key)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._loop, name="prefetch", daemon=True)
+                self.thread.start()
+        self.queue.put((key, job))
+        return True
+
+    def cancel(self):
+        """待っているジョブを捨てる（予約データを書き換えた時など）"""
+        with self.lock:
+            while True:
+                try:
+                    key, _ = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.pending.discard(key)
+            self.done.clear()
+
+    def close(self):
+        """待っているジョブを捨ててスレッドを止める（グループのキャッシュを捨てた時。Tenant.close() から呼ぶ）"""
+        self.cancel()
+        with self.lock:
+            self.closed = True
+        self.queue.put((None, None))
+
+    def _loop(self):
+        while True:
+            key, job = self.queue.get()
+            if job is None: return
+            try:
+                job()
+            except Exception:
+                logger.exception("先読みに失敗しました（%s）", key)
+            with self.lock:
+                self.pending.discard(key)
+                self.done[key] = time.monotonic()
+                self.done.move_to_end(key)
+                while len(self.done) > MAX_DONE_KEYS:
+                    self.done.popitem(last=False)
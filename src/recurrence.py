@@ -0,0 +1,191 @@
+"""
+繰り返し予約（定期練習など）
+
+繰り返しのルールを recurrences シートに1行で保存し、
+カレンダー・リストに表示する期間の分だけ予約として展開する。
+参加表明が行われた回は、その時点で reservations シートに1行として書き込む（実体化）。
+"""
+import uuid
+from datetime import date, timedelta
+
+import pandas as pd
+
+from sheets_common import safe_int
+
+RECURRENCE_SHEET = "recurrences"
+
+RECURRENCE_COLUMNS = [
+    "id","facility","status","frequency","start_date","end_date",
+    "start_hour","start_minute","end_hour","end_minute","exceptions","message"
+]
+
+# 繰り返し単位 → 表示名
+FREQUENCIES = {"weekly": "毎週", "biweekly": "隔週", "monthly": "毎月"}
+
+# 展開した回のイベントID・行ラベルの接頭辞
+OCCURRENCE_PREFIX = "s:"
+
+
+def normalize_rules(df):
+    """
+    recurrences シートの生データを整える（日付の変換、除外日のリスト化）
+
+    Args:
+        df: get_all_records() から作った DataFrame
+
+    Returns:
+        DataFrame
+    """
+    for c in RECURRENCE_COLUMNS:
+        if c not in df.columns:
+            df[c] = ""
+    df["id"] = df["id"].astype(str)
+    df["start_date"] = pd.to_datetime(df["start_date"], errors="coerce").dt.date
+    df["end_date"] = pd.to_datetime(df["end_date"], errors="coerce").dt.date
+
+    df["exceptions"] = df["exceptions"].apply(
+        lambda x: [] if pd.isna(x) or x == "" else parse_exception_dates(str(x).replace(";", ","))
+    )
+    df["message"] = df["message"].fillna("")
+    return df
+
+def parse_exception_dates(text):
+    """
+    「2025-12-29, 2026-01-05」のような入力から除外日のリストを作る（読めない値は無視）
+    """
+    parts = [x.strip() for x in str(text).replace("、", ",").split(",") if x.strip()]
+    if not parts:
+        return []
+    return [d for d in pd.to_datetime(parts, errors="coerce").date if not pd.isna(d)]
+
+def new_rule(facility, status, frequency, start_date, end_date, start_time, end_time, exceptions=(), message=""):
+    """
+    recurrences シートに追加する1行を作る
+
+    Returns:
+        list: RECURRENCE_COLUMNS の順の値
+    """
+    rule = {
+        "id": uuid.uuid4().hex[:8],
+        "facility": facility,
+        "status": status,
+        "frequency": frequency,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat() if end_date else "",
+        "start_hour": start_time.hour,
+        "start_minute": start_time.minute,
+        "end_hour": end_time.hour,
+        "end_minute": end_time.minute,
+        "exceptions": ";".join(d.isoformat() for d in sorted(exceptions)),
+        "message": message,
+    }
+    return [rule[c] for c in RECURRENCE_COLUMNS]
+
+def _add_months(d, months, day):
+    """d の months か月後の day 日（その月に day 日がなければ None）"""
+    total = d.year * 12 + d.month - 1 + months
+    year, month = divmod(total, 12)
+    try:
+        return date(year, month + 1, day)
+    except ValueError:
+        return None
+
+def iter_occurrences(rule, window_start, window_end):
+    """
+    ルールから window_start 以上 window_end 未満の開催日を順に返す
+
+    期間の先頭まで1件ずつ進めるのではなく、計算で最初の候補日に飛ぶ。
+
+    Args:
+        rule: normalize_rules() の1行
+        window_start: 表示期間の開始日
+        window_end: 表示期間の終了日（含まない）
+    """
+    start = rule["start_date"]
+    if pd.isna(start) or rule["frequency"] not in FREQUENCIES:
+        return
+    end = rule["end_date"]
+    if not pd.isna(end) and end:
+        window_end = min(window_end, end + timedelta(days=1))
+    exceptions = set(rule["exceptions"])
+    first = max(start, window_start)
+
+    if rule["frequency"] in ("weekly", "biweekly"):
+        step = 7 if rule["frequency"] == "weekly" else 14
+        k = -(-(first - start).days // step)
+        d = start + timedelta(days=k * step)
+        while d < window_end:
+            if d not in exceptions:
+                yield d
+            d += timedelta(days=step)
+    else:
+        months = (first.year - start.year) * 12 + (first.month - start.month)
+        while True:
+            d = _add_months(start, months, start.day)
+            months += 1
+            if d is None: continue
+            if d >= window_end: break
+            if d >= first and d not in exceptions:
+                yield d
+
+def occurrence_id(series_id, day):
+    return f"{OCCURRENCE_PREFIX}{series_id}:{day.isoformat()}"
+
+def parse_occurrence_id(value):
+    """
+    展開した回のIDを (シリーズID, 日付) に分解する（繰り返し予約でなければ None）
+    """
+    if not isinstance(value, str) or not value.startswith(OCCURRENCE_PREFIX):
+        return None
+    series_id, _, day = value[len(OCCURRENCE_PREFIX):].rpartition(":")
+    return series_id, date.fromisoformat(day)
+
+def materialized_keys(reservations_df):
+    """実体化済みの回を判定するためのキー (日付, 施設, 開始時, 開始分) の集合"""
+    if reservations_df.empty:
+        return set()
+    return set(zip(
+        reservations_df["date"], reservations_df["facility"],
+        reservations_df["start_hour"].map(safe_int), reservations_df["start_minute"].map(safe_int),
+    ))
+
+def occurrence_row(rule, day):
+    """
+    ルールの1回分を reservations シートの行（辞書）にする
+    """
+    return {
+        "date": day,
+        "facility": rule["facility"],
+        "status": rule["status"],
+        "start_hour": safe_int(rule["start_hour"], 9),
+        "start_minute": safe_int(rule["start_minute"], 0),
+        "end_hour": safe_int(rule["end_hour"], 11),
+        "end_minute": safe_int(rule["end_minute"], 0),
+        "participants": [],
+        "absent": [],
+        "consider": [],
+        "message": rule["message"],
+    }
+
+def expand_rules(rules_df, window_start, window_end, reservations_df):
+    """
+    表示期間内の繰り返し予約を展開する（実体化済みの回は除く）
+
+    Args:
+        rules_df: normalize_rules() の結果
+        window_start: 表示期間の開始日
+        window_end: 表示期間の終了日（含まない）
+        reservations_df: load_reservations() の結果
+
+    Returns:
+        DataFrame: reservations と同じ列を持ち、インデックスが occurrence_id() の DataFrame
+    """
+    done = materialized_keys(reservations_df)
+    rows, ids = [], []
+    for _, rule in rules_df.iterrows():
+        for day in iter_occurrences(rule, window_start, window_end):
+            row = occurrence_row(rule, day)
+            if (day, row["facility"], row["start_hour"], row["start_minute"]) in done: continue
+            rows.append(row)
+            ids.append(occurrence_id(rule["id"], day))
+    return pd.DataFrame(rows, index=pd.Index(ids, dtype="object"))
@@ -0,0 +1,57 @@
+"""
+抽選期間リマインダーの判定
+
+lottery_periods シートの設定から、今日表示するメッセージを決める。
+tennis_app.py（画面上部のお知らせ）と api_server.py の両方から使う。
+"""
+from datetime import date
+
+
+def active_reminder_messages(df, today):
+    """
+    今日が抽選期間に当たるメッセージの一覧
+
+    Args:
+        df: lottery_periods シートの DataFrame
+        today: 判定する日（JST）
+
+    Returns:
+        list: メッセージ
+    """
+    if df.empty: return []
+
+    messages_to_show = []
+
+    for _, row in df.iterrows():
+        enabled_val = str(row.get("enabled", "")).lower()
+        if enabled_val not in ["true", "1", "yes", "有効"]: continue
+
+        freq = row.get("frequency", "")
+        msg = row.get("messages", "")
+        if not msg: continue
+
+        is_match = False
+        try:
+            if freq == "monthly":
+                s_day = int(row.get("start_day", 0))
+                e_day = int(row.get("end_day", 32))
+                if s_day <= today.day <= e_day: is_match = True
+            elif freq == "weekly":
+                if today.strftime("%a") in str(row.get("weekdays", "")): is_match = True
+            elif freq == "yearly":
+                s_month = int(row.get("start_month", 0))
+                s_day = int(row.get("start_day", 0))
+                e_month = int(row.get("end_month", 0))
+                e_day = int(row.get("end_day", 0))
+                if s_month > 0:
+                    start_date = date(today.year, s_month, s_day)
+                    end_date = date(today.year, e_month, e_day)
+                    if start_date > end_date:
+                        if today >= start_date or today <= end_date: is_match = True
+                    else:
+                        if start_date <= today <= end_date: is_match = True
+        except: continue
+
+        if is_match: messages_to_show.append(msg)
+
+    return messages_to_show
@@ -0,0 +1,132 @@
+"""
+施設ごと・日付ごとの予約時間帯インデックス
+
+予約登録時の重複チェック（同じ施設・同じ時間帯のダブルブッキング）と、
+指定日の空き時間帯の検索に使う。
+"""
+from bisect import bisect_left, bisect_right
+from datetime import time as dt_time
+
+import pandas as pd
+
+from sheets_common import safe_int
+
+# 時間帯を占有しないステータス
+NON_BLOCKING_STATUSES = ["中止"]
+
+
+def to_minutes(t):
+    """datetime.time を 0:00 からの分に変換"""
+    return t.hour * 60 + t.minute
+
+def from_minutes(m):
+    """0:00 からの分を datetime.time に変換（24:00 以降は 23:59 に丸める）"""
+    m = min(m, 23 * 60 + 59)
+    return dt_time(m // 60, m % 60)
+
+
+class FacilityIntervalIndex:
+    """
+    (施設名, 日付) ごとに予約時間帯を開始時刻順に保持するインデックス
+
+    各バケットは開始時刻のソート済みリストと、バケット内の最長予約時間を持つ。
+    [start, end) と重なり得る予約は開始時刻が (start - 最長時間, end) の範囲に限られるため、
+    二分探索で候補を絞り込める。
+    """
+    def __init__(self):
+        self.buckets = {}
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        load_reservations() の結果からインデックスを作る
+
+        Args:
+            df: 予約データ
+
+        Returns:
+            FacilityIntervalIndex
+        """
+        index = cls()
+        if df.empty:
+            return index
+        for idx, r in df.iterrows():
+            if r.get("status") in NON_BLOCKING_STATUSES: continue
+            day = r.get("date")
+            facility = r.get("facility")
+            if pd.isna(day) or day == "" or not facility: continue
+            start = safe_int(r.get("start_hour"), 9) * 60 + safe_int(r.get("start_minute"), 0)
+            end = safe_int(r.get("end_hour"), 11) * 60 + safe_int(r.get("end_minute"), 0)
+            if end <= start: continue
+            index.add(facility, day, start, end, idx)
+        return index
+
+    def add(self, facility, day, start, end, idx):
+        """
+        予約を1件追加する
+
+        Args:
+            facility: 施設名
+            day: 日付
+            start: 開始（0:00からの分）
+            end: 終了（0:00からの分）
+            idx: 予約の行インデックス
+        """
+        bucket = self.buckets.setdefault((facility, day), {"starts": [], "entries": [], "max_len": 0})
+        pos = bisect_right(bucket["starts"], start)
+        bucket["starts"].insert(pos, start)
+        bucket["entries"].insert(pos, (start, end, idx))
+        bucket["max_len"] = max(bucket["max_len"], end - start)
+
+    def overlaps(self, facility, day, start_time, end_time, exclude_idx=None):
+        """
+        指定した時間帯と重なる予約を探す
+
+        Args:
+            facility: 施設名
+            day: 日付
+            start_time: 開始時刻（datetime.time）
+            end_time: 終了時刻（datetime.time）
+            exclude_idx: 対象外にする予約の行インデックス（編集中の予約など）
+
+        Returns:
+            list: (開始時刻, 終了時刻, 行インデックス) のリスト
+        """
+        bucket = self.buckets.get((facility, day))
+        if not bucket:
+            return []
+        start, end = to_minutes(start_time), to_minutes(end_time)
+        lo = bisect_left(bucket["starts"], start - bucket["max_len"] + 1)
+        hi = bisect_left(bucket["starts"], end)
+        found = []
+        for s, e, idx in bucket["entries"][lo:hi]:
+            if e > start and idx != exclude_idx:
+                found.append((from_minutes(s), from_minutes(e), idx))
+        return found
+
+    def free_slots(self, facility, day, open_time=dt_time(7, 0), close_time=dt_time(22, 0), min_minutes=60):
+        """
+        指定日の空き時間帯を探す
+
+        Args:
+            facility: 施設名
+            day: 日付
+            open_time: 営業開始時刻
+            close_time: 営業終了時刻
+            min_minutes: 空きとみなす最短の長さ（分）
+
+        Returns:
+            list: (開始時刻, 終了時刻) のリスト
+        """
+        bucket = self.buckets.get((facility, day), {"entries": []})
+        open_m, close_m = to_minutes(open_time), to_minutes(close_time)
+        slots = []
+        cursor = open_m
+        for s, e, _ in bucket["entries"]:
+            if s >= close_m: break
+            if s - cursor >= min_minutes:
+                slots.append((from_minutes(cursor), from_minutes(s)))
+            cursor = max(cursor, e)
+        if close_m - cursor >= min_minutes:
+            slots.append((from_minutes(cursor), from_minutes(close_m)))
+        return slots
@@ -0,0 +1,259 @@
+"""
+同じホストの複数プロセスで共有する予約データのキャッシュ（SQLite）
+
+Streamlit を複数プロセスで動かす（ロードバランサーの後ろに複数台並べる）と、
+TENANT.cached や ReservationStore はプロセスごとに持つため、Sheets の読み込みが
+プロセス数だけ増え、プロセスによって表示が食い違う。
+
+secrets.toml で有効にすると、ReservationStore の内容を SQLite ファイルに置き、
+同じホストのプロセスはそこから読む。
+
+    [shared_cache]
+    path = "/var/tmp/tennis_plan/cache.sqlite3"
+
+* Sheets を確認しに行くのは、リース（一定時間の担当権）を取れた1プロセスだけ。
+  取れなかったプロセスは SQLite の内容を使う
+* 書き込んだプロセスはすぐに最新の内容を書き戻し、リビジョン（更新のたびに増える番号）を上げる。
+  各プロセスはリビジョンが変わっていたら手元のキャッシュを捨てる
+"""
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from change_log import ReservationStore
+
+# Sheets を確認してから、次に確認するまでの秒数（アプリの load_reservations と同じ）
+SHARED_REFRESH_SECONDS = 15
+
+# 担当プロセスのリースの有効期間（秒）。担当が落ちてもこの時間で他のプロセスが引き継ぐ
+LEASE_SECONDS = 30
+
+
+class SharedCache:
+    """
+    SQLite ファイル1つ分の共有キャッシュ
+
+    Args:
+        path: SQLite ファイルのパス（ホスト内のプロセスで同じパスを指定する）
+    """
+    def __init__(self, path):
+        self.path = path
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                " sheet_id TEXT PRIMARY KEY, revision INTEGER, version INTEGER,"
+                " header TEXT, rows TEXT, loaded_at REAL, checked_at REAL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # 接続はスレッドをまたいで使えないため、操作ごとに開いて閉じる
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def revision(self, sheet_id):
+        """現在のリビジョン（まだ保存されていなければ 0）"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT revision FROM snapshots WHERE sheet_id = ?", (sheet_id,)).fetchone()
+        return row[0] if row else 0
+
+    def load(self, sheet_id, known_revision=None):
+        """
+        保存されている内容
+
+        Args:
+            sheet_id: スプレッドシートID
+            known_revision: 手元にあるリビジョン。同じ場合は行データを読まない
+
+        Returns:
+            dict: {"revision", "version", "header", "rows", "loaded_at", "checked_at"}
+                  保存されていなければ None。リビジョンが known_revision と同じ場合 header と rows は None
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT revision, version, loaded_at, checked_at FROM snapshots WHERE sheet_id = ?", (sheet_id,)
+            ).fetchone()
+            if row is None: return None
+            snap = dict(zip(["revision", "version", "loaded_at", "checked_at"], row), header=None, rows=None)
+            if snap["revision"] != known_revision:
+                header, rows = conn.execute(
+                    "SELECT header, rows FROM snapshots WHERE sheet_id = ?", (sheet_id,)
+                ).fetchone()
+                snap["header"], snap["rows"] = json.loads(header), json.loads(rows)
+        return snap
+
+    def save(self, sheet_id, version, header, rows, loaded_at, changed=True):
+        """
+        Sheets から取得した内容を保存する
+
+        Args:
+            changed: False の場合は確認した時刻だけを更新する（リビジョンは変えない）
+
+        Returns:
+            int: 保存後のリビジョン
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT revision FROM snapshots WHERE sheet_id = ?", (sheet_id,)).fetchone()
+            if row is not None and not changed:
+                conn.execute("UPDATE snapshots SET checked_at = ? WHERE sheet_id = ?", (now, sheet_id))
+                conn.execute("COMMIT")
+                return row[0]
+            revision = (row[0] if row else 0) + 1
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (sheet_id, revision, version, json.dumps(header, ensure_ascii=False),
+                 json.dumps(rows, ensure_ascii=False), loaded_at, now),
+            )
+            conn.execute("COMMIT")
+        return revision
+
+    def expire(self, sheet_id):
+        """保存されている内容を古いことにする（次の refresh() で Sheets を確認させる）"""
+        with self._connect() as conn:
+            conn.execute("UPDATE snapshots SET checked_at = 0 WHERE sheet_id = ?", (sheet_id,))
+
+    def acquire(self, name, seconds=LEASE_SECONDS):
+        """
+        リースを取る（他のプロセスが有効なリースを持っていれば取れない）
+
+        Args:
+            name: リースの名前
+            seconds: リースの有効期間（秒）
+
+        Returns:
+            bool: 取れたか
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != self.owner and row[1] > now:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (name, self.owner, now + seconds))
+            conn.execute("COMMIT")
+        return True
+
+    def release(self, name):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner))
+
+
+class SharedReservationStore(ReservationStore):
+    """
+    SharedCache を通して読む ReservationStore
+
+    refresh() は SQLite の内容が新しければそれを使い、SHARED_REFRESH_SECONDS を過ぎていれば
+    リースを取れたプロセスだけが Sheets を確認して結果を書き戻す。
+
+    Args:
+        worksheet: reservations シート
+        log_sheet: changelog シート
+        shared: SharedCache
+        sheet_id: スプレッドシートID（SQLite のキー）
+    """
+    def __init__(self, worksheet, log_sheet, shared, sheet_id):
+        super().__init__(worksheet, log_sheet)
+        self.shared = shared
+        self.sheet_id = sheet_id
+        self.revision = None
+        self.refresh_lock = threading.Lock()
+
+    def _adopt(self, snap):
+        with self.lock:
+            self.header = snap["header"]
+            self.rows = snap["rows"]
+            self.version = snap["version"]
+            # 全件読み直しの間隔はホスト内で共通にする（loaded_at は time.time() で保存）
+            self.loaded_at = time.monotonic() - (time.time() - snap["loaded_at"])
+        self.revision = snap["revision"]
+
+    def _publish(self, result):
+        with self.lock:
+            header, rows, version = list(self.header), [list(r) for r in self.rows], self.version
+            loaded_at = time.time() - (time.monotonic() - self.loaded_at)
+        self.revision = self.shared.save(
+            self.sheet_id, version, header, rows, loaded_at, changed=result != "none" or self.revision is None,
+        )
+
+    def refresh(self, latest=False):
+        """
+        Args:
+            latest: True の場合は共有キャッシュの鮮度に関係なく Sheets を確認する（書き込み前など）
+
+        Returns:
+            str: "full" / "delta" / "none"（ReservationStore.refresh と同じ）/ "shared"（SQLite の内容を使った）
+        """
+        with self.refresh_lock:
+            snap = self.shared.load(self.sheet_id, self.revision)
+            adopted = False
+            if snap is not None and snap["revision"] != self.revision and (self.version is None or snap["version"] >= self.version):
+                self._adopt(snap)
+                adopted = True
+            fresh = snap is not None and time.time() - snap["checked_at"] < SHARED_REFRESH_SECONDS
+            if not latest and self.version is not None and fresh:
+                return "shared" if adopted else "none"
+
+            lease = f"refresh:{self.sheet_id}"
+            if not latest and self.version is not None and not self.shared.acquire(lease):
+                # 他のプロセスが確認中。少し古い内容のまま使う
+                return "shared" if adopted else "none"
+            try:
+                result = super().refresh()
+                self._publish(result)
+            finally:
+                if not latest:
+                    self.shared.release(lease)
+            return result
+
+    def invalidate(self):
+        # ホスト内のどのプロセスも、次の refresh() で Sheets を確認するようにする
+        self.shared.expire(self.sheet_id)
+
+    def write_values(self, values, on_written=None, journal_ids=None):
+        super().write_values(values, on_written=on_written, journal_ids=journal_ids)
+        # 書き込んだ内容をすぐに読み直して共有し、他のプロセスのキャッシュを無効にする
+        self.refresh(latest=True)
+
+
+def make_reservation_store(worksheet, log_sheet, secrets, sheet_id):
+    """
+    secrets の [shared_cache] があれば SharedReservationStore、なければ ReservationStore を作る
+
+    Args:
+        worksheet: reservations シート
+        log_sheet: changelog シート
+        secrets: st.secrets または load_secrets() の結果
+        sheet_id: スプレッドシートID
+    """
+    shared = get_shared_cache(secrets)
+    if shared is None:
+        return ReservationStore(worksheet, log_sheet)
+    return SharedReservationStore(worksheet, log_sheet, shared, sheet_id)
+
+_shared_caches = {}
+_shared_lock = threading.Lock()
+
+def get_shared_cache(secrets):
+    """
+    secrets の [shared_cache] path の SharedCache（プロセス内で1つ）。設定がなければ None
+    """
+    path = secrets.get("shared_cache", {}).get("path")
+    if not path: return None
+    with _shared_lock:
+        if path not in _shared_caches:
+            _shared_caches[path] = SharedCache(path)
+        return _shared_caches[path]
@@ -0,0 +1,212 @@
+"""
+Google Sheets 連携の共通処理
+
+tennis_app.py（Streamlit）とコマンドラインのバッチ・ツール類の両方から使う。
+Streamlit に依存しないこと。
+"""
+import os
+import time
+import tomllib
+from datetime import date, datetime, timedelta
+
+import gspread
+import pandas as pd
+from google.oauth2.service_account import Credentials
+from gspread.exceptions import APIError
+
+# reservations シートの列（SPECIFICATION.md 4.1）
+RESERVATION_COLUMNS = [
+    "date","facility","status","start_hour","start_minute",
+    "end_hour","end_minute","participants","absent","consider","message"
+]
+
+# ;区切りで保存するリスト列
+LIST_COLUMNS = ["participants", "absent", "consider"]
+
+# 予約のステータス（SPECIFICATION.md 7）
+RESERVATION_STATUSES = ["確保", "抽選中", "中止", "完了"]
+
+# これ以上状態が変わらないステータス
+TERMINAL_STATUSES = ["中止", "完了"]
+
+# コマンドライン実行時に読む secrets（Streamlit と同じファイル）
+DEFAULT_SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+
+
+def run_with_retry(func, *args, **kwargs):
+    max_retries = 5
+    for i in range(max_retries):
+        try:
+            return func(*args, **kwargs)
+        except APIError as e:
+            if i == max_retries - 1: raise e
+            code = e.response.status_code
+            if code == 429 or code >= 500:
+                time.sleep(2 ** (i + 1))
+            else:
+                raise e
+        except Exception as e:
+            if i == max_retries - 1: raise e
+            time.sleep(2)
+
+def safe_int(val, default=0):
+    try:
+        if pd.isna(val) or val == "": return default
+        return int(float(val))
+    except:
+        return default
+
+def reservation_keys(dates, facilities):
+    """
+    予約のキー（日付_施設_n）。n は同じ日付・施設の予約のうち、シート上で上から何番目か（1始まり）
+
+    行の位置と違い、他の日付の行を削除・追加しても変わらない。時刻を変えても変わらない。
+    同じ日・同じ施設に複数の予約（コート2面など）があっても別のキーになる。
+
+    Args:
+        dates: 日付（datetime.date）の並び。日付でない値のキーは None
+        facilities: 施設名の並び
+
+    Returns:
+        list: キー（dates と同じ順序）
+    """
+    seen = {}
+    keys = []
+    for d, facility in zip(dates, facilities):
+        if isinstance(d, datetime): d = d.date()
+        if not isinstance(d, date) or pd.isna(d):
+            keys.append(None)
+            continue
+        base = f"{d.isoformat()}_{facility}"
+        seen[base] = seen.get(base, 0) + 1
+        keys.append(f"{base}_{seen[base]}")
+    return keys
+
+def jst_today():
+    return (datetime.utcnow() + timedelta(hours=9)).date()
+
+def normalize_reservations(df):
+    """
+    reservations シートの生データを、アプリで扱う形に整える
+
+    * 足りない列を空文字で補う
+    * date を datetime.date に変換
+    * participants / absent / consider を ; 区切りからリストに変換
+
+    Args:
+        df: get_all_records() 等から作った DataFrame
+
+    Returns:
+        DataFrame
+    """
+    for c in RESERVATION_COLUMNS:
+        if c not in df.columns:
+            df[c] = ""
+
+    df["date"] = pd.to_datetime(df["date"], errors="coerce").dt.date
+
+    def _to_list_cell(x):
+        if isinstance(x, (list, tuple)): return list(x)
+        if pd.isna(x) or x == "": return []
+        return str(x).split(";")
+
+    for col in LIST_COLUMNS:
+        df[col] = df[col].apply(_to_list_cell)
+
+    df["message"] = df["message"].fillna("")
+    return df
+
+def serialize_reservations(df):
+    """
+    予約データをシートに書き込める値（ヘッダー行 + データ行の2次元リスト）に変換
+
+    Args:
+        df: normalize_reservations() 形式の DataFrame
+
+    Returns:
+        list: [[ヘッダー...], [値...], ...]
+    """
+    df_to_save = df.copy()
+    
+    for col in LIST_COLUMNS:
+        if col in df_to_save.columns:
+            df_to_save[col] = df_to_save[col].apply(lambda lst: ";".join(lst) if isinstance(lst, (list, tuple)) else (lst if pd.notnull(lst) else ""))
+
+    if "date" in df_to_save.columns:
+        df_to_save["date"] = df_to_save["date"].apply(lambda d: d.isoformat() if isinstance(d, (date, datetime, pd.Timestamp)) else (str(d) if pd.notnull(d) else ""))
+
+    df_to_save = df_to_save.where(pd.notnull(df_to_save), "")
+
+    def _serialize_cell(v):
+        if isinstance(v, (date, datetime, pd.Timestamp)): return v.isoformat()
+        if isinstance(v, (list, tuple)): return ";".join(map(str, v))
+        return str(v)
+
+    values = [df_to_save.columns.values.tolist()]
+    ser_df = df_to_save.map(_serialize_cell)
+    values += ser_df.values.tolist()
+    return values
+
+def load_secrets(path=DEFAULT_SECRETS_PATH):
+    """
+    Streamlit の secrets.toml を読み込む（コマンドライン実行用）
+
+    Args:
+        path: secrets.toml のパス
+
+    Returns:
+        dict: secrets の内容
+    """
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+def open_spreadsheet(google_secrets, sheet_id):
+    """
+    サービスアカウントで認証してスプレッドシートを開く
+
+    Args:
+        google_secrets: secrets の [google] セクション（サービスアカウント情報）
+        sheet_id: スプレッドシートID
+
+    Returns:
+        gspread.Spreadsheet
+    """
+    scope = ["https://www.googleapis.com/auth/spreadsheets"]
+    creds = Credentials.from_service_account_info(dict(google_secrets), scopes=scope)
+    client = gspread.authorize(creds)
+    return client.open_by_key(sheet_id)
+
+def open_worksheet(google_secrets, sheet_id, sheet_name):
+    """
+    サービスアカウントで認証してワークシートを開く
+
+    Args:
+        google_secrets: secrets の [google] セクション（サービスアカウント情報）
+        sheet_id: スプレッドシートID
+        sheet_name: シート名
+
+    Returns:
+        gspread.Worksheet
+    """
+    return open_spreadsheet(google_secrets, sheet_id).worksheet(sheet_name)
+
+def open_or_create_worksheet(google_secrets, sheet_id, sheet_name, header):
+    """
+    ワークシートを開く。存在しない場合はヘッダー行だけのシートを作成する
+
+    Args:
+        google_secrets: secrets の [google] セクション
+        sheet_id: スプレッドシートID
+        sheet_name: シート名
+        header: 作成時に書き込むヘッダー行
+
+    Returns:
+        gspread.Worksheet
+    """
+    spreadsheet = open_spreadsheet(google_secrets, sheet_id)
+    try:
+        return spreadsheet.worksheet(sheet_name)
+    except gspread.exceptions.WorksheetNotFound:
+        ws = run_with_retry(spreadsheet.add_worksheet, title=sheet_name, rows=1000, cols=len(header))
+        run_with_retry(ws.append_row, list(header))
+        return ws
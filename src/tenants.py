@@ -0,0 +1,337 @@
+"""
+複数グループ（テナント）対応
+
+1つのデプロイで複数のテニスグループを扱う。グループごとに別のスプレッドシートを使い、
+URL のクエリパラメータ ?group=<グループ名> で切り替える。
+
+secrets.toml の例:
+    [google]
+    GSHEET_ID = "..."          # グループ指定なし（default）の時のスプレッドシート
+
+    [groups]
+    kita = "..."               # ?group=kita の時のスプレッドシート
+    minami = "..."
+
+    [tenancy]                  # すべて省略可
+    max_cache_mb = 256         # 全グループ合計のキャッシュの上限
+    idle_minutes = 60          # この時間使われていないグループのキャッシュを捨てる
+    reads_per_minute = 20      # グループごとの API 上限（省略時は、その時 API を使っているグループで 60 を分け合う）
+    writes_per_minute = 20
+
+グループごとのキャッシュ（予約・施設・抽選期間など）は TenantRegistry が LRU で保持し、
+一定時間使われていないグループ、およびメモリの上限を超えた分を古い順に捨てる。
+Sheets API の呼び出しはサービスアカウントの上限（1分あたりの回数）内に抑え、
+直近1分間に API を使っているグループで等分する（使っているグループが1つなら上限まで使える）。
+"""
+import functools
+import pickle
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+import pandas as pd
+
+DEFAULT_GROUP = "default"
+
+DEFAULT_MAX_CACHE_MB = 256
+DEFAULT_IDLE_MINUTES = 60
+# サービスアカウント1つあたりの Sheets API 上限（読み取り・書き込みそれぞれ1分60回）
+SERVICE_ACCOUNT_PER_MINUTE = 60
+
+# リソース（予約データなど）のメモリ使用量を見積もり直す間隔（秒）。見積もりは全行をたどるため毎回は行わない
+RESOURCE_SIZE_SECONDS = 60
+
+# 読み取りとして数える Worksheet のメソッド
+READ_METHODS = {"get", "get_all_records", "get_all_values", "get_values", "batch_get", "row_values", "col_values"}
+
+
+def load_group_sheets(secrets):
+    """
+    secrets からグループ名 → スプレッドシートID の対応を作る
+
+    Args:
+        secrets: st.secrets または load_secrets() の結果
+
+    Returns:
+        dict
+    """
+    groups = {}
+    default_id = secrets.get("google", {}).get("GSHEET_ID")
+    if default_id:
+        groups[DEFAULT_GROUP] = default_id
+    for name, sheet_id in secrets.get("groups", {}).items():
+        groups[str(name)] = str(sheet_id)
+    return groups
+
+def estimate_size(obj):
+    """キャッシュしている値のおおよそのメモリ使用量（バイト）"""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(estimate_size(v) for v in obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+    if hasattr(obj, "rows") and isinstance(obj.rows, list):
+        # ReservationStore など、行データを持つオブジェクト
+        return estimate_size(obj.rows)
+    return sys.getsizeof(obj)
+
+
+class QuotaBudget:
+    """
+    サービスアカウントの Sheets API 呼び出し回数の上限（直近1分間）を、グループで分け合う
+
+    直近1分間に API を使った（または待っている）グループの数で上限を等分し、
+    グループごとの割り当てに達した場合は空きが出るまで待つ。1つのグループが API を使い切って
+    他のグループの操作が 429 になるのを防ぎつつ、使っているグループが少なければ多く使える。
+
+    Args:
+        reads_per_minute: 全グループ合計の読み取り回数の上限
+        writes_per_minute: 全グループ合計の書き込み回数の上限
+        group_reads_per_minute: グループごとの読み取り回数の上限（None なら等分だけ）
+        group_writes_per_minute: グループごとの書き込み回数の上限（None なら等分だけ）
+    """
+    def __init__(self, reads_per_minute=SERVICE_ACCOUNT_PER_MINUTE, writes_per_minute=SERVICE_ACCOUNT_PER_MINUTE,
+                 group_reads_per_minute=None, group_writes_per_minute=None):
+        self.limits = {"read": reads_per_minute, "write": writes_per_minute}
+        self.group_limits = {"read": group_reads_per_minute, "write": group_writes_per_minute}
+        # (呼び出した時刻, スプレッドシートID)
+        self.windows = {"read": deque(), "write": deque()}
+        self.waiting = {"read": Counter(), "write": Counter()}
+        self.waited = Counter()
+        self.lock = threading.Lock()
+
+    def share(self, kind, sheet_id):
+        """
+        今のグループごとの割り当て（直近1分間に使った・待っているグループで等分）
+        """
+        active = {sid for _, sid in self.windows[kind]} | {sid for sid, n in self.waiting[kind].items() if n}
+        active.add(sheet_id)
+        share = max(self.limits[kind] // len(active), 1)
+        if self.group_limits[kind] is not None:
+            share = min(share, self.group_limits[kind])
+        return share
+
+    def acquire(self, kind, sheet_id):
+        with self.lock:
+            self.waiting[kind][sheet_id] += 1
+        try:
+            while True:
+                now = time.monotonic()
+                with self.lock:
+                    window = self.windows[kind]
+                    while window and now - window[0][0] >= 60:
+                        window.popleft()
+                    own = [t for t, sid in window if sid == sheet_id]
+                    if len(window) < self.limits[kind] and len(own) < self.share(kind, sheet_id):
+                        window.append((now, sheet_id))
+                        return
+                    # 自分の割り当てを使い切っていれば自分の最も古い呼び出し、そうでなければ全体の最も古い呼び出しが抜けるまで
+                    # （他のグループが使わなくなると割り当てが増えるため、長くても1秒ごとに見直す）
+                    oldest = own[0] if len(own) >= self.share(kind, sheet_id) else window[0][0]
+                    wait = min(max(60 - (now - oldest), 0.01), 1.0)
+                    self.waited[sheet_id] += wait
+                time.sleep(wait)
+        finally:
+            with self.lock:
+                self.waiting[kind][sheet_id] -= 1
+
+
+class GroupBudget:
+    """
+    1グループ分の QuotaBudget の窓口（BudgetedWorksheet に渡す）
+    """
+    def __init__(self, quota, sheet_id):
+        self.quota = quota
+        self.sheet_id = sheet_id
+
+    def acquire(self, kind):
+        self.quota.acquire(kind, self.sheet_id)
+
+    @property
+    def waited(self):
+        return self.quota.waited[self.sheet_id]
+
+
+class BudgetedWorksheet:
+    """
+    gspread.Worksheet の呼び出しごとに QuotaBudget を消費するラッパー
+    """
+    def __init__(self, worksheet, budget):
+        self._worksheet = worksheet
+        self._budget = budget
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            self._budget.acquire("read" if name in READ_METHODS else "write")
+            return attr(*args, **kwargs)
+        return call
+
+
+class Tenant:
+    """
+    1グループ分のキャッシュ
+
+    cached() は st.cache_data と同じように使える（有効期限付き、取り出すたびに複製を返す）。
+    resource() は st.cache_resource の代わりで、同じオブジェクトを共有する。
+    """
+    def __init__(self, group, sheet_id):
+        self.group = group
+        self.sheet_id = sheet_id
+        self.entries = {}
+        self.resources = {}
+        # cached() の関数名 → clear() のたびに増やす番号。計算中に clear() された値（古いデータから作った値）は保存しない
+        self.generations = Counter()
+        # cached() の値の合計サイズ（保存・削除のたびに増減する）と、リソースの見積もり（RESOURCE_SIZE_SECONDS ごと）
+        self.entries_bytes = 0
+        self.resources_bytes = 0
+        self.sized_at = None
+        self.last_used = time.monotonic()
+        self.lock = threading.RLock()
+
+    def cached(self, ttl):
+        def decorator(func):
+            name = func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                key = (name, args, tuple(sorted(kwargs.items())))
+                now = time.monotonic()
+                with self.lock:
+                    entry = self.entries.get(key)
+                    generation = self.generations[name]
+                if entry is None or entry[1] < now:
+                    value = func(*args, **kwargs)
+                    data = pickle.dumps(value)
+                    with self.lock:
+                        if self.generations[name] == generation:
+                            old = self.entries.get(key)
+                            self.entries_bytes += len(data) - (len(old[0]) if old else 0)
+                            self.entries[key] = (data, now + ttl)
+                    return value
+                return pickle.loads(entry[0])
+
+            def clear():
+                with self.lock:
+                    self.generations[name] += 1
+                    for key in [k for k in self.entries if k[0] == name]:
+                        self.entries_bytes -= len(self.entries.pop(key)[0])
+            wrapper.clear = clear
+            return wrapper
+        return decorator
+
+    def resource(self, name, factory):
+        with self.lock:
+            if name in self.resources:
+                return self.resources[name]
+        # 作成（Sheets への接続など）はロックの外で行い、その間もグループのキャッシュを読めるようにする。
+        # 同時に作られた場合は先に入れた方を使う
+        value = factory()
+        with self.lock:
+            if name not in self.resources:
+                self.resources[name] = value
+                # 次の memory_bytes() で見積もり直す
+                self.sized_at = None
+            return self.resources[name]
+
+    def close(self):
+        """キャッシュを捨てる時に、close() を持つリソース（先読みのワーカーなど）を止める"""
+        with self.lock:
+            resources = list(self.resources.values())
+        for r in resources:
+            if callable(getattr(r, "close", None)):
+                r.close()
+
+    def memory_bytes(self):
+        """
+        キャッシュのメモリ使用量（バイト）
+
+        cached() の値は保存時のサイズの合計。リソースは RESOURCE_SIZE_SECONDS ごとに見積もり直し、
+        その間は前回の見積もりを使う（TenantRegistry.get() はページの操作のたびに呼ばれるため）。
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.sized_at is None or now - self.sized_at > RESOURCE_SIZE_SECONDS:
+                self.resources_bytes = sum(estimate_size(r) for r in self.resources.values())
+                self.sized_at = now
+            return self.entries_bytes + self.resources_bytes
+
+
+class TenantRegistry:
+    """
+    グループごとの Tenant を LRU で保持する
+
+    Args:
+        max_cache_mb: 全グループ合計のキャッシュの上限（MB）
+        idle_minutes: この時間使われていないグループのキャッシュを捨てる
+        reads_per_minute: グループごとの読み取り回数の上限（None なら API を使っているグループで等分）
+        writes_per_minute: グループごとの書き込み回数の上限（None なら API を使っているグループで等分）
+    """
+    def __init__(self, max_cache_mb=DEFAULT_MAX_CACHE_MB, idle_minutes=DEFAULT_IDLE_MINUTES,
+                 reads_per_minute=None, writes_per_minute=None):
+        self.max_bytes = max_cache_mb * 1024 * 1024
+        self.idle_seconds = idle_minutes * 60
+        self.tenants = OrderedDict()
+        # API の上限はキャッシュを捨てた後も引き継ぐ
+        self.quota = QuotaBudget(
+            max(SERVICE_ACCOUNT_PER_MINUTE, reads_per_minute or 0),
+            max(SERVICE_ACCOUNT_PER_MINUTE, writes_per_minute or 0),
+            reads_per_minute, writes_per_minute,
+        )
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_secrets(cls, secrets):
+        """
+        secrets の [tenancy] から作る。API の上限を指定しない場合は、
+        サービスアカウントの上限（1分60回）を、その時 API を使っているグループで分け合う
+        """
+        conf = secrets.get("tenancy", {})
+        return cls(
+            max_cache_mb=conf.get("max_cache_mb", DEFAULT_MAX_CACHE_MB),
+            idle_minutes=conf.get("idle_minutes", DEFAULT_IDLE_MINUTES),
+            reads_per_minute=conf.get("reads_per_minute"),
+            writes_per_minute=conf.get("writes_per_minute"),
+        )
+
+    def budget(self, sheet_id):
+        return GroupBudget(self.quota, sheet_id)
+
+    def get(self, group, sheet_id):
+        """
+        グループの Tenant を取得する（なければ作成）。あわせて古いキャッシュを捨てる
+        """
+        with self.lock:
+            tenant = self.tenants.get(group)
+            if tenant is None or tenant.sheet_id != sheet_id:
+                if tenant is not None:
+                    tenant.close()
+                tenant = Tenant(group, sheet_id)
+                self.tenants[group] = tenant
+            tenant.last_used = time.monotonic()
+            self.tenants.move_to_end(group)
+            self._evict(keep=group)
+            return tenant
+
+    def _evict(self, keep):
+        now = time.monotonic()
+        for group in [g for g, t in self.tenants.items() if g != keep and now - t.last_used > self.idle_seconds]:
+            self.tenants.pop(group).close()
+        sizes = {g: t.memory_bytes() for g, t in self.tenants.items()}
+        total = sum(sizes.values())
+        for group in list(self.tenants):
+            if total <= self.max_bytes: break
+            if group == keep: continue
+            total -= sizes[group]
+            self.tenants.pop(group).close()
+
+    def stats(self):
+        """グループごとのキャッシュ使用量（バイト）"""
+        with self.lock:
+            return {g: t.memory_bytes() for g, t in self.tenants.items()}
@@ -1,42 +1,43 @@
+import os
+import threading
+import time
+from collections import OrderedDict
 import streamlit as st
 import pandas as pd
 from datetime import datetime, date, timedelta
 from datetime import time as dt_time  
 from streamlit_calendar import calendar
-import gspread
-from google.oauth2.service_account import Credentials
-import json
-import time
-from gspread.exceptions import APIError
 from urllib.parse import quote
+from gspread.utils import rowcol_to_a1
+
+from sheets_common import (
+    run_with_retry, safe_int, jst_today, open_worksheet, open_or_create_worksheet,
+    serialize_reservations,
+)
+from maintenance import complete_past_reservations, start_daily_scheduler
+from reservation_index import FacilityIntervalIndex
+from bulk_import import read_import_file, validate_import, plan_import, commit_import
+from recurrence import (
+    RECURRENCE_SHEET, RECURRENCE_COLUMNS, FREQUENCIES,
+    normalize_rules, new_rule, expand_rules, occurrence_row, parse_occurrence_id, parse_exception_dates,
+)
+from change_log import (
+    CHANGELOG_SHEET, CHANGELOG_COLUMNS, append_changes, append_reload, compact_changelog, rows_to_frame,
+)
+from offline import JOURNAL_DIR, OfflineState, replay_journal
+from ical_feed import FEED_DIR, FeedCache, data_version, publish_feeds, member_feed_name, ALL_FEED_NAME
+from reminders import active_reminder_messages
+from calendar_events import EventCache
+from prefetch import Prefetcher, adjacent_months, month_grid_window
+from member_index import MemberIndex, attendance_frame, member_monthly_stats, facility_monthly_stats
+from api_server import DEFAULT_HOST as DEFAULT_API_HOST, ApiSource, serve_in_background
+from shared_cache import SharedReservationStore, get_shared_cache, make_reservation_store
+from tenants import DEFAULT_GROUP, TenantRegistry, BudgetedWorksheet, load_group_sheets
 
 # ==========================================
 # 1. 共通関数・設定
 # ==========================================
 
-def run_with_retry(func, *args, **kwargs):
-    max_retries = 5
-    for i in range(max_retries):
-        try:
-            return func(*args, **kwargs)
-        except APIError as e:
-            if i == max_retries - 1: raise e
-            code = e.response.status_code
-            if code == 429 or code >= 500:
-                time.sleep(2 ** (i + 1))
-            else:
-                raise e
-        except Exception as e:
-            if i == max_retries - 1: raise e
-            time.sleep(2)
-
-def safe_int(val, default=0):
-    try:
-        if pd.isna(val) or val == "": return default
-        return int(float(val))
-    except:
-        return default
-
 def to_jst_date(iso_str):
     try:
         dt = datetime.fromisoformat(iso_str.replace("Z", "+00:00"))
@@ -83,97 +84,510 @@ def generate_google_calendar_url(reservation_data):
     return f"{base_url}?{'&'.join(params)}"
 
 
-# ===== Google Sheets 認証 =====
-GSHEET_ID = st.secrets.get("google", {}).get("GSHEET_ID")
+# ===== グループ（テナント）の選択 =====
+# ?group=<グループ名> でグループごとのスプレッドシートに切り替える（指定なしは [google] の GSHEET_ID）
+GROUP_SHEETS = load_group_sheets(st.secrets)
+GROUP = st.query_params.get("group", DEFAULT_GROUP)
+GSHEET_ID = GROUP_SHEETS.get(GROUP)
 if not GSHEET_ID:
-    st.error("Secretsの設定エラー: [google] セクション内に GSHEET_ID が見つかりません。")
+    if GROUP == DEFAULT_GROUP:
+        st.error("Secretsの設定エラー: [google] セクション内に GSHEET_ID が見つかりません。")
+    else:
+        st.error(f"グループ「{GROUP}」は登録されていません。")
     st.stop()
 
 @st.cache_resource(show_spinner=False)
-def get_gsheet(sheet_id, sheet_name):
-    scope = ["https://www.googleapis.com/auth/spreadsheets"]
-    service_account_info = dict(st.secrets["google"])
-    creds = Credentials.from_service_account_info(service_account_info, scopes=scope)
-    client = gspread.authorize(creds)
-    worksheet = client.open_by_key(sheet_id).worksheet(sheet_name)
-    return worksheet
+def get_tenant_registry():
+    """グループごとのキャッシュ（LRU）と API 呼び出し回数の上限"""
+    return TenantRegistry.from_secrets(st.secrets)
+
+# このグループのキャッシュ。以降の読み込み関数は st.cache_data の代わりに TENANT.cached を使う
+TENANT = get_tenant_registry().get(GROUP, GSHEET_ID)
+
+# ===== Google Sheets 認証 =====
+# シートはグループのキャッシュに置き、グループのキャッシュを捨てると一緒に捨てる
+def get_gsheet(tenant, sheet_name):
+    return tenant.resource(("gsheet", sheet_name), lambda: BudgetedWorksheet(
+        open_worksheet(st.secrets["google"], tenant.sheet_id, sheet_name),
+        get_tenant_registry().budget(tenant.sheet_id),
+    ))
+
+def get_or_create_gsheet(tenant, sheet_name, header):
+    return tenant.resource(("gsheet", sheet_name), lambda: BudgetedWorksheet(
+        open_or_create_worksheet(st.secrets["google"], tenant.sheet_id, sheet_name, header),
+        get_tenant_registry().budget(tenant.sheet_id),
+    ))
+
+def get_reservation_store(tenant):
+    """グループ内で共有する予約データ（変更ログで差分だけ更新する。[shared_cache] があればプロセス間でも共有）"""
+    return tenant.resource("reservation_store", lambda: make_reservation_store(
+        get_gsheet(tenant, "reservations"),
+        get_or_create_gsheet(tenant, CHANGELOG_SHEET, CHANGELOG_COLUMNS),
+        st.secrets, tenant.sheet_id,
+    ))
+
+def get_offline_state():
+    """接続できない時のスナップショットと未同期の書き込み"""
+    return TENANT.resource("offline", lambda: OfflineState(JOURNAL_DIR, GSHEET_ID))
+
+offline = get_offline_state()
 
 try:
-    worksheet = get_gsheet(GSHEET_ID, "reservations")
+    worksheet = get_gsheet(TENANT, "reservations")
+    reservation_store = get_reservation_store(TENANT)
 except Exception as e:
-    st.error(f"Google Sheetへの接続に失敗しました: {e}")
-    st.stop()
+    # 以前に取得したデータがあれば、オフラインで表示を続ける
+    if offline.load_snapshot() is None:
+        st.error(f"Google Sheetへの接続に失敗しました: {e}")
+        st.stop()
+    worksheet = reservation_store = None
+    offline.mark_down(e)
 
 
 # ==========================================
 # 2. データ読み書き
 # ==========================================
 
-@st.cache_data(ttl=15)
-def load_reservations():
-    data = run_with_retry(worksheet.get_all_records)
-    df = pd.DataFrame(data)
+def is_online():
+    return reservation_store is not None and not offline.is_down()
 
-    expected_cols = [
-        "date","facility","status","start_hour","start_minute",
-        "end_hour","end_minute","participants","absent","consider","message"
-    ]
-    for c in expected_cols:
-        if c not in df.columns:
-            df[c] = ""
+def local_reservation_rows():
+    """
+    オフライン時の予約データ（最後に取得した内容 + 未同期の変更）
 
-    df["date"] = pd.to_datetime(df["date"], errors="coerce").dt.date
+    Returns:
+        tuple: (ヘッダー, データ行)
+    """
+    if reservation_store is not None and reservation_store.version is not None:
+        with reservation_store.lock:
+            header, rows = list(reservation_store.header), [list(r) for r in reservation_store.rows]
+    else:
+        snapshot = offline.load_snapshot() or {"header": [], "rows": []}
+        header, rows = snapshot["header"], snapshot["rows"]
+    return header, offline.journal.overlay(rows)
 
-    def _to_list_cell(x):
-        if isinstance(x, (list, tuple)): return list(x)
-        if pd.isna(x) or x == "": return []
-        return str(x).split(";")
+def journal_base_version():
+    """最後に取得できた予約データのバージョン（ジャーナルの記録に残し、反映済みかを変更ログで調べる範囲にする）"""
+    return reservation_store.version if reservation_store is not None else None
 
-    for col in ["participants", "absent", "consider"]:
-        df[col] = df[col].apply(_to_list_cell)
+def sync_offline_writes():
+    """
+    未同期の書き込みを Sheets に反映する
 
-    df["message"] = df["message"].fillna("")
-    return df
+    Returns:
+        bool: 未同期の書き込みが残っていないか
+    """
+    if not offline.journal.pending(): return True
+    if not is_online(): return False
+    try:
+        # 競合した変更は journal.conflicts() に残り、画面上部に表示される。
+        # 他のセッション・プロセスが反映中の場合は None（反映が終わるまで未同期のまま）
+        if replay_journal(reservation_store, offline.journal) is None:
+            return False
+    except Exception as e:
+        offline.mark_down(e)
+        return False
+    return True
 
-def save_reservations(df):
-    df_to_save = df.copy()
-    
+@TENANT.cached(ttl=15)
+def load_reservations():
+    # 未同期の書き込みがある間は、最後に取得した内容に未同期の変更を重ねて表示する
+    # （反映は sync_offline_writes() で、キャッシュの外で行う）
+    if is_online() and not offline.journal.pending():
+        try:
+            # 前回から変更がなければ reservations シートは読まない（changelog の新しい行だけを確認する）
+            df = reservation_store.snapshot()
+            offline.mark_up()
+            offline.save_snapshot(reservation_store)
+            return df
+        except Exception as e:
+            offline.mark_down(e)
+    return rows_to_frame(*local_reservation_rows())
+
+@TENANT.cached(ttl=15)
+def load_facility_options():
+    """過去に登録された施設名の一覧（新規登録ダイアログの選択肢）"""
+    df = load_reservations()
+    if 'facility' not in df.columns: return []
+    return df['facility'].dropna().unique().tolist()
+
+@TENANT.cached(ttl=15)
+def load_nickname_options():
+    """過去に参加表明したニックネームの一覧（参加表明の選択肢）"""
+    df = load_reservations()
+    past_nicks = []
     for col in ["participants", "absent", "consider"]:
-        if col in df_to_save.columns:
-            df_to_save[col] = df_to_save[col].apply(lambda lst: ";".join(lst) if isinstance(lst, (list, tuple)) else (lst if pd.notnull(lst) else ""))
+        if col in df.columns:
+            for lst in df[col]:
+                if isinstance(lst, list): past_nicks.extend([n for n in lst if n])
+                elif isinstance(lst, str) and lst.strip(): past_nicks.extend(lst.split(";"))
+    return sorted(set(past_nicks), key=lambda s: s)
+
+@TENANT.cached(ttl=15)
+def load_reservation_index():
+    """施設・日付ごとの時間帯インデックス（重複チェック・空き時間検索用）"""
+    return FacilityIntervalIndex.from_frame(load_reservations())
+
+@TENANT.cached(ttl=60)
+def load_recurrences():
+    """
+    recurrencesシートから繰り返し予約のルールを読み込む（シートがなければ空）
+    """
+    try:
+        sheet = get_gsheet(TENANT, RECURRENCE_SHEET)
+        records = run_with_retry(sheet.get_all_records)
+    except Exception:
+        records = []
+    return normalize_rules(pd.DataFrame(records))
+
+@TENANT.cached(ttl=15)
+def load_occurrences(window_start, window_end):
+    """
+    表示期間内の繰り返し予約を展開する（実体化済みの回は除く）
 
-    if "date" in df_to_save.columns:
-        df_to_save["date"] = df_to_save["date"].apply(lambda d: d.isoformat() if isinstance(d, (date, datetime, pd.Timestamp)) else (str(d) if pd.notnull(d) else ""))
+    Args:
+        window_start: 表示期間の開始日
+        window_end: 表示期間の終了日（含まない）
+    """
+    return expand_rules(load_recurrences(), window_start, window_end, load_reservations())
+
+@TENANT.cached(ttl=15)
+def load_occurrence_events(window_start, window_end):
+    """表示期間内の繰り返し予約のイベント（前後の月は prefetch_around() で先に作っておく）"""
+    return build_calendar_events(load_occurrences(window_start, window_end), title_prefix="🔁 ")
+
+# 予約リストに表示する繰り返し予約の期間（日数）
+LIST_OCCURRENCE_DAYS = 60
+
+@TENANT.cached(ttl=15)
+def load_list_rows(show_past):
+    """
+    予約リストに表示する行（表示用の列を追加した予約データ）
+
+    Args:
+        show_past: 過去の予約も含めるか
+
+    Returns:
+        DataFrame: 予約・繰り返し予約が1件もなければ None
+    """
+    df_res = load_reservations()
+    today_jst = (datetime.utcnow() + timedelta(hours=9)).date()
+    df_occ = load_occurrences(today_jst, today_jst + timedelta(days=LIST_OCCURRENCE_DAYS))
+    df_list = pd.concat([df_res, df_occ]) if not df_occ.empty else df_res.copy()
+    if df_list.empty:
+        return None
+
+    if not show_past:
+        df_list = df_list[df_list['date'] >= today_jst]
+
+    def format_time_range(r):
+        sh = int(safe_int(r.get('start_hour')))
+        sm = int(safe_int(r.get('start_minute')))
+        eh = int(safe_int(r.get('end_hour')))
+        em = int(safe_int(r.get('end_minute')))
+        return f"{sh:02}:{sm:02} - {eh:02}:{em:02}"
+
+    df_list['時間'] = df_list.apply(format_time_range, axis=1)
+
+    # 参加者と保留を統合して表示
+    def format_participants_with_consider(row):
+        parts = []
+        participants = row['participants'] if isinstance(row['participants'], list) else []
+        consider = row['consider'] if isinstance(row['consider'], list) else []
+
+        if participants:
+            parts.append(", ".join(participants))
+        if consider:
+            parts.append(f"(保留 {", ".join(consider)})")
+
+        return " ".join(parts) if parts else ""
+
+    df_list['参加者'] = df_list.apply(format_participants_with_consider, axis=1)
+
+    # メモ欄の<br>をスペースに変換
+    df_list['message'] = df_list['message'].apply(lambda x: str(x).replace('<br>', ' ') if pd.notna(x) else '')
+
+    def format_date_with_weekday(d):
+        if not isinstance(d, (date, datetime)): return str(d)
+        weekdays = ["(月)", "(火)", "(水)", "(木)", "(金)", "(土)", "(日)"]
+        wd = weekdays[d.weekday()]
+        return f"{d.strftime('%Y-%m-%d')} {wd}"
+
+    df_list['日付'] = df_list['date'].apply(format_date_with_weekday)
+    df_list['日時'] = df_list['日付'] + " " + df_list['時間']
+    df_list['施設名'] = df_list['facility']
+    # 繰り返し予約（未実体化の回）には目印を付ける
+    df_list['ステータス'] = [("🔁 " if parse_occurrence_id(i) else "") + str(status) for i, status in zip(df_list.index, df_list['status'])]
+    df_list['メモ'] = df_list['message']
+    return df_list
+
+def find_rule(series_id):
+    """
+    繰り返し予約のルールを探す
+
+    Returns:
+        tuple: (recurrences シート上の位置, ルール) 見つからない場合は None
+    """
+    rules = load_recurrences()
+    matches = rules.index[rules["id"] == str(series_id)]
+    if len(matches) == 0: return None
+    return matches[0], rules.loc[matches[0]]
+
+def save_recurrence(rule_values):
+    """
+    繰り返し予約のルールを recurrences シートに1行追加する（シートがなければ作成）
+
+    ルールはジャーナルに記録しないため、オフライン中は保存しない。
+
+    Returns:
+        bool: 保存できたか
+    """
+    if not is_online(): return False
+    try:
+        sheet = get_or_create_gsheet(TENANT, RECURRENCE_SHEET, tuple(RECURRENCE_COLUMNS))
+        run_with_retry(sheet.append_row, rule_values)
+    except Exception as e:
+        offline.mark_down(e)
+        return False
+    load_recurrences.clear()
+    load_occurrences.clear()
+    return True
+
+def skip_occurrence(occ_id):
+    """
+    繰り返し予約の1回分を除外日に追加する（該当セルのみ更新。オフライン中は更新しない）
+
+    Returns:
+        bool: 更新できたか
+    """
+    if not is_online(): return False
+    series_id, day = parse_occurrence_id(occ_id)
+    found = find_rule(series_id)
+    if found is None: return False
+    pos, rule = found
+    exceptions = sorted(set(rule["exceptions"]) | {day})
+    col = list(load_recurrences().columns).index("exceptions") + 1
+    try:
+        sheet = get_gsheet(TENANT, RECURRENCE_SHEET)
+        run_with_retry(sheet.update, values=[[";".join(d.isoformat() for d in exceptions)]], range_name=rowcol_to_a1(pos + 2, col))
+    except Exception as e:
+        offline.mark_down(e)
+        return False
+    load_recurrences.clear()
+    load_occurrences.clear()
+    return True
 
-    df_to_save = df_to_save.where(pd.notnull(df_to_save), "")
+def materialize_occurrence(occ_id, nick, part_type):
+    """
+    繰り返し予約の1回分を、参加表明を反映した状態で reservations シートに追加する
 
-    def _serialize_cell(v):
-        if isinstance(v, (date, datetime, pd.Timestamp)): return v.isoformat()
-        if isinstance(v, (list, tuple)): return ";".join(map(str, v))
-        return str(v)
+    シート全体は書き直さず、append_rows 1回で書き込む。
 
-    values = [df_to_save.columns.values.tolist()]
-    ser_df = df_to_save.map(_serialize_cell)
-    values += ser_df.values.tolist()
+    Returns:
+        int: 追加した予約の行インデックス（ルールが見つからない場合は None）
+    """
+    series_id, day = parse_occurrence_id(occ_id)
+    found = find_rule(series_id)
+    if found is None: return None
+    row = occurrence_row(found[1], day)
+    if part_type == "参加": row["participants"] = [nick]
+    elif part_type == "保留": row["consider"] = [nick]
 
-    run_with_retry(worksheet.clear)
-    run_with_retry(worksheet.update, values)
     load_reservations.clear()
+    current_df = load_reservations()
+    values = serialize_reservations(pd.DataFrame([row]).reindex(columns=current_df.columns, fill_value=""))
+    if is_online() and not offline.journal.pending():
+        try:
+            run_with_retry(worksheet.append_rows, values[1:])
+            append_changes(reservation_store.log_sheet, [("insert", len(current_df), values[1])], len(current_df))
+            clear_reservation_caches()
+            return len(current_df)
+        except Exception as e:
+            offline.mark_down(e)
+    _, rows = local_reservation_rows()
+    offline.journal.record(rows, rows + [values[1]], journal_base_version())
+    clear_reservation_caches()
+    return len(current_df)
+
+def save_reservations(df):
+    # 未同期の書き込みがある間は、順序を守るためジャーナルに追記する
+    if is_online() and not offline.journal.pending():
+        try:
+            reservation_store.write(df)
+            # 書き込み後の内容は write() で共有キャッシュにも反映済み
+            clear_reservation_caches(invalidate=False)
+            return
+        except Exception as e:
+            offline.mark_down(e)
+    _, rows = local_reservation_rows()
+    offline.journal.record(rows, serialize_reservations(df)[1:], journal_base_version())
+    clear_reservation_caches()
+
+@TENANT.cached(ttl=15)
+def load_data_version():
+    """予約データのバージョン（.ics フィード・参加者の索引を作り直すかの判定に使う）"""
+    return data_version(load_reservations())
+
+def clear_reservation_caches(invalidate=True):
+    """
+    Args:
+        invalidate: 共有キャッシュ（[shared_cache]）も無効にするか。他のプロセスの更新を反映するだけの時は False
+    """
+    if invalidate and reservation_store is not None:
+        reservation_store.invalidate()
+    load_reservations.clear()
+    load_facility_options.clear()
+    load_nickname_options.clear()
+    load_reservation_index.clear()
+    load_occurrences.clear()
+    load_occurrence_events.clear()
+    load_list_rows.clear()
+    load_data_version.clear()
+    # 古いデータの先読みは捨てる
+    get_prefetcher().cancel()
+
+def get_prefetcher():
+    """表示後の先読みを実行するワーカー（グループ内で共有する）"""
+    return TENANT.resource("prefetcher", Prefetcher)
+
+def check_shared_revision():
+    """
+    他のプロセスが予約データを更新していたら（共有キャッシュのリビジョンが変わっていたら）、
+    このプロセスのキャッシュを捨てる
+    """
+    if not isinstance(reservation_store, SharedReservationStore): return
+    seen = TENANT.resource("shared_revision", dict)
+    revision = reservation_store.shared.revision(GSHEET_ID)
+    if "revision" in seen and seen["revision"] != revision:
+        clear_reservation_caches(invalidate=False)
+    seen["revision"] = revision
+
+check_shared_revision()
+
+
+# ===== 定期メンテナンス（過去の予約を「完了」に更新） =====
+# 定期処理のリースの有効期間（秒）。起動直後の実行と毎日の実行が、プロセスごとに重ならないようにする
+MAINTENANCE_LEASE_SECONDS = 3600
+
+@st.cache_resource(show_spinner=False)
+def start_status_maintenance(group, sheet_id):
+    """スプレッドシートごとに1回だけ、毎日のステータス更新スレッドを起動する"""
+    shared = get_shared_cache(st.secrets)
+
+    def _job():
+        # 複数プロセスで動かしている場合（[shared_cache]）は、リースを取れた1プロセスだけが実行する。
+        # リースは解放せず、期限まで他のプロセスの同じ日の実行を止める
+        if shared is not None and not shared.acquire(f"maintenance:{sheet_id}", seconds=MAINTENANCE_LEASE_SECONDS):
+            return
+        # 起動した時の Tenant はその後捨てられていることがあるため、実行のたびに取り直す
+        tenant = get_tenant_registry().get(group, sheet_id)
+        log_sheet = get_or_create_gsheet(tenant, CHANGELOG_SHEET, CHANGELOG_COLUMNS)
+        if complete_past_reservations(get_gsheet(tenant, "reservations"), log_sheet):
+            clear_reservation_caches()
+        compact_changelog(log_sheet)
+    return start_daily_scheduler(_job)
+
+start_status_maintenance(GROUP, GSHEET_ID)
+
+
+# ===== 読み取り専用 API（secrets の [api] port を設定した場合のみ） =====
+@st.cache_resource(show_spinner=False)
+def start_api_server():
+    """プロセスごとに1回だけ、予約データを共有する API サーバーを起動する（ポートを使えなければ None）"""
+    conf = st.secrets.get("api", {})
+    if not conf.get("port"): return None
+
+    def resolve(group):
+        sheet_id = GROUP_SHEETS.get(group)
+        if sheet_id is None: return None
+        tenant = get_tenant_registry().get(group, sheet_id)
+        return tenant.resource("api_source", lambda: ApiSource(
+            get_reservation_store(tenant), get_gsheet(tenant, "lottery_periods"),
+        ))
+    return serve_in_background(conf.get("host", DEFAULT_API_HOST), int(conf["port"]), resolve)
+
+start_api_server()
+
+
+# ===== カレンダー購読（.ics フィード） =====
+# default 以外のグループのフィードは ics/<グループ名>/ に置く
+FEED_PATH = "ics" if GROUP == DEFAULT_GROUP else f"ics/{GROUP}"
+
+def get_feed_cache():
+    """グループ内で共有するフィードのキャッシュ"""
+    return TENANT.resource("feed_cache", FeedCache)
+
+def publish_ical_feeds():
+    """
+    予約データか日付が変わった時だけ .ics ファイルを書き直す
+
+    ファイルは Streamlit の静的配信（/app/static/ics/）で返すため、
+    カレンダーアプリの定期取得ではスクリプトも Sheets の読み込みも動かない。
+    """
+    version = load_data_version()
+    today = jst_today()
+    cache = get_feed_cache()
+    if (version, today) == (cache.version, cache.today): return
+    feed_dir = FEED_DIR if GROUP == DEFAULT_GROUP else os.path.join(FEED_DIR, GROUP)
+    publish_feeds(cache, version, load_reservations(), today, load_nickname_options(), feed_dir=feed_dir)
+
+publish_ical_feeds()
+
+
+# ===== 参加者ごとの予約の索引 =====
+def get_member_index_holder():
+    """グループ内で共有する索引と、その作成・更新のロック"""
+    return TENANT.resource("member_index", lambda: {"lock": threading.Lock()})
+
+def get_member_index():
+    """
+    ニックネーム → 予約の索引
+
+    データのバージョンごとに1回だけ作る。参加表明の変更は update_member_index() で差分を反映する。
+    """
+    holder = get_member_index_holder()
+    version = load_data_version()
+    with holder["lock"]:
+        if holder.get("version") != version:
+            holder["index"] = MemberIndex.from_frame(load_reservations())
+            holder["version"] = version
+        return holder["index"]
+
+def update_member_index(idx, base_version, df):
+    """
+    予約1件の参加表明を変更して保存した後に、索引を作り直さずに更新する
+
+    索引が変更前のデータ（base_version）から作ったものでなければ（他のセッションの保存を
+    含んでいなければ）、差分では最新にならないため捨てて、次の get_member_index() で作り直す。
+
+    Args:
+        idx: 変更した予約の行インデックス
+        base_version: 変更前の予約データの data_version()
+        df: 保存した予約データ
+    """
+    holder = get_member_index_holder()
+    with holder["lock"]:
+        if holder.get("version") != base_version:
+            holder.pop("index", None)
+            holder.pop("version", None)
+            return
+        holder["index"].set_roles(idx, {c: df.at[idx, c] for c in ["participants", "consider", "absent"]})
+        holder["version"] = data_version(df)
 
 
 # ==========================================
 # 3. 抽選リマインダー
 # ==========================================
-@st.cache_data(ttl=3600)
+@TENANT.cached(ttl=3600)
 def load_lottery_data_cached():
     try:
-        lottery_sheet = get_gsheet(GSHEET_ID, "lottery_periods")
+        lottery_sheet = get_gsheet(TENANT, "lottery_periods")
         records = run_with_retry(lottery_sheet.get_all_records)
         return pd.DataFrame(records)
     except Exception:
         return pd.DataFrame()
 
-@st.cache_data(ttl=3600)
+@TENANT.cached(ttl=3600)
 def load_facilities_data():
     """
     facilitiesシートから施設情報を読み込む
@@ -182,7 +596,7 @@ def load_facilities_data():
         dict: {施設名: {"url": URL, "address": 住所}}
     """
     try:
-        facilities_sheet = get_gsheet(GSHEET_ID, "facilities")
+        facilities_sheet = get_gsheet(TENANT, "facilities")
         records = run_with_retry(facilities_sheet.get_all_records)
         df = pd.DataFrame(records)
         
@@ -209,7 +623,7 @@ def add_facility_if_not_exists(facility_name):
         return
     
     try:
-        facilities_sheet = get_gsheet(GSHEET_ID, "facilities")
+        facilities_sheet = get_gsheet(TENANT, "facilities")
         records = run_with_retry(facilities_sheet.get_all_records)
         df = pd.DataFrame(records)
         
@@ -233,47 +647,7 @@ def add_facility_if_not_exists(facility_name):
         pass
 
 def check_and_show_reminders():
-    df = load_lottery_data_cached()
-    if df.empty: return []
-
-    jst_now = datetime.utcnow() + timedelta(hours=9)
-    today = jst_now.date()
-    
-    messages_to_show = []
-
-    for _, row in df.iterrows():
-        enabled_val = str(row.get("enabled", "")).lower()
-        if enabled_val not in ["true", "1", "yes", "有効"]: continue
-
-        freq = row.get("frequency", "")
-        msg = row.get("messages", "")
-        if not msg: continue
-
-        is_match = False
-        try:
-            if freq == "monthly":
-                s_day = int(row.get("start_day", 0))
-                e_day = int(row.get("end_day", 32))
-                if s_day <= today.day <= e_day: is_match = True
-            elif freq == "weekly":
-                if today.strftime("%a") in str(row.get("weekdays", "")): is_match = True
-            elif freq == "yearly":
-                s_month = int(row.get("start_month", 0))
-                s_day = int(row.get("start_day", 0))
-                e_month = int(row.get("end_month", 0))
-                e_day = int(row.get("end_day", 0))
-                if s_month > 0:
-                    start_date = date(today.year, s_month, s_day)
-                    end_date = date(today.year, e_month, e_day)
-                    if start_date > end_date: 
-                        if today >= start_date or today <= end_date: is_match = True
-                    else:
-                        if start_date <= today <= end_date: is_match = True
-        except: continue
-
-        if is_match: messages_to_show.append(msg)
-
-    return messages_to_show
+    return active_reminder_messages(load_lottery_data_cached(), jst_today())
 
 
 # ==========================================
@@ -323,6 +697,37 @@ div[data-testid="stDialog"] button[aria-label="Close"] {
 
 st.markdown("<h3>🎾 テニスコート予約管理</h3>", unsafe_allow_html=True)
 
+# 未同期の書き込みがあれば、表示の前に Sheets に反映する
+if offline.journal.pending() and is_online() and sync_offline_writes():
+    clear_reservation_caches()
+
+# オフライン・未同期の表示
+load_reservations()
+pending_writes = offline.journal.pending()
+if not is_online() or pending_writes:
+    badge_col, sync_col = st.columns([4, 1])
+    with badge_col:
+        status = "⚠️ オフライン（前回取得したデータを表示中）" if not is_online() else "🔄 同期待ち"
+        if pending_writes:
+            status += f" / 未同期 {sum(len(r['changes']) for r in pending_writes)}件"
+        st.warning(status)
+    with sync_col:
+        if st.button("今すぐ同期", use_container_width=True):
+            offline.mark_up()
+            clear_reservation_caches()
+            st.rerun()
+
+sync_conflicts = offline.journal.conflicts()
+if sync_conflicts:
+    with st.expander(f"⚠️ 同期できなかった変更 {len(sync_conflicts)}件", expanded=False):
+        st.caption("オフライン中の変更のうち、同じ予約が他の人にも変更されていたため反映しなかったものです。")
+        for c in sync_conflicts:
+            row = c.get("after") or c.get("before") or []
+            st.write(f"{c['ts']} {c['op']}: {' / '.join(str(v) for v in row[:3])}")
+        if st.button("確認済みにする"):
+            offline.journal.clear_conflicts()
+            st.rerun()
+
 # お知らせをトグルに表示
 reminder_messages = check_and_show_reminders()
 if reminder_messages:
@@ -330,17 +735,47 @@ if reminder_messages:
         for m in reminder_messages:
             st.info(m)
 
+@st.fragment
+def ical_subscription_view():
+    with st.expander("📆 カレンダー購読", expanded=False):
+        target = st.selectbox("対象", ["全体"] + load_nickname_options(), key="ical_target")
+        name = ALL_FEED_NAME if target == "全体" else member_feed_name(target)
+        headers = st.context.headers
+        base = f"{headers.get('X-Forwarded-Proto', 'http')}://{headers.get('Host', 'localhost:8501')}"
+        st.code(f"{base}/app/static/{FEED_PATH}/{name}", language=None)
+        st.caption("Googleカレンダー等の「URLで追加」に登録すると、今後の予約が自動で反映されます。")
+
+ical_subscription_view()
+
 # 成功メッセージの表示（toastを使用）
 if 'show_success_message' in st.session_state and st.session_state['show_success_message']:
     st.toast(st.session_state['show_success_message'], icon="✅")
     st.session_state['show_success_message'] = None
 
-df_res = load_reservations()
-
+# 状態変数の初期化（フラグメント単独の再実行でも参照するため先頭でまとめて行う）
 # リストの選択状態をクリアするためのカウンター
 if 'list_reset_counter' not in st.session_state:
     st.session_state['list_reset_counter'] = 0
 
+if 'is_popup_open' not in st.session_state:
+    st.session_state['is_popup_open'] = False
+
+if 'last_click_signature' not in st.session_state:
+    st.session_state['last_click_signature'] = None
+
+if 'popup_mode' not in st.session_state:
+    st.session_state['popup_mode'] = None
+
+if 'prev_cal_state' not in st.session_state:
+    st.session_state['prev_cal_state'] = None
+
+if 'active_event_idx' not in st.session_state:
+    st.session_state['active_event_idx'] = None
+
+# ★追加: リスト操作直後のカレンダーイベントを無視するためのフラグ
+if 'skip_calendar_event' not in st.session_state:
+    st.session_state['skip_calendar_event'] = False
+
 status_color = {
     "確保": {"bg":"#90ee90","text":"black"},
     "抽選中": {"bg":"#ffd966","text":"black"},
@@ -348,69 +783,254 @@ status_color = {
     "完了": {"bg":"#d3d3d3","text":"black"}
 }
 
-events = []
-for idx, r in df_res.iterrows():
-    raw_date = r.get("date")
-    if pd.isna(raw_date) or raw_date == "": continue
-    if isinstance(raw_date, str):
-        try: curr_date = datetime.fromisoformat(str(raw_date)[:10]).date()
-        except: continue
-    else: curr_date = raw_date
+def build_calendar_events(df, title_prefix="", ids=None):
+    """
+    予約データからカレンダー表示用のイベント一覧を生成
 
-    s_hour = safe_int(r.get("start_hour"), 9)
-    s_min  = safe_int(r.get("start_minute"), 0)
-    e_hour = safe_int(r.get("end_hour"), 11)
-    e_min  = safe_int(r.get("end_minute"), 0)
+    Args:
+        df: load_reservations() / load_occurrences() の結果
+        title_prefix: タイトルの先頭に付ける文字（繰り返し予約の目印など）
+        ids: イベントの id（df の行の順。省略時は行インデックス。通常の予約は EventCache が予約のキーを渡す）
 
-    try:
-        start_dt = datetime.combine(curr_date, dt_time(s_hour, s_min))
-        end_dt   = datetime.combine(curr_date, dt_time(e_hour, e_min))
-    except Exception: continue
+    Returns:
+        list: streamlit-calendar に渡すイベント辞書のリスト
+    """
+    events = []
+    for idx, (_, r) in zip(df.index if ids is None else ids, df.iterrows()):
+        raw_date = r.get("date")
+        if pd.isna(raw_date) or raw_date == "": continue
+        if isinstance(raw_date, str):
+            try: curr_date = datetime.fromisoformat(str(raw_date)[:10]).date()
+            except: continue
+        else: curr_date = raw_date
+
+        s_hour = safe_int(r.get("start_hour"), 9)
+        s_min  = safe_int(r.get("start_minute"), 0)
+        e_hour = safe_int(r.get("end_hour"), 11)
+        e_min  = safe_int(r.get("end_minute"), 0)
+
+        try:
+            start_dt = datetime.combine(curr_date, dt_time(s_hour, s_min))
+            end_dt   = datetime.combine(curr_date, dt_time(e_hour, e_min))
+        except Exception: continue
 
-    color = status_color.get(r["status"], {"bg":"#FFFFFF","text":"black"})
-    title_str = f"{r['status']} {r['facility']}"
+        color = status_color.get(r["status"], {"bg":"#FFFFFF","text":"black"})
+        title_str = f"{title_prefix}{r['status']} {r['facility']}"
 
-    events.append({
-        "id": idx,
-        "title": title_str,
-        "start": start_dt.isoformat(),
-        "end": end_dt.isoformat(),
-        "backgroundColor": color["bg"],
-        "borderColor": color["bg"],
-        "textColor": color["text"]
-    })
+        events.append({
+            "id": idx,
+            "title": title_str,
+            "start": start_dt.isoformat(),
+            "end": end_dt.isoformat(),
+            "backgroundColor": color["bg"],
+            "borderColor": color["bg"],
+            "textColor": color["text"]
+        })
+    return events
+
+
+# ==========================================
+# 5. イベントハンドリング（★完全解決版）
+# ==========================================
+def handle_calendar_state(cal_state, df):
+    """
+    カレンダーの操作結果からポップアップの開閉を判定する
+
+    Args:
+        cal_state: calendar() の戻り値
+        df: カレンダー描画に使用した予約データ
+    """
+    if not cal_state:
+        return
+
+    # 状態が変わった時だけ処理
+    if cal_state == st.session_state['prev_cal_state']:
+        return
+    st.session_state['prev_cal_state'] = cal_state
+
+    # 表示中の期間を記録（繰り返し予約の展開範囲に使う）
+    view = cal_state.get("view", {})
+    view_start = view.get("activeStart") or view.get("currentStart")
+    view_end = view.get("activeEnd") or view.get("currentEnd")
+    if view_start and view_end:
+        st.session_state['calendar_window'] = (
+            to_jst_date(view_start) - timedelta(days=1), to_jst_date(view_end) + timedelta(days=1)
+        )
+
+    # ★最優先: リスト操作直後の「カレンダーの更新（エコー）」なら無視して通す
+    if st.session_state['skip_calendar_event']:
+        st.session_state['skip_calendar_event'] = False
+        # 念のため現在のビュー開始日を更新しておく（次回の誤動作防止）
+        current_view = cal_state.get("view", {})
+        st.session_state['last_view_start'] = current_view.get("currentStart")
+        # 何もせず終了（ポップアップは維持される）
+        return
+
+    # 通常の判定処理へ
+    current_view = cal_state.get("view", {})
+    current_start = current_view.get("currentStart")
+
+    if 'last_view_start' not in st.session_state:
+        st.session_state['last_view_start'] = current_start
+
+    # 1. ナビゲーション（月移動）チェック
+    # カレンダーは固定の key でマウントしたまま（再マウントしない）。ポップアップの状態は
+    # ダイアログを閉じた時（✕ / Esc は on_dismiss_dialog()）に戻しているので、ここでは表示月だけを記録する
+    if current_start != st.session_state['last_view_start']:
+        st.session_state['last_view_start'] = current_start
+        return
+
+    # 2. クリックチェック
+    callback = cal_state.get("callback")
+    current_signature = None
+    if callback == "dateClick":
+        current_signature = f"date_{cal_state['dateClick']['date']}"
+    elif callback == "eventClick":
+        current_signature = f"event_{cal_state['eventClick']['event']['id']}"
+
+    # 新しいクリックなら開く
+    if current_signature and current_signature != st.session_state['last_click_signature']:
+        st.session_state['last_click_signature'] = current_signature
+        st.session_state['is_popup_open'] = True
+
+        if callback == "dateClick":
+            st.session_state['clicked_date'] = cal_state["dateClick"]["date"]
+            st.session_state['active_event_idx'] = None
+            st.session_state['popup_mode'] = "new"
+            st.session_state['list_reset_counter'] += 1
+
+        elif callback == "eventClick":
+            event_id = cal_state["eventClick"]["event"]["id"]
+            occurrence = parse_occurrence_id(event_id)
+            # 繰り返し予約の回は展開した回のID、通常の予約は予約のキー（行インデックスに引き直す）
+            idx = event_id if occurrence else get_event_cache().row_index(event_id)
+            if idx is None:
+                # 表示した後に削除された予約
+                st.session_state['is_popup_open'] = False
+                return
+            st.session_state['active_event_idx'] = idx
+            if occurrence:
+                st.session_state['clicked_date'] = str(occurrence[1])
+            elif idx in df.index:
+                target_date = df.loc[idx]["date"]
+                st.session_state['clicked_date'] = str(target_date)
+            st.session_state['popup_mode'] = "edit"
+            st.session_state['list_reset_counter'] += 1
+
+        # ダイアログはページ全体の再実行で開く
+        st.rerun()
 
 
 # ---------------------------------------------------------
-# 5. 画面表示（タブ切り替え⇒ラジオボタン切り替えに変更）
+# 6. 画面表示（カレンダー・リストはフラグメント単位で再実行）
 # ---------------------------------------------------------
-# 表示モードが変わったらポップアップを閉じる
-if 'prev_view_mode' not in st.session_state:
-    st.session_state['prev_view_mode'] = None
+def default_calendar_window(initial_date):
+    """カレンダーの表示期間がまだ分からない時の展開範囲（表示月の6週間分）"""
+    return month_grid_window(to_jst_date(str(initial_date)[:7] + "-01"))
 
-view_mode = st.radio(
-    "表示モード", 
-    ["📅 カレンダー", "📋 予約リスト"], 
-    horizontal=True,
-    label_visibility="collapsed",
-    key="view_mode_selector"
-)
+def get_event_cache():
+    """予約 → イベントの変換結果（グループ内で共有し、変わった予約だけ作り直す）"""
+    return TENANT.resource("calendar_events", lambda: EventCache(build_calendar_events))
 
-# モードが切り替わったらポップアップを閉じる
-if st.session_state['prev_view_mode'] is not None and st.session_state['prev_view_mode'] != view_mode:
-    st.session_state['is_popup_open'] = False
-    st.session_state['last_click_signature'] = None
-    st.session_state['active_event_idx'] = None
-    st.session_state['list_reset_counter'] += 1
-st.session_state['prev_view_mode'] = view_mode
+def build_event_links(r, facilities):
+    """
+    ダイアログに表示するリンク
 
-# === モード1: カレンダー表示 ===
-if view_mode == "📅 カレンダー":
+    Args:
+        r: 予約1件
+        facilities: load_facilities_data() の結果
+
+    Returns:
+        dict: {"calendar_url", "facility_url", "address", "map_url"}
+    """
+    info = facilities.get(r['facility'], {})
+    address = info.get('address', '')
+    return {
+        "calendar_url": generate_google_calendar_url(r),
+        "facility_url": info.get('url', ''),
+        "address": address,
+        "map_url": f"https://www.google.com/maps/search/?api=1&query={quote(address)}" if address else "",
+    }
+
+# リンクを保持するデータのバージョンの数
+EVENT_LINK_VERSIONS = 2
+
+def get_event_links(idx, r, version):
+    """
+    予約1件のリンク（データのバージョンと行インデックスごと。施設情報のキャッシュと同じ1時間ごとに作り直す）
+
+    先読みのジョブは、ジョブの中で読んだデータのバージョンを渡す。ジョブの実行中にデータが更新されても、
+    古いデータから作ったリンクが新しいバージョンのリンクとして使われることはない。
+
+    Args:
+        idx: 予約の行インデックス（繰り返し予約の回は ID）
+        r: 予約1件
+        version: r を読んだ時のデータのバージョン（load_data_version()）
+    """
+    holder = TENANT.resource("event_links", lambda: {"lock": threading.Lock(), "created": 0, "links": OrderedDict()})
+    with holder["lock"]:
+        if time.monotonic() - holder["created"] > 3600:
+            holder.update(created=time.monotonic(), links=OrderedDict())
+        links = holder["links"].setdefault(version, {})
+        holder["links"].move_to_end(version)
+        # 表示中のバージョンと、更新直後に先読みが作った直前のバージョンだけを残す
+        while len(holder["links"]) > EVENT_LINK_VERSIONS:
+            holder["links"].popitem(last=False)
+        found = links.get(idx)
+    if found is not None:
+        return found
+    # リンクは lock の外で作り、書き込みだけ lock の中で行う（先読みのスレッドと同時に書くため）
+    built = build_event_links(r, load_facilities_data())
+    with holder["lock"]:
+        return links.setdefault(idx, built)
+
+def prefetch_around(window):
+    """
+    表示中の期間とその前後の月のイベント・予約リストの行・施設情報・リンクを先読みする
+
+    描画の後に、1回の実行につき1回だけ呼ぶ（画面全体の実行ではページの最後、
+    カレンダーの月移動ではカレンダーの fragment から）。
+    予約リストの行は、セッションの「過去の予約も表示する」の設定で読む。
+
+    Args:
+        window: 表示中の期間 (開始日, 終了日)
+    """
+    center = window[0] + (window[1] - window[0]) / 2
+    windows = [window] + [month_grid_window(m) for m in adjacent_months(center)]
+    show_past = st.session_state.get("filter_show_past", False)
+
+    def _job():
+        df = load_reservations()
+        version = data_version(df)
+        get_event_cache().get(df, version)
+        load_list_rows(show_past)
+        load_facilities_data()
+        start, end = min(w[0] for w in windows), max(w[1] for w in windows)
+        for idx, r in df.iterrows():
+            if isinstance(r['date'], date) and start <= r['date'] < end:
+                get_event_links(idx, r, version)
+        for w in windows:
+            load_occurrence_events(*w)
+            for idx, r in load_occurrences(*w).iterrows():
+                get_event_links(idx, r, version)
+
+    get_prefetcher().request((load_data_version(), window, show_past), _job)
+
+@st.fragment
+def calendar_view():
+    df_res = load_reservations()
+
+    # 表示月はカレンダーが保持する。表示モードを切り替えて戻った時は最後に表示していた月から
     initial_date = datetime.now().strftime("%Y-%m-%d")
-    if "clicked_date" in st.session_state and st.session_state["clicked_date"]:
+    if st.session_state.get('last_view_start'):
+        initial_date = str(to_jst_date(st.session_state['last_view_start']))
+    elif st.session_state.get("clicked_date"):
         initial_date = st.session_state["clicked_date"]
 
-    cal_key = str(initial_date)[:7]
+    # 表示中の期間のイベントだけを渡す（繰り返し予約も表示中の期間だけ展開する）
+    window = st.session_state.get('calendar_window') or default_calendar_window(initial_date)
+    events = get_event_cache().between(df_res, load_data_version(), *window)
+    events = events + load_occurrence_events(*window)
 
     cal_state = calendar(
         events=events,
@@ -427,65 +1047,24 @@ if view_mode == "📅 カレンダー":
             "titleFormat": {"year": "numeric", "month": "2-digit"},
             "longPressDelay": 500 
         },
-        key=f"calendar_{cal_key}"
+        key="calendar"
     )
 
-# === モード2: 予約リスト表示 ===
-elif view_mode == "📋 予約リスト":
-    # ★重要: カレンダー変数を空にしておく（下のイベントハンドリングを無効化するため）
-    cal_state = None 
-    
+    handle_calendar_state(cal_state, df_res)
+
+    # 月移動で表示期間が変わったら、その期間の繰り返し予約を展開して描画し直す
+    # （fragment だけの再実行ではページの最後の先読みが動かないため、ここで新しい期間の前後を先読みする）
+    if st.session_state.get('calendar_window', window) != window:
+        prefetch_around(st.session_state['calendar_window'])
+        st.rerun(scope="fragment")
+
+
+@st.fragment
+def list_view():
     show_past = st.checkbox("過去の予約も表示する", value=False, key="filter_show_past")
-    df_list = df_res.copy()
-    
-    if not df_list.empty:
-        if not show_past:
-            today_jst = (datetime.utcnow() + timedelta(hours=9)).date()
-            df_list = df_list[df_list['date'] >= today_jst]
-
-        def format_time_range(r):
-            sh = int(safe_int(r.get('start_hour')))
-            sm = int(safe_int(r.get('start_minute')))
-            eh = int(safe_int(r.get('end_hour')))
-            em = int(safe_int(r.get('end_minute')))
-            return f"{sh:02}:{sm:02} - {eh:02}:{em:02}"
-        
-        df_list['時間'] = df_list.apply(format_time_range, axis=1)
-        
-        def format_list_col(lst):
-            if isinstance(lst, list): return ", ".join(lst)
-            return str(lst)
-        
-        # 参加者と保留を統合して表示
-        def format_participants_with_consider(row):
-            parts = []
-            participants = row['participants'] if isinstance(row['participants'], list) else []
-            consider = row['consider'] if isinstance(row['consider'], list) else []
-            
-            if participants:
-                parts.append(", ".join(participants))
-            if consider:
-                parts.append(f"(保留 {", ".join(consider)})")
-            
-            return " ".join(parts) if parts else ""
-        
-        df_list['参加者'] = df_list.apply(format_participants_with_consider, axis=1)
-        
-        # メモ欄の<br>をスペースに変換
-        df_list['message'] = df_list['message'].apply(lambda x: str(x).replace('<br>', ' ') if pd.notna(x) else '')
-
-        def format_date_with_weekday(d):
-            if not isinstance(d, (date, datetime)): return str(d)
-            weekdays = ["(月)", "(火)", "(水)", "(木)", "(金)", "(土)", "(日)"]
-            wd = weekdays[d.weekday()]
-            return f"{d.strftime('%Y-%m-%d')} {wd}"
-
-        df_list['日付'] = df_list['date'].apply(format_date_with_weekday)
-        df_list['日時'] = df_list['日付'] + " " + df_list['時間']
-        df_list['施設名'] = df_list['facility']
-        df_list['ステータス'] = df_list['status']
-        df_list['メモ'] = df_list['message']
-        
+    df_list = load_list_rows(show_past)
+
+    if df_list is not None:
         display_cols = ['日時', '施設名', 'ステータス', '参加者', 'メモ']
 
         df_display = df_list[display_cols]
@@ -494,8 +1073,10 @@ elif view_mode == "📋 予約リスト":
 
         table_key = f"reservation_list_table_{st.session_state['list_reset_counter']}"
 
+        # 行インデックスに通常の予約（整数）と繰り返し予約（文字列）が混在するため、
+        # 表示用には連番に振り直す（選択行は df_display.index から引き直す）
         event_selection = st.dataframe(
-            df_display,
+            df_display.reset_index(drop=True),
             use_container_width=True,
             hide_index=True,
             on_select="rerun",
@@ -518,10 +1099,10 @@ elif view_mode == "📋 予約リスト":
             # リストで選択が変わった時
             if st.session_state.get('active_event_idx') != actual_idx:
                 st.session_state['active_event_idx'] = actual_idx
-                target_date = df_res.loc[actual_idx]["date"]
+                target_date = df_list.loc[actual_idx]["date"]
                 st.session_state['clicked_date'] = str(target_date)
                 
-                # ポップアップON
+                # ポップアップON（ダイアログはページ全体の再実行で開く）
                 st.session_state['is_popup_open'] = True
                 st.session_state['popup_mode'] = "edit"
                 st.rerun()
@@ -529,104 +1110,157 @@ elif view_mode == "📋 予約リスト":
         st.info("表示できる予約データがありません。")
 
 
-# ==========================================
-# 6. イベントハンドリング（★完全解決版）
-# ==========================================
+@st.fragment
+def my_schedule_view():
+    members = load_nickname_options()
+    if not members:
+        st.info("まだ参加表明がありません。")
+        return
+    member = st.selectbox("名前", members, key="my_schedule_member")
+
+    df_res = load_reservations()
+    mine = get_member_index().reservations(member)
+    today = jst_today()
+    rows = []
+    for idx, col in mine.items():
+        if idx not in df_res.index: continue
+        r = df_res.loc[idx]
+        if pd.isna(r["date"]) or r["date"] < today: continue
+        rows.append({
+            "日付": r["date"],
+            "時間": f"{safe_int(r['start_hour'], 9):02d}:{safe_int(r['start_minute']):02d}-{safe_int(r['end_hour'], 11):02d}:{safe_int(r['end_minute']):02d}",
+            "施設": r["facility"],
+            "ステータス": r["status"],
+            "参加": "参加" if col == "participants" else "保留",
+        })
+    st.markdown("**今後の予定**")
+    if rows:
+        st.dataframe(pd.DataFrame(rows).sort_values(["日付", "時間"]), hide_index=True, use_container_width=True)
+    else:
+        st.caption("予定はありません。")
+
+    long_df = attendance_frame(df_res)
+    tab_member, tab_facility = st.tabs(["月ごとの参加状況", "施設ごとの集計"])
+    with tab_member:
+        stats = member_monthly_stats(long_df, member).drop(columns="member")
+        st.dataframe(stats.sort_values("month", ascending=False), hide_index=True, use_container_width=True)
+    with tab_facility:
+        stats = facility_monthly_stats(df_res, long_df)
+        st.dataframe(stats.sort_values(["month", "facility"], ascending=[False, True]), hide_index=True, use_container_width=True)
+
+
+@st.fragment
+def bulk_import_view():
+    st.caption("抽選結果などをCSV/TSVでまとめて登録します。列: date, facility, status（当選/落選/確保/抽選中/中止）, start, end（HH:MM）, message")
+    if not is_online() or offline.journal.pending():
+        st.info("オフライン中・未同期の変更がある間は一括登録できません。")
+        return
+    uploaded = st.file_uploader("ファイルを選択", type=["csv", "tsv", "txt"], key="bulk_import_file")
+    if uploaded is None:
+        return
 
-# 状態変数の初期化
-if 'is_popup_open' not in st.session_state:
-    st.session_state['is_popup_open'] = False
+    try:
+        df_in = read_import_file(uploaded.getvalue(), uploaded.name)
+    except Exception as e:
+        st.error(f"ファイルを読み込めませんでした: {e}")
+        return
 
-if 'last_click_signature' not in st.session_state:
-    st.session_state['last_click_signature'] = None
+    valid_df, errors = validate_import(df_in)
+    if errors:
+        st.warning(f"⚠️ {len(errors)}件のエラーがあります（エラーの行は登録されません）")
+        st.dataframe(pd.DataFrame(errors, columns=["行", "エラー"]), hide_index=True, use_container_width=True)
 
-if 'popup_mode' not in st.session_state:
-    st.session_state['popup_mode'] = None
+    # 書き込み位置がずれないよう、最新のシート内容と突き合わせる
+    current_df = load_reservations()
+    plan = plan_import(current_df, valid_df)
+    st.write(f"新規登録: **{len(plan['new_rows'])}件** / ステータス更新: **{len(plan['status_updates'])}件** / 重複のためスキップ: {plan['duplicates']}件")
 
-if 'prev_cal_state' not in st.session_state:
-    st.session_state['prev_cal_state'] = None
+    if len(plan['new_rows']) == 0 and not plan['status_updates']:
+        return
 
-if 'active_event_idx' not in st.session_state:
+    if st.button("取り込む", type="primary", use_container_width=True):
+        # 共有キャッシュ（[shared_cache]）の鮮度に関係なく、Sheets の最新の内容と突き合わせる
+        reservation_store.refresh(latest=True)
+        load_reservations.clear()
+        current_df = load_reservations()
+        plan = plan_import(current_df, valid_df)
+        result = commit_import(
+            worksheet, get_gsheet(TENANT, "facilities"),
+            current_df, plan, load_facilities_data().keys()
+        )
+        append_reload(reservation_store.log_sheet)
+        clear_reservation_caches()
+        load_facilities_data.clear()
+        message = f"{result['added'] + result['updated']}件を取り込みました"
+        if result["skipped"]:
+            message += f"（{result['skipped']}件は他の人が変更していたため更新していません）"
+        st.session_state['show_success_message'] = message
+        st.rerun()
+
+
+# 表示モードが変わったらポップアップを閉じる
+if 'prev_view_mode' not in st.session_state:
+    st.session_state['prev_view_mode'] = None
+
+view_mode = st.radio(
+    "表示モード", 
+    ["📅 カレンダー", "📋 予約リスト", "👤 マイ予定", "📥 一括登録"], 
+    horizontal=True,
+    label_visibility="collapsed",
+    key="view_mode_selector"
+)
+
+# モードが切り替わったらポップアップを閉じる
+if st.session_state['prev_view_mode'] is not None and st.session_state['prev_view_mode'] != view_mode:
+    st.session_state['is_popup_open'] = False
+    st.session_state['last_click_signature'] = None
     st.session_state['active_event_idx'] = None
+    st.session_state['list_reset_counter'] += 1
+st.session_state['prev_view_mode'] = view_mode
 
-# ★追加: リスト操作直後のカレンダーイベントを無視するためのフラグ
-if 'skip_calendar_event' not in st.session_state:
-    st.session_state['skip_calendar_event'] = False
+# === モード1: カレンダー表示 ===
+if view_mode == "📅 カレンダー":
+    calendar_view()
 
-if cal_state:
-    # 状態が変わった時だけ処理
-    if cal_state != st.session_state['prev_cal_state']:
-        st.session_state['prev_cal_state'] = cal_state
-        
-        # ★最優先: リスト操作直後の「カレンダーの更新（エコー）」なら無視して通す
-        if st.session_state['skip_calendar_event']:
-            st.session_state['skip_calendar_event'] = False
-            # 念のため現在のビュー開始日を更新しておく（次回の誤動作防止）
-            current_view = cal_state.get("view", {})
-            st.session_state['last_view_start'] = current_view.get("currentStart")
-            # 何もせず終了（ポップアップは維持される）
-        
-        else:
-            # 通常の判定処理へ
-            current_view = cal_state.get("view", {})
-            current_start = current_view.get("currentStart")
-            
-            if 'last_view_start' not in st.session_state:
-                st.session_state['last_view_start'] = current_start
-            
-            # 1. ナビゲーション（月移動）チェック
-            if current_start != st.session_state['last_view_start']:
-                # 月が変わったら強制リセット
-                st.session_state['last_view_start'] = current_start
-                st.session_state['is_popup_open'] = False
-                st.session_state['active_event_idx'] = None
-                st.session_state['list_reset_counter'] += 1
-            
-            else:
-                # 2. クリックチェック
-                callback = cal_state.get("callback")
-                current_signature = None
-                if callback == "dateClick":
-                    current_signature = f"date_{cal_state['dateClick']['date']}"
-                elif callback == "eventClick":
-                    current_signature = f"event_{cal_state['eventClick']['event']['id']}"
-                
-                # 新しいクリックなら開く
-                if current_signature and current_signature != st.session_state['last_click_signature']:
-                    st.session_state['last_click_signature'] = current_signature
-                    st.session_state['is_popup_open'] = True
-                    
-                    if callback == "dateClick":
-                        st.session_state['clicked_date'] = cal_state["dateClick"]["date"]
-                        st.session_state['active_event_idx'] = None
-                        st.session_state['popup_mode'] = "new"
-                        st.session_state['list_reset_counter'] += 1
-                    
-                    elif callback == "eventClick":
-                        idx = int(cal_state["eventClick"]["event"]["id"])
-                        st.session_state['active_event_idx'] = idx
-                        if idx in df_res.index:
-                            target_date = df_res.loc[idx]["date"]
-                            st.session_state['clicked_date'] = str(target_date)
-                        st.session_state['popup_mode'] = "edit"
-                        st.session_state['list_reset_counter'] += 1
-                    
-                    st.rerun()
+# === モード2: 予約リスト表示 ===
+elif view_mode == "📋 予約リスト":
+    list_view()
+
+# === モード3: マイ予定 ===
+elif view_mode == "👤 マイ予定":
+    my_schedule_view()
+
+# === モード4: 一括登録 ===
+elif view_mode == "📥 一括登録":
+    bulk_import_view()
+
+# カレンダー・予約リストの描画の後に、カレンダーで最後に表示していた期間（なければ今月）の前後を先読みする
+# （リストから予約を開いた時もこの期間のリンクを使う）
+if view_mode in ("📅 カレンダー", "📋 予約リスト"):
+    prefetch_around(st.session_state.get('calendar_window') or default_calendar_window(jst_today()))
 
 
 # ==========================================
 # 7. ポップアップ画面の定義（閉じるボタン完全版）
 # ==========================================
-@st.dialog("予約内容の登録・編集")
+# ※ st.dialog の中の操作はダイアログ関数だけが再実行される。
+#   画面全体の変数に頼らず、必要なデータはここでキャッシュから取得する。
+def on_dismiss_dialog():
+    """ダイアログを ✕ / Esc で閉じた時に、ポップアップの状態を戻す（同じ予定・日付をもう一度クリックできるように）"""
+    st.session_state['is_popup_open'] = False
+    st.session_state['last_click_signature'] = None
+    st.session_state['active_event_idx'] = None
+
+@st.dialog("予約内容の登録・編集", on_dismiss=on_dismiss_dialog)
 def entry_form_dialog(mode, idx=None, date_str=None):
+    df_res = load_reservations()
+
     # --- A. 新規登録モード ---
     if mode == "new":
         display_date = to_jst_date(date_str)
         st.write(f"📅 **日付:** {display_date}")
         
-        past_facilities = []
-        if 'facility' in df_res.columns:
-            past_facilities = df_res['facility'].dropna().unique().tolist()
+        past_facilities = load_facility_options()
         
         facility_select = st.selectbox("施設名", options=["(施設名を選択)"] + past_facilities + ["新規登録"], index=0)
         facility = st.text_input("施設名を入力") if facility_select == "新規登録" else (facility_select if facility_select != "(施設名を選択)" else "")
@@ -637,6 +1271,23 @@ def entry_form_dialog(mode, idx=None, date_str=None):
         with col1: start_time = st.time_input("開始時間", value=dt_time(9, 0), step=timedelta(minutes=30))
         with col2: end_time = st.time_input("終了時間", value=dt_time(11, 0), step=timedelta(minutes=30))
 
+        repeat = st.selectbox("繰り返し", ["なし"] + list(FREQUENCIES.values()), index=0)
+        if repeat != "なし":
+            col_until, col_skip = st.columns(2)
+            with col_until: repeat_until = st.date_input("繰り返しの終了日", value=display_date + timedelta(days=90), min_value=display_date)
+            with col_skip: skip_text = st.text_input("除外する日", placeholder="例: 2025-12-29, 2026-01-05")
+
+        # 同じ施設・時間帯の予約がないかチェック（登録はブロックしない）
+        if facility:
+            res_index = load_reservation_index()
+            overlapping = res_index.overlaps(facility, display_date, start_time, end_time) if end_time > start_time else []
+            if overlapping:
+                times = ", ".join(f"{s:%H:%M}-{e:%H:%M}" for s, e, _ in overlapping)
+                st.warning(f"⚠️ 同じ施設・時間帯に予約があります（{times}）")
+            free = res_index.free_slots(facility, display_date)
+            if free:
+                st.caption("空き時間: " + ", ".join(f"{s:%H:%M}-{e:%H:%M}" for s, e in free))
+
         message = st.text_area("メモ", placeholder="例：集合時間や持ち物など")
 
         st.markdown('<div style="margin-top: -20px;"></div>', unsafe_allow_html=True)
@@ -649,6 +1300,24 @@ def entry_form_dialog(mode, idx=None, date_str=None):
                     st.error("⚠️ 施設名を選択してください")
                 elif end_time <= start_time:
                     st.error("⚠️ 終了時間は開始時間より後にしてください")
+                elif repeat != "なし" and not is_online():
+                    st.error("⚠️ オフライン中は繰り返し予約を登録できません")
+                elif repeat != "なし":
+                    # 繰り返し予約はルールを1行保存するだけ（各回は表示時に展開）
+                    add_facility_if_not_exists(facility)
+                    frequency = {v: k for k, v in FREQUENCIES.items()}[repeat]
+                    if not save_recurrence(new_rule(
+                        facility, status, frequency, display_date, repeat_until,
+                        start_time, end_time, parse_exception_dates(skip_text), message.replace('\n', '<br>')
+                    )):
+                        st.error("⚠️ 接続できないため、繰り返し予約を登録できませんでした")
+                    else:
+                        st.session_state['show_success_message'] = '繰り返し予約を登録しました'
+                        st.session_state['is_popup_open'] = False
+                        st.session_state['last_click_signature'] = None
+                        st.session_state['active_event_idx'] = None
+                        st.session_state['list_reset_counter'] += 1
+                        st.rerun()
                 else:
                     # 施設名をfacilitiesシートに自動追加
                     add_facility_if_not_exists(facility)
@@ -688,6 +1357,11 @@ def entry_form_dialog(mode, idx=None, date_str=None):
 
     # --- B. 編集モード ---
     elif mode == "edit" and idx is not None:
+        # 繰り返し予約の回（まだ reservations シートにない）は展開結果から表示する
+        occurrence = parse_occurrence_id(idx)
+        if occurrence:
+            df_res = load_occurrences(occurrence[1], occurrence[1] + timedelta(days=1))
+
         if idx not in df_res.index:
             st.error("イベントが削除されました。")
             if st.button("閉じる"):
@@ -703,10 +1377,10 @@ def entry_form_dialog(mode, idx=None, date_str=None):
         r = df_res.loc[idx]
         
         # 施設情報を取得
-        facilities_data = load_facilities_data()
-        facility_info = facilities_data.get(r['facility'], {})
-        facility_url = facility_info.get('url', '')
-        facility_address = facility_info.get('address', '')
+        # 表示中の期間の予約は先読みで作成済み
+        links = get_event_links(idx, r, load_data_version())
+        facility_url = links['facility_url']
+        facility_address = links['address']
         
         def clean_join(lst):
             if not isinstance(lst, list): return 'なし'
@@ -723,8 +1397,7 @@ def entry_form_dialog(mode, idx=None, date_str=None):
         st.markdown(f"**日時:** {r['date']} {int(safe_int(r.get('start_hour'))):02}:{int(safe_int(r.get('start_minute'))):02} - {int(safe_int(r.get('end_hour'))):02}:{int(safe_int(r.get('end_minute'))):02}")
         
         # Googleカレンダーに追加リンク
-        calendar_url = generate_google_calendar_url(r)
-        st.markdown(f'<a href="{calendar_url}" target="_blank" style="font-size: 14px; color: #1f77b4;">カレンダーに追加</a>', unsafe_allow_html=True)
+        st.markdown(f'<a href="{links['calendar_url']}" target="_blank" style="font-size: 14px; color: #1f77b4;">カレンダーに追加</a>', unsafe_allow_html=True)
         
         # 施設情報表示
         if facility_url:
@@ -733,9 +1406,12 @@ def entry_form_dialog(mode, idx=None, date_str=None):
             st.markdown(f"**施設:** {r['facility']}")
         
         if facility_address:
-            map_url = f"https://www.google.com/maps/search/?api=1&query={quote(facility_address)}"
-            st.markdown(f'**住所:** <a href="{map_url}" target="_blank" style="color: #1f77b4;">{facility_address}</a>', unsafe_allow_html=True)
+            st.markdown(f'**住所:** <a href="{links['map_url']}" target="_blank" style="color: #1f77b4;">{facility_address}</a>', unsafe_allow_html=True)
         st.markdown(f"**ステータス:** {r['status']}")
+        if occurrence:
+            found_rule = find_rule(occurrence[0])
+            if found_rule is not None:
+                st.markdown(f"**繰り返し:** 🔁 {FREQUENCIES.get(found_rule[1]['frequency'], '')}")
         st.markdown(f"**参加:** {clean_join(r.get('participants'))}")
         st.markdown(f"**保留:** {clean_join(r.get('consider'))}")
         st.markdown(f"**メモ:**\n{display_msg}")
@@ -744,13 +1420,7 @@ def entry_form_dialog(mode, idx=None, date_str=None):
         st.divider()
 
         st.subheader("参加表明")
-        past_nicks = []
-        for col in ["participants", "absent", "consider"]:
-            if col in df_res.columns:
-                for lst in df_res[col]:
-                    if isinstance(lst, list): past_nicks.extend([n for n in lst if n])
-                    elif isinstance(lst, str) and lst.strip(): past_nicks.extend(lst.split(";"))
-        past_nicks = sorted(set(past_nicks), key=lambda s: s)
+        past_nicks = load_nickname_options()
         
         col_nick, col_type = st.columns([1, 1])
         with col_nick:
@@ -764,9 +1434,18 @@ def entry_form_dialog(mode, idx=None, date_str=None):
             if st.button("反映する", type="primary", use_container_width=True):
                 if not nick:
                     st.warning("名前を選択してください")
+                elif occurrence:
+                    # 初めて参加表明された回だけ reservations シートに書き込む
+                    if part_type != "削除":
+                        new_idx = materialize_occurrence(idx, nick, part_type)
+                        if new_idx is not None:
+                            st.session_state['active_event_idx'] = new_idx
+                    st.success("反映しました")
+                    st.rerun()
                 else:
                     current_df = load_reservations()
                     if idx in current_df.index:
+                        base_version = data_version(current_df)
                         participants = list(current_df.at[idx, "participants"]) if isinstance(current_df.at[idx, "participants"], list) else []
                         absent = list(current_df.at[idx, "absent"]) if isinstance(current_df.at[idx, "absent"], list) else []
                         consider = list(current_df.at[idx, "consider"]) if isinstance(current_df.at[idx, "consider"], list) else []
@@ -783,6 +1462,7 @@ def entry_form_dialog(mode, idx=None, date_str=None):
                         current_df.at[idx, "consider"] = consider
                         
                         save_reservations(current_df)
+                        update_member_index(idx, base_version, current_df)
                         st.success("反映しました")
                         st.rerun()
         with col_close_main:
@@ -795,6 +1475,21 @@ def entry_form_dialog(mode, idx=None, date_str=None):
 
                 st.rerun()
 
+        if occurrence:
+            with st.expander("管理者メニュー（繰り返し予約）"):
+                st.write("この回だけ休みにします（他の回はそのまま）")
+                if st.button("この回を休みにする", use_container_width=True, disabled=not is_online()):
+                    if not skip_occurrence(idx):
+                        st.error("⚠️ 接続できないため、休みにできませんでした")
+                    else:
+                        st.session_state['show_success_message'] = '休みにしました'
+                        st.session_state['is_popup_open'] = False
+                        st.session_state['last_click_signature'] = None
+                        st.session_state['active_event_idx'] = None
+                        st.session_state['list_reset_counter'] += 1
+                        st.rerun()
+            return
+
         with st.expander("管理者メニュー（編集・削除）"):
             edit_tab, delete_tab = st.tabs(["内容編集", "削除"])
             with edit_tab:
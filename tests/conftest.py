@@ -0,0 +1,105 @@
+"""
+テスト共通の設定
+
+src/ のモジュールはフラットに import する（アプリ・コマンドラインと同じ）。
+Google Sheets の代わりに、値を文字列で保持するインメモリのワークシートを使う。
+"""
+import os
+import re
+import sys
+
+import pytest
+from gspread.utils import a1_to_rowcol
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from change_log import CHANGELOG_COLUMNS, ReservationStore  # noqa: E402
+from sheets_common import RESERVATION_COLUMNS  # noqa: E402
+
+
+class FakeWorksheet:
+    """
+    gspread.Worksheet のうち、テストするコードが使うメソッドだけを持つインメモリ実装
+
+    append_rows の "=ROW()-1"（changelog の version 列）は行番号から計算した値にする。
+    """
+    def __init__(self, rows):
+        self.rows = [[str(v) for v in r] for r in rows]
+
+    @property
+    def row_count(self):
+        return max(len(self.rows), 1000)
+
+    def _range(self, range_name):
+        start, _, end = range_name.partition(":")
+        row1, col1 = a1_to_rowcol(start if re.search(r"\d", start) else start + "1")
+        if not end:
+            return row1, col1, row1, col1
+        m = re.match(r"([A-Z]*)(\d*)$", end)
+        col2 = a1_to_rowcol(m.group(1) + "1")[1] if m.group(1) else max([len(r) for r in self.rows] + [1])
+        row2 = int(m.group(2)) if m.group(2) else len(self.rows)
+        return row1, col1, row2, col2
+
+    def get_values(self, range_name=None, **kwargs):
+        if range_name is None:
+            return [list(r) for r in self.rows]
+        row1, col1, row2, col2 = self._range(range_name)
+        return [r[col1 - 1:col2] for r in self.rows[row1 - 1:row2]]
+
+    def get_all_values(self, **kwargs):
+        return self.get_values()
+
+    def row_values(self, row, **kwargs):
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def batch_get(self, ranges, **kwargs):
+        return [self.get_values(r) for r in ranges]
+
+    def update(self, values=None, range_name=None, **kwargs):
+        self._write(range_name or "A1", values)
+
+    def batch_update(self, data, **kwargs):
+        for d in data:
+            self._write(d["range"], d["values"])
+
+    def _write(self, range_name, values):
+        row, col, _, _ = self._range(range_name)
+        for i, vals in enumerate(values):
+            while len(self.rows) < row + i:
+                self.rows.append([])
+            target = self.rows[row + i - 1]
+            for j, v in enumerate(vals):
+                while len(target) < col + j:
+                    target.append("")
+                target[col + j - 1] = str(v)
+
+    def batch_clear(self, ranges):
+        for range_name in ranges:
+            row1, col1, row2, col2 = self._range(range_name)
+            for r in self.rows[row1 - 1:row2]:
+                for c in range(col1 - 1, min(col2, len(r))):
+                    r[c] = ""
+        while self.rows and not any(self.rows[-1]):
+            self.rows.pop()
+
+    def append_rows(self, values, **kwargs):
+        for v in values:
+            row = [str(x) for x in v]
+            if row and row[0] == "=ROW()-1":
+                row[0] = str(len(self.rows))
+            self.rows.append(row)
+
+
+def reservation_row(day, facility, status="確保", start_hour=9, participants=""):
+    """reservations シートの1行（文字列）"""
+    return [day, facility, status, str(start_hour), "0", str(start_hour + 2), "0", participants, "", "", ""]
+
+
+@pytest.fixture
+def make_store():
+    """reservations と changelog のワークシートから ReservationStore を作る"""
+    def _make(rows):
+        worksheet = FakeWorksheet([RESERVATION_COLUMNS] + rows)
+        log_sheet = FakeWorksheet([CHANGELOG_COLUMNS])
+        return ReservationStore(worksheet, log_sheet)
+    return _make
@@ -0,0 +1,57 @@
+from datetime import date
+
+import pandas as pd
+
+from bulk_import import plan_import, read_import_file, validate_import
+from sheets_common import normalize_reservations
+
+
+def existing(*rows):
+    return normalize_reservations(pd.DataFrame([
+        {"date": d, "facility": f, "status": s, "start_hour": 9, "start_minute": 0, "end_hour": 11, "end_minute": 0}
+        for d, f, s in rows
+    ]))
+
+
+def incoming(text):
+    valid, errors = validate_import(read_import_file(text.encode("utf-8"), "import.csv"))
+    assert errors == []
+    return valid
+
+
+def test_new_rows_and_status_updates():
+    df = existing(("2026-11-01", "市民コート", "抽選中"), ("2026-11-02", "中央公園", "確保"))
+    plan = plan_import(df, incoming(
+        "date,facility,status,start,end\n"
+        "2026-11-01,市民コート,当選,9:00,11:00\n"
+        "2026-11-02,中央公園,確保,9:00,11:00\n"
+        "2026-11-03,中央公園,落選,9:00,11:00\n"
+    ))
+    assert plan["status_updates"] == [(0, "確保")]
+    assert plan["duplicates"] == 1
+    assert plan["new_rows"]["date"].tolist() == [date(2026, 11, 3)]
+    assert plan["new_rows"]["status"].tolist() == ["中止"]
+
+
+def test_different_time_is_a_new_reservation():
+    df = existing(("2026-11-01", "市民コート", "確保"))
+    plan = plan_import(df, incoming("date,facility,start,end\n2026-11-01,市民コート,13:00,15:00\n"))
+    assert len(plan["new_rows"]) == 1
+    assert plan["status_updates"] == []
+
+
+def test_later_row_in_file_wins():
+    plan = plan_import(existing(), incoming(
+        "date,facility,status,start,end\n"
+        "2026-11-01,市民コート,抽選中,9:00,11:00\n"
+        "2026-11-01,市民コート,当選,9:00,11:00\n"
+    ))
+    assert plan["new_rows"]["status"].tolist() == ["確保"]
+    assert plan["duplicates"] == 1
+
+
+def test_invalid_rows_are_reported_with_file_line_numbers():
+    text = "date,facility,start,end\n2026-13-01,市民コート,9:00,11:00\n2026-11-01,,11:00,9:00\n"
+    valid, errors = validate_import(read_import_file(text.encode("utf-8"), "import.csv"))
+    assert valid.empty
+    assert [line for line, _ in errors] == [2, 3, 3]
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from change_log import CHANGELOG_COLUMNS, ReservationStore, diff_rows
+from conftest import FakeWorksheet, reservation_row
+from sheets_common import RESERVATION_COLUMNS
+
+A = reservation_row("2026-11-01", "市民コート")
+B = reservation_row("2026-11-02", "中央公園")
+C = reservation_row("2026-11-03", "中央公園")
+D = reservation_row("2026-11-04", "市民コート", status="抽選中")
+
+
+def apply_entries(rows, entries):
+    """変更ログのエントリを先頭から順に適用する（ReservationStore._apply と同じ順序）"""
+    rows = [list(r) for r in rows]
+    for op, pos, values in entries:
+        if op == "insert":
+            rows.insert(pos, values)
+        elif op == "update":
+            rows[pos] = values
+        else:
+            del rows[pos]
+    return rows
+
+
+@pytest.mark.parametrize("old, new", [
+    ([], [A, B]),
+    ([A, B], []),
+    ([A, B, C], [A, C]),
+    ([A, B], [B, A]),
+    ([A, A, B], [A, B]),
+    ([A, B], [A, D, B, C]),
+    ([A, B, C], [D, D]),
+])
+def test_diff_rows_round_trip(old, new):
+    assert apply_entries(old, diff_rows(old, new)) == new
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_diff_rows_round_trip_random(seed):
+    rng = random.Random(seed)
+    pool = [A, B, C, D]
+    old = [rng.choice(pool) for _ in range(rng.randint(0, 8))]
+    new = [rng.choice(pool) for _ in range(rng.randint(0, 8))]
+    assert apply_entries(old, diff_rows(old, new)) == new
+
+
+def test_diff_rows_of_equal_rows_is_empty():
+    assert diff_rows([A, B], [A, B]) == []
+
+
+def test_other_store_applies_written_changes_as_delta():
+    worksheet = FakeWorksheet([RESERVATION_COLUMNS, A, B, C])
+    log_sheet = FakeWorksheet([CHANGELOG_COLUMNS])
+    writer, reader = ReservationStore(worksheet, log_sheet), ReservationStore(worksheet, log_sheet)
+    writer.refresh()
+    reader.refresh()
+
+    writer.write_values([RESERVATION_COLUMNS, A, D, C])
+    assert reader.refresh() == "delta"
+    assert reader.rows == [A, D, C]
+    # 書き込んだ側も次の refresh() で自分の変更ログを適用する
+    assert writer.refresh() == "delta"
+    assert writer.rows == reader.rows
+    assert writer.version == reader.version
+
+
+def test_store_reloads_when_header_changes():
+    worksheet = FakeWorksheet([RESERVATION_COLUMNS, A])
+    log_sheet = FakeWorksheet([CHANGELOG_COLUMNS])
+    writer, reader = ReservationStore(worksheet, log_sheet), ReservationStore(worksheet, log_sheet)
+    writer.refresh()
+    reader.refresh()
+
+    header = RESERVATION_COLUMNS + ["note"]
+    writer.write_values([header, A + ["x"]])
+    assert reader.refresh() == "full"
+    assert reader.header == header
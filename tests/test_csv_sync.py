@@ -0,0 +1,48 @@
+from conftest import reservation_row
+from csv_sync import apply_participation_push, content_hash, plan_sync, sheet_participations
+from sheets_common import RESERVATION_COLUMNS
+
+
+def base(**values):
+    return {k: content_hash(v) for k, v in values.items()}
+
+
+def test_changed_on_one_side_goes_to_the_other():
+    plan = plan_sync(
+        local={"a": "2", "b": "1", "new": "1"},
+        remote={"a": "1", "b": "2"},
+        base=base(a="1", b="1"),
+    )
+    assert plan == {"push": {"a": "2", "new": "1"}, "pull": {"b": "2"}, "conflicts": []}
+
+
+def test_deletions_are_synced_as_none():
+    plan = plan_sync(local={"b": "1"}, remote={"a": "1"}, base=base(a="1", b="1"))
+    assert plan["push"] == {"a": None}
+    assert plan["pull"] == {"b": None}
+
+
+def test_changed_on_both_sides_prefers_sheet():
+    plan = plan_sync(local={"a": "2"}, remote={"a": "3"}, base=base(a="1"))
+    assert plan == {"push": {}, "pull": {"a": "3"}, "conflicts": ["a"]}
+
+
+def test_unchanged_rows_are_not_synced():
+    plan = plan_sync(local={"a": "1"}, remote={"a": "1"}, base={})
+    assert plan == {"push": {}, "pull": {}, "conflicts": []}
+
+
+def test_participations_of_two_courts_on_the_same_day_are_not_guessed():
+    rows = [
+        reservation_row("2026-11-01", "市民コート", participants="a"),
+        reservation_row("2026-11-01", "市民コート", start_hour=13, participants="b"),
+        reservation_row("2026-11-02", "中央公園", participants="c"),
+    ]
+    assert sheet_participations(RESERVATION_COLUMNS, rows) == {"2026-11-02|中央公園|c": "〇"}
+
+    unmatched = apply_participation_push(RESERVATION_COLUMNS, rows, {
+        "2026-11-01|市民コート|d": "〇", "2026-11-02|中央公園|d": "×", "2026-11-09|中央公園|d": "〇",
+    })
+    assert unmatched == ["2026-11-01|市民コート|d", "2026-11-09|中央公園|d"]
+    absent = RESERVATION_COLUMNS.index("absent")
+    assert [r[absent] for r in rows] == ["", "", "d"]
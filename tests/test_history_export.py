@@ -0,0 +1,58 @@
+from datetime import date
+
+import pandas as pd
+
+from history_export import history_frames, read_history, write_partitions
+from sheets_common import normalize_reservations
+
+
+def reservations(*rows):
+    return normalize_reservations(pd.DataFrame([
+        dict(zip(["date", "facility", "start_hour", "end_hour", "participants", "consider"], r),
+             status="確保", start_minute="0", end_minute="0")
+        for r in rows
+    ]))
+
+
+def test_frames_are_keyed_by_reservation_and_partitioned_by_month():
+    frames = history_frames(reservations(
+        ("2026-10-31", "市民コート", "9", "11", "a;b", "c"),
+        ("2026-10-31", "市民コート", "9", "11", "", ""),
+        ("2026-11-01", "中央公園", "13", "15", "a", ""),
+        ("", "中央公園", "9", "11", "a", ""),
+    ))
+    res = frames["reservations"]
+    assert res["reservation"].tolist() == [
+        "2026-10-31 09:00 市民コート", "2026-10-31 09:00 市民コート#2", "2026-11-01 13:00 中央公園",
+    ]
+    assert res[["year", "month"]].values.tolist() == [[2026, 10], [2026, 10], [2026, 11]]
+    assert res["participants"].tolist() == [2, 0, 1]
+    part = frames["participations"]
+    assert sorted(zip(part["reservation"], part["member"])) == [
+        ("2026-10-31 09:00 市民コート", "a"), ("2026-10-31 09:00 市民コート", "b"),
+        ("2026-10-31 09:00 市民コート", "c"), ("2026-11-01 13:00 中央公園", "a"),
+    ]
+
+
+def test_out_of_range_times_are_null_and_durations_clipped_per_row():
+    res = history_frames(reservations(
+        ("2026-10-01", "A", "9", "11", "", ""),
+        ("2026-10-02", "A", "200", "11", "", ""),
+        ("2026-10-03", "A", "13", "10", "", ""),
+    ))["reservations"]
+    assert res["start_hour"].tolist()[1] is pd.NA
+    assert res["hours"].fillna(-1).tolist() == [2.0, -1, 0.0]
+
+
+def test_write_partitions_rewrites_only_changed_months(tmp_path):
+    df = reservations(("2026-10-01", "A", "9", "11", "a", ""), ("2026-11-01", "B", "9", "11", "", ""))
+    manifest = {}
+    write_partitions(str(tmp_path), history_frames(df), manifest)
+
+    df.loc[1, "facility"] = "C"
+    stats = write_partitions(str(tmp_path), history_frames(df), manifest)
+    assert stats["reservations"] == {"written": 1, "removed": 0, "kept": 1}
+    assert read_history(str(tmp_path), "reservations", columns=["facility"], months=[11])["facility"].tolist() == ["C"]
+    assert read_history(str(tmp_path), "reservations", columns=["date"], years=[2026])["date"].tolist() == [
+        date(2026, 10, 1), date(2026, 11, 1),
+    ]
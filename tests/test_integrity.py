@@ -0,0 +1,42 @@
+from conftest import reservation_row
+from integrity import check_row
+from sheets_common import RESERVATION_COLUMNS
+
+
+def issues(**values):
+    row = reservation_row("2026-11-01", "市民コート")
+    for col, value in values.items():
+        row[RESERVATION_COLUMNS.index(col)] = value
+    return [(i["kind"], i["column"], i["fix"]) for i in check_row(RESERVATION_COLUMNS, row)]
+
+
+def test_valid_row_has_no_issues():
+    assert issues() == []
+
+
+def test_empty_row_is_ignored():
+    assert check_row(RESERVATION_COLUMNS, [""] * len(RESERVATION_COLUMNS)) == []
+
+
+def test_date_format_is_fixed():
+    assert issues(date="2026/11/1") == [("date_format", "date", "2026-11-01")]
+
+
+def test_times_are_normalized_or_reset_to_default():
+    assert issues(start_hour="１０") == [("bad_time", "start_hour", "10")]
+    assert issues(end_minute="75") == [("bad_time", "end_minute", "0")]
+    assert issues(end_hour="abc") == [("bad_time", "end_hour", "11")]
+
+
+def test_status_alias_and_blank_status():
+    assert issues(status="当選") == [("unknown_status", "status", "確保")]
+    assert issues(status="") == [("unknown_status", "status", "確保")]
+    assert issues(status="???") == [("unknown_status", "status", None)]
+
+
+def test_duplicate_names_are_removed():
+    assert issues(participants="a; b;a;") == [("duplicate_names", "participants", "a;b")]
+
+
+def test_row_without_date_is_not_fixed_automatically():
+    assert issues(date="", start_hour="x") == [("blank_date", "date", None), ("bad_time", "start_hour", None)]
@@ -0,0 +1,14 @@
+from datetime import date
+
+from maintenance import find_past_open_rows
+
+
+def test_only_past_rows_with_open_status():
+    dates = ["2026-10-20", "2026-10-01", "", "2026-10-18", "2026-10-17", "not a date", "2026-10-19"]
+    statuses = ["確保", "確保", "確保", "中止", "抽選中", "確保", "確保"]
+    # シート上の行番号（ヘッダーが1行目）
+    assert find_past_open_rows(dates, statuses, date(2026, 10, 19)) == [3, 6]
+
+
+def test_rows_missing_status_cell_are_open():
+    assert find_past_open_rows(["2026-10-01", "2026-10-02"], ["完了"], date(2026, 10, 19)) == [3]
@@ -0,0 +1,103 @@
+import random
+
+import pytest
+
+from conftest import reservation_row
+from offline import WriteJournal, apply_changes, record_changes, replay_journal
+
+A = reservation_row("2026-11-01", "市民コート")
+B = reservation_row("2026-11-02", "中央公園")
+C = reservation_row("2026-11-03", "中央公園")
+
+
+def test_apply_changes_reproduces_recorded_rows():
+    old = [A, B]
+    new = [B, C, A]
+    rows, conflicts = apply_changes(old, record_changes(old, new))
+    assert rows == new
+    assert conflicts == []
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_apply_changes_round_trip_random(seed):
+    rng = random.Random(seed)
+    old = [rng.choice([A, B, C]) for _ in range(rng.randint(0, 6))]
+    new = [rng.choice([A, B, C]) for _ in range(rng.randint(0, 6))]
+    assert apply_changes(old, record_changes(old, new)) == (new, [])
+
+
+def test_update_of_row_changed_by_someone_else_conflicts():
+    changes = record_changes([A, B], [A, C])
+    edited = reservation_row("2026-11-02", "中央公園", status="中止")
+    rows, conflicts = apply_changes([A, edited], changes)
+    assert rows == [A, edited]
+    assert [c["op"] for c in conflicts] == ["update"]
+
+
+def test_delete_of_ambiguous_duplicate_conflicts_instead_of_guessing():
+    # 記録時の位置が別の内容になっていて、同じ内容の行が複数ある場合はどれを消すか決めない
+    changes = record_changes([B, A, A], [B, A])
+    rows, conflicts = apply_changes([A, A], changes)
+    assert rows == [A, A]
+    assert len(conflicts) == 1
+
+
+def test_replay_deletes_one_of_two_identical_rows(tmp_path, make_store):
+    store = make_store([A, A, B])
+    store.refresh()
+    journal = WriteJournal(str(tmp_path / "j.jsonl"))
+    journal.record([A, A, B], [A, B], store.version)
+
+    assert replay_journal(store, journal) == []
+    assert store.worksheet.rows[1:] == [A, B]
+    assert journal.pending() == []
+
+
+def test_replay_skips_records_already_in_changelog(tmp_path, make_store):
+    store = make_store([A, A, B])
+    store.refresh()
+    journal = WriteJournal(str(tmp_path / "j.jsonl"))
+    journal.record([A, A, B], [A, B], store.version)
+    records = journal.pending()
+
+    # シートに書き込んだ後、ジャーナルから取り除けなかった
+    def fail():
+        raise OSError("disk full")
+    try:
+        store.write_values([store.header, A, B], on_written=fail, journal_ids=[records[0]["id"]])
+    except OSError:
+        pass
+    assert journal.pending() == records
+
+    # もう一度反映しても、残っている A は消さない
+    assert replay_journal(store, journal) == []
+    assert store.worksheet.rows[1:] == [A, B]
+    assert journal.pending() == []
+
+
+def test_replay_inserts_duplicate_row(tmp_path, make_store):
+    # 同じ日時・施設のコート2面目の追加は、同じ内容の行がすでにあっても追加する
+    store = make_store([A, B])
+    store.refresh()
+    journal = WriteJournal(str(tmp_path / "j.jsonl"))
+    journal.record([A, B], [A, B, A], store.version)
+
+    assert replay_journal(store, journal) == []
+    assert store.worksheet.rows[1:] == [A, B, A]
+    # 反映済みの ID が changelog に残るので、もう一度反映しても増えない
+    journal.record([A, B], [A, B, A], store.version)
+    records = journal.pending()
+    store.write_values([store.header, A, B, A, A], journal_ids=[records[0]["id"]])
+    assert replay_journal(store, journal) == []
+    assert store.worksheet.rows[1:] == [A, B, A, A]
+
+
+def test_replay_returns_none_while_another_replay_runs(tmp_path, make_store):
+    store = make_store([A])
+    store.refresh()
+    journal = WriteJournal(str(tmp_path / "j.jsonl"))
+    journal.record([A], [A, B], store.version)
+    with journal.replay_lock() as locked:
+        assert locked
+        assert replay_journal(store, journal) is None
+    assert len(journal.pending()) == 1
@@ -0,0 +1,46 @@
+from datetime import date
+
+import pandas as pd
+
+from recurrence import iter_occurrences
+
+
+def rule(frequency, start, end=None, exceptions=()):
+    return pd.Series({"frequency": frequency, "start_date": start, "end_date": end, "exceptions": list(exceptions)})
+
+
+def test_weekly_starts_at_first_date_in_window():
+    days = list(iter_occurrences(rule("weekly", date(2026, 1, 5)), date(2026, 3, 1), date(2026, 3, 20)))
+    assert days == [date(2026, 3, 2), date(2026, 3, 9), date(2026, 3, 16)]
+
+
+def test_biweekly_keeps_phase_from_start_date():
+    days = list(iter_occurrences(rule("biweekly", date(2026, 1, 5)), date(2026, 1, 6), date(2026, 2, 10)))
+    assert days == [date(2026, 1, 19), date(2026, 2, 2)]
+
+
+def test_window_end_is_exclusive_and_end_date_inclusive():
+    r = rule("weekly", date(2026, 1, 5), end=date(2026, 1, 19))
+    assert list(iter_occurrences(r, date(2026, 1, 1), date(2026, 1, 12))) == [date(2026, 1, 5)]
+    assert list(iter_occurrences(r, date(2026, 1, 1), date(2026, 3, 1))) == [
+        date(2026, 1, 5), date(2026, 1, 12), date(2026, 1, 19),
+    ]
+
+
+def test_exceptions_are_skipped():
+    r = rule("weekly", date(2026, 1, 5), exceptions=[date(2026, 1, 12)])
+    assert list(iter_occurrences(r, date(2026, 1, 1), date(2026, 1, 20))) == [date(2026, 1, 5), date(2026, 1, 19)]
+
+
+def test_monthly_skips_months_without_the_day():
+    days = list(iter_occurrences(rule("monthly", date(2026, 1, 31)), date(2026, 1, 1), date(2026, 6, 1)))
+    assert days == [date(2026, 1, 31), date(2026, 3, 31), date(2026, 5, 31)]
+
+
+def test_rule_starting_after_window_yields_nothing():
+    assert list(iter_occurrences(rule("weekly", date(2026, 6, 1)), date(2026, 1, 1), date(2026, 2, 1))) == []
+
+
+def test_unknown_frequency_or_missing_start_yields_nothing():
+    assert list(iter_occurrences(rule("daily", date(2026, 1, 1)), date(2026, 1, 1), date(2026, 2, 1))) == []
+    assert list(iter_occurrences(rule("weekly", pd.NaT), date(2026, 1, 1), date(2026, 2, 1))) == []